@@ -0,0 +1,309 @@
+#!/usr/bin/python3
+
+import gzip
+import hashlib
+import json
+import os
+import platform
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+import synth
+
+# Benchmarks of the log parsers, on synthetic logs (see synth.py), so that
+# parser speed-ups can be measured and regressions caught on any Linux box.
+# Each case parses one generated log, in a fresh python process so that its
+# peak RSS is its own; only the parse itself is timed (not starting python or
+# importing numpy), and its output is thrown away, but counted: a case that
+# produces no rows (say, from a log synth.py got wrong) fails instead of
+# passing for a fast one. Every case is run --repeat times and the fastest run
+# is kept.
+#
+#   python3 bench.py [--size MB] [--cases a,b] [--save out.json] [--baseline out.json]
+#
+# --save writes the results to a file, and --baseline compares a run with
+# saved results, flagging any case whose MB/s dropped (or whose peak RSS grew)
+# by more than --tolerance. bench.py exits with status 1 if any case did.
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_dir = os.path.join(tempfile.gettempdir(), "bundler-bench")
+
+# Each case is a function that imports what it needs and returns the parse
+# function, which is what gets timed: it is called with the path of the log,
+# and returns how many rows (not counting any header) it produced.
+
+class Output:
+    """
+    Stands in for /dev/null, counting the lines written to it.
+    """
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, s):
+        self.lines += s.count(b"\n" if isinstance(s, bytes) else "\n")
+        return len(s)
+
+    def flush(self):
+        pass
+
+def nimbus(**kwargs):
+    from parse_outputs import ccp_fields, ccp_log_header, parse_nimbus_log
+    def run(path):
+        out = Output()
+        with open(path, 'rb') as f:
+            parse_nimbus_log(f, out, Output(), ccp_log_header, "sfq,nimbus,96,50", ccp_fields, 1, **kwargs)
+        return out.lines
+    return run
+
+def nimbus_decimate():
+    from parse_outputs import default_points
+    return nimbus(decimate='minmax', points=default_points)
+
+def nimbus_lines():
+    """
+    nimbus, parsed a line at a time (with parse_nimbus_columns off).
+    """
+    from parse_outputs import NimbusLogStream, ccp_fields, nimbus_block_size
+    def run(path):
+        out = Output()
+        stream = NimbusLogStream(out, "sfq,nimbus,96,50", ccp_fields, 1)
+        stream.st.columns = False
+        with open(path, 'rb') as f:
+            while True:
+                buf = f.read(nimbus_block_size)
+                if not buf:
+                    break
+                stream.feed(buf)
+        stream.finish(Output())
+        return out.lines
+    return run
+
+def mm_graph():
+    from parse_outputs import mm_aggs, parse_downlink_log, parse_port_aggs
+    def run(path):
+        out = Output()
+        with open(path, 'rb') as f:
+            parse_downlink_log(f, out, 100, parse_port_aggs(mm_aggs))
+        return out.lines - 1
+    return run
+
+def etg_columnize():
+    from parse_outputs import etg_cross_traffic_pattern
+    from columnize import columnize, parse_cross_traffic_pattern
+    prefix = "sch:sfq, bw:96, rtt:50, alg:nimbus, traffic:b=poisson_c=, seed:0 "
+    def run(path):
+        out = Output()
+        with open(path) as f:
+            columnize((prefix + l for l in f), out, parse_cross_traffic_pattern(etg_cross_traffic_pattern))
+        return out.lines - 1
+    return run
+
+def udping():
+    sys.path.insert(0, os.path.join(here, "cloud"))
+    from parse_udping import parse_udping
+    def run(path):
+        return sum(len(pings) for pings in parse_udping(path).values())
+    return run
+
+def script(name, *args):
+    """
+    A case that runs a script reading stdin and writing stdout (with a header).
+    """
+    def run(path):
+        argv, stdin, stdout = sys.argv, sys.stdin, sys.stdout
+        sys.argv = [name] + list(args)
+        out = Output()
+        try:
+            with open(path) as sys.stdin:
+                sys.stdout = out
+                runpy.run_path(os.path.join(here, name), run_name="__main__")
+        finally:
+            sys.argv, sys.stdin, sys.stdout = argv, stdin, stdout
+        return out.lines - 1
+    return lambda: run
+
+# name: (kind of log, case)
+cases = {
+    'nimbus': ('ccp', nimbus),
+    'nimbus-decimate': ('ccp', nimbus_decimate),
+    'nimbus-lines': ('ccp', nimbus_lines),
+    'mm-graph': ('downlink', mm_graph),
+    'columnize': ('etg', etg_columnize),
+    'categorize': ('fcts', script('categorize.py', '100', '1000', '10000')),
+    'translate-time': ('times', script('translate-time.py', 'time rtt port', '0')),
+    'udping': ('udping', udping),
+}
+
+def input_log(dirname, kind, size, seed, mix):
+    """
+    The path of a generated log, which is only generated if it isn't there.
+    """
+    mix = dict((k, v) for k, v in mix.items() if k in synth.mixes[kind])
+    tag = hashlib.blake2b(json.dumps([synth.version, mix], sort_keys=True).encode(), digest_size=4).hexdigest()
+    path = os.path.join(dirname, "{}-{}-{}-{}.log".format(kind, size, seed, tag))
+    if not os.path.exists(path):
+        print("generating {} ({:.1f} MB)".format(path, size / 1e6))
+        synth.generate(kind, path + ".part", size, seed, **mix)
+        os.replace(path + ".part", path)
+    return path
+
+def run_child(case, path):
+    """
+    Run one case in this process and print how long the parse took (this is
+    what the parent runs in a fresh process).
+    """
+    _, setup = cases[case]
+    try:
+        run = setup()
+    except ImportError as e:
+        print(json.dumps({'skipped': str(e)}))
+        return
+    start = time.perf_counter()
+    rows = run(path)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'rows': rows}))
+
+class Skipped(Exception):
+    pass
+
+def run_case(case, path):
+    """
+    Run case on path in a fresh process. Returns (seconds, peak RSS in bytes),
+    or raises Skipped if the case can't run here.
+    """
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", case, path], stdout=subprocess.PIPE, cwd=here)
+    out = proc.stdout.read().decode()
+    proc.stdout.close()
+    # wait4 rather than proc.wait, for the child's own resource usage
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise Exception("{} exited with {}".format(case, proc.returncode))
+    res = json.loads(out.strip().splitlines()[-1])
+    if 'skipped' in res:
+        raise Skipped(res['skipped'])
+    if res['rows'] <= 0:
+        raise Exception("{} produced no rows from {}".format(case, path))
+    # ru_maxrss is in KB on linux
+    return res['seconds'], usage.ru_maxrss * 1024
+
+def bench(names, dirname, size, seed, mix, repeat):
+    """
+    Returns {case: {'bytes', 'seconds', 'mb_s', 'rss_mb'}} (or {'skipped'}).
+    """
+    results = {}
+    for name in names:
+        kind, _ = cases[name]
+        path = input_log(dirname, kind, size, seed, mix)
+        nbytes = os.path.getsize(path)
+        if kind == 'udping':
+            # gzipped, so count what is parsed
+            with gzip.open(path, 'rb') as f:
+                nbytes = sum(len(buf) for buf in iter(lambda: f.read(1024 * 1024), b''))
+        try:
+            runs = [run_case(name, path) for _ in range(repeat)]
+        except Skipped as e:
+            print("{}: skipped ({})".format(name, e))
+            results[name] = {'skipped': str(e)}
+            continue
+        secs = min(s for s, _ in runs)
+        rss = max(r for _, r in runs)
+        results[name] = {
+            'bytes': nbytes,
+            'seconds': secs,
+            'mb_s': nbytes / 1e6 / secs if secs > 0 else 0,
+            'rss_mb': rss / 1e6,
+        }
+        print("{}: {:.1f} MB/s".format(name, results[name]['mb_s']))
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Table rows of results against baseline, and the cases that regressed.
+    """
+    lines = ["{:<16} {:>8} {:>9} {:>9} {:>10} {:>13} {:>8}".format("case", "MB", "time (s)", "MB/s", "RSS (MB)", "baseline MB/s", "change")]
+    regressed = []
+    for name, r in results.items():
+        if 'skipped' in r:
+            lines.append("{:<16} skipped: {}".format(name, r['skipped']))
+            continue
+        base = baseline.get(name) if baseline else None
+        change = ""
+        base_mb_s = ""
+        if base and 'mb_s' in base:
+            base_mb_s = "{:.1f}".format(base['mb_s'])
+            ratio = r['mb_s'] / base['mb_s'] - 1
+            change = "{:+.0%}".format(ratio)
+            if ratio < -tolerance:
+                regressed.append("{}: {:.1f} MB/s, was {:.1f}".format(name, r['mb_s'], base['mb_s']))
+            if r['rss_mb'] > base['rss_mb'] * (1 + tolerance):
+                regressed.append("{}: peak RSS {:.0f} MB, was {:.0f}".format(name, r['rss_mb'], base['rss_mb']))
+        lines.append("{:<16} {:>8.1f} {:>9.3f} {:>9.1f} {:>10.1f} {:>13} {:>8}".format(
+            name,
+            r['bytes'] / 1e6,
+            r['seconds'],
+            r['mb_s'],
+            r['rss_mb'],
+            base_mb_s,
+            change,
+        ))
+    return lines, regressed
+
+if __name__ == "__main__":
+    import argparse
+
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark the log parsers on synthetic logs")
+    parser.add_argument("--cases", default=",".join(cases), help="which cases to run, comma separated (default all: {})".format(", ".join(cases)))
+    parser.add_argument("--size", type=float, default=32, help="how big a log each case parses (MB)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated logs")
+    parser.add_argument("--mix", type=synth.parse_mix, default={}, help="line mix of the generated logs, k=v,... (see mixes in synth.py)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case, the fastest is kept")
+    parser.add_argument("--dir", default=default_dir, help="where the generated logs are kept (default {})".format(default_dir))
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="how much slower (or bigger) than the baseline a case can get before it is flagged (default 0.1, 10%%)")
+    args = parser.parse_args()
+
+    names = [c for c in args.cases.split(",") if c]
+    unknown = [c for c in names if c not in cases]
+    if unknown:
+        sys.exit("unknown case(s) {} (there are {})".format(", ".join(unknown), ", ".join(cases)))
+    for k in args.mix:
+        if not any(k in m for m in synth.mixes.values()):
+            sys.exit("no log has a {} to set in --mix".format(k))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        baseline = saved['cases']
+        if saved.get('size') != args.size or saved.get('mix', {}) != args.mix:
+            print("note: {} was run with --size {} --mix {}".format(args.baseline, saved.get('size'), saved.get('mix', {})))
+
+    os.makedirs(args.dir, exist_ok=True)
+    results = bench(names, args.dir, int(args.size * 1e6), args.seed, args.mix, args.repeat)
+    lines, regressed = compare(results, baseline, args.tolerance)
+    print()
+    print("\n".join(lines))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'cases': results,
+                'size': args.size,
+                'seed': args.seed,
+                'mix': args.mix,
+                'python': platform.python_version(),
+                'host': platform.node(),
+                'time': time.time(),
+            }, f, indent=2)
+    if regressed:
+        print()
+        print("{} regression(s) past {:.0%}:\n{}".format(len(regressed), args.tolerance, "\n".join(regressed)))
+        sys.exit(1)
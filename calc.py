@@ -2,9 +2,9 @@
 
 import sys
 import os
-import glob
 from tqdm import tqdm
 import re
+from compressed import find_logs, open_log
 
 
 # grep "rin" nimbus.out| awk '{print $9,$13,$15,$17,$21,$23}' | tr -d ','
@@ -30,12 +30,12 @@ def parse_ccp_log(f, grps):
     print(grps[3], grps[4], min_rate, max_rate, max_rate-min_rate)
 
 
-pattern = re.compile('fifo_(?P<bw>[\d]+)_(?P<delay>[\d]+)/nimbus.bundler_qlen=(?P<qlen>[\d]+).bundler_qlen_alpha=(?P<alpha>[\d]+).bundler_qlen_beta=(?P<beta>[\d]+)/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/ccp.log')
+pattern = re.compile('fifo_(?P<bw>[\d]+)_(?P<delay>[\d]+)/nimbus.bundler_qlen=(?P<qlen>[\d]+).bundler_qlen_alpha=(?P<alpha>[\d]+).bundler_qlen_beta=(?P<beta>[\d]+)/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/ccp.log(\.gz|\.zst)?$')
 def post_process_dir(d):
-    g = glob.glob(d + "/**/ccp.log", recursive=True)
+    g = find_logs(d, "ccp.log")
     for exp in g:
         exp_root = "/".join(exp.split("/")[:-1])
-        with open(exp) as f:
+        with open_log(exp, 'r') as f:
             matches = pattern.search(exp)
             grps = matches.groups()
             parse_ccp_log(f, grps)
@@ -1,6 +1,5 @@
 import os
 import agenda
-import time
 from util import *
 
 def get_ccp_alg_dir(config, alg):
@@ -70,13 +69,17 @@ def check_ccp_alg(config, node):
                     "node failed to build {}".format(alg)
                 )
 
-def start_ccp(config, inbox, alg):
+def start_ccp(config, inbox, alg, out=None):
+    """
+    out : where ccp logs to; by default ccp.log in the iteration directory,
+          which is then added to the iteration's outputs
+    """
     if config['args'].verbose:
         agenda.subtask("Starting ccp")
 
     ccp_binary = get_ccp_binary_path(config, alg['name'])
     ccp_binary_name = ccp_binary.split('/')[-1]
-    ccp_out = os.path.join(config['iteration_dir'], "ccp.log")
+    ccp_out = out or os.path.join(config['iteration_dir'], "ccp.log")
 
     alg_name = alg['name']
     args = list(config['ccp'][alg_name]['args'].items())
@@ -94,11 +97,10 @@ def start_ccp(config, inbox, alg):
         stderr=ccp_out,
     ), "Failed to start ccp")
 
-    if not config['args'].dry_run:
-        time.sleep(1)
-    inbox.check_proc(ccp_binary_name, ccp_out)
-    inbox.check_file('starting CCP', ccp_out)
+    inbox.check_proc(ccp_binary_name, ccp_out, timeout=startup_timeout)
+    inbox.check_file('starting CCP', ccp_out, timeout=startup_timeout)
 
-    config['iteration_outputs'].append((inbox, ccp_out))
+    if out is None:
+        config['iteration_outputs'].append((inbox, ccp_out))
 
     return ccp_out
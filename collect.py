@@ -0,0 +1,356 @@
+import agenda
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import stat
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import host_parse
+from compressed import is_compressed, suffixes
+from timing import adopt, current_span, span
+from util import expect, for_each_host, warn
+
+copy_buf_size = 4 * 1024 * 1024
+
+# how the logs that can get big (see compressed_logs) are compressed on their
+# hosts with --compress-logs, once the iteration is over; parse_outputs reads
+# them either way (see compressed.py)
+log_compressors = {
+    'gzip': "gzip -1 -f {}",
+    'zstd': "zstd -q -1 --rm -f {}",
+}
+compressed_logs = re.compile(r'^(ccp|inbox|outbox|downlink\d*)\.log$')
+
+def install_host_parser(conn):
+    """
+    Copy host_parse.py and the modules it needs to conn, installing numpy and
+    agenda there if they are missing. Returns whether the host can run it.
+    """
+    check = "python3 -c 'import numpy, agenda'"
+    if conn.run(check).exited and (conn.run("python3 -m pip install --user numpy agenda").exited or conn.run(check).exited):
+        return False
+    expect(conn.run("mkdir -p {}".format(host_parse.remote_dir)), "Failed to create {}".format(host_parse.remote_dir))
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in host_parse.modules:
+        conn.put(os.path.join(here, module), remote=os.path.join(host_parse.remote_dir, module))
+    return True
+
+# the logs host_parse.py parses
+host_parsed_logs = ['ccp.log', 'downlink.log']
+
+def parse_on_hosts(outputs, sample_rate, decimate, points, keep_raw=False):
+    """
+    Parse the ccp and mahimahi logs among outputs ((conn, remote file) pairs)
+    on their hosts with host_parse.py, all hosts at once. Returns outputs with
+    the parsed series in place of the logs (or as well as them, with
+    keep_raw). Logs a host fails to parse are left in outputs, to be parsed
+    locally as usual.
+    """
+    by_host = {}
+    for conn, fname in outputs:
+        if os.path.basename(fname) in host_parsed_logs and not conn.dry:
+            by_host.setdefault(conn.addr, (conn, []))[1].append(fname)
+    hosts = list(by_host.values())
+
+    def parse(host):
+        conn, fnames = host
+        # nice, so that a host that also takes part in the next iteration
+        # keeps up with it
+        return conn.run_batch(["nice -n 19 python3 host_parse.py {} '{}' {} {}".format(
+            sample_rate,
+            decimate or '',
+            points,
+            " ".join(fnames),
+        )], wd=host_parse.remote_dir)[0]
+
+    parsed = set()
+    added = []
+    for (conn, fnames), res in zip(hosts, for_each_host(hosts, parse, host=lambda host: host[0].addr)):
+        try:
+            if res.exited:
+                raise Exception(res.stderr.strip().splitlines()[-1] if res.stderr.strip() else "exited with {}".format(res.exited))
+            done = json.loads(res.stdout.strip().splitlines()[-1])
+        except Exception as e:
+            warn("could not parse logs on {}, collecting them to parse locally: {}".format(conn.addr, e), exit=False)
+            continue
+        parsed.update((conn.addr, fname) for fname in done['parsed'])
+        added.extend((conn, fname) for fname in done['outputs'])
+    return [(conn, fname) for conn, fname in outputs if keep_raw or (conn.addr, fname) not in parsed] + added
+
+def compress_logs(outputs, method):
+    """
+    Compress the big logs among outputs ((conn, remote file) pairs) in place
+    on their hosts, all hosts at once. Returns outputs with those files renamed
+    to their compressed names; any that couldn't be compressed are left as
+    they were.
+    """
+    by_host = {}
+    for conn, fname in outputs:
+        if compressed_logs.match(os.path.basename(fname)):
+            by_host.setdefault(conn.addr, (conn, []))[1].append(fname)
+    hosts = list(by_host.values())
+
+    def compress(host):
+        conn, fnames = host
+        # the logs of processes run with sudo belong to root
+        return conn.run_batch((log_compressors[method].format(fname) for fname in fnames), sudo=True)
+
+    renamed = {}
+    for (conn, fnames), results in zip(hosts, for_each_host(hosts, compress, host=lambda host: host[0].addr)):
+        for fname, res in zip(fnames, results):
+            if res.exited:
+                warn("could not compress {} on {}, collecting it as is: {}".format(fname, conn.addr, res.stderr.strip()), exit=False)
+            else:
+                renamed[(conn.addr, fname)] = fname + suffixes[method]
+    return [(conn, renamed.get((conn.addr, fname), fname)) for conn, fname in outputs]
+
+def staging_dir(remote_dir):
+    """
+    Where BackgroundCollector moves an iteration directory while collecting it.
+    """
+    return remote_dir.rstrip("/") + ".collecting"
+
+class Collector:
+    """
+    Fetches iteration outputs from the experiment hosts over SFTP, many files
+    (and hosts) at once. Every worker thread keeps its own SFTP session per host
+    open for the whole run, on top of the host's existing ssh connection, so
+    sessions are set up once rather than per file.
+
+    compress : gzip each file on its host first and inflate it locally while it
+               downloads (files that are already compressed are fetched as
+               they are)
+    """
+    def __init__(self, workers=8, compress=False):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.compress = compress
+        self.local = threading.local()
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def sftp(self, conn):
+        sessions = getattr(self.local, 'sessions', None)
+        if sessions is None:
+            sessions = self.local.sessions = {}
+        if id(conn) not in sessions:
+            sessions[id(conn)] = conn.client.open_sftp()
+            with self.lock:
+                self.sessions.append(sessions[id(conn)])
+        return sessions[id(conn)]
+
+    def fetch(self, conn, remote, local, parent=None):
+        """
+        Returns (bytes transferred, start time, end time).
+        """
+        adopt(parent)
+        with span('fetch', host=conn.addr, file=remote) as s:
+            res = self.fetch_file(conn, remote, local)
+            s.set(bytes=res[0])
+            return res
+
+    def fetch_file(self, conn, remote, local):
+        if remote.startswith("~/"):
+            remote = remote[2:]
+        compress = self.compress and not is_compressed(remote)
+        if conn.dry or conn.verbose:
+            print("[{}] sftp{} {}:{} -> localhost:{}".format(
+                conn.addr,
+                " (gzip)" if compress else "",
+                conn.addr,
+                remote,
+                local
+            ))
+        start = time.time()
+        if conn.dry:
+            return 0, start, start
+
+        sftp = self.sftp(conn)
+        if compress:
+            res = conn.run("gzip -1 -c {}".format(remote), stdout=remote + ".gz")
+            if res.exited:
+                conn.run("rm -f {}.gz".format(remote))
+                raise Exception("gzip exited with {}".format(res.exited))
+            nbytes = sftp.stat(remote + ".gz").st_size
+            with sftp.open(remote + ".gz", 'rb') as r:
+                r.prefetch(nbytes)
+                with gzip.GzipFile(fileobj=r) as z, open(local, 'wb') as out:
+                    shutil.copyfileobj(z, out, copy_buf_size)
+            conn.run("rm -f {}.gz".format(remote))
+        else:
+            sftp.get(remote, local)
+            nbytes = os.path.getsize(local)
+        os.chmod(local, stat.S_IMODE(sftp.stat(remote).st_mode))
+        return nbytes, start, time.time()
+
+    def collect(self, outputs, local_dir):
+        """
+        Download every (conn, remote file) in outputs into local_dir, and print
+        how many bytes came from each host and how long that took. Returns the
+        (remote file, exception) of every file that could not be fetched.
+        """
+        with span('collect', files=len(outputs)) as s:
+            failed, nbytes = self.collect_files(outputs, local_dir)
+            s.set(fetched=nbytes)
+            return failed
+
+    def collect_files(self, outputs, local_dir):
+        parent = current_span()
+        jobs = []
+        for conn, fname in outputs:
+            local = os.path.join(local_dir, os.path.basename(fname))
+            if conn.interact:
+                # every transfer waits for a key press, so keep them in order
+                job = Future()
+                try:
+                    job.set_result(self.serial_fetch(conn, fname, local))
+                except Exception as e:
+                    job.set_exception(e)
+            else:
+                job = self.pool.submit(self.fetch, conn, fname, local, parent)
+            jobs.append((conn, fname, job))
+
+        failed = []
+        stats = {}
+        for conn, fname, job in jobs:
+            try:
+                nbytes, start, end = job.result()
+            except Exception as e:
+                failed.append((fname, e))
+                continue
+            s = stats.setdefault(conn.addr, [0, 0, start, end])
+            s[0] += 1
+            s[1] += nbytes
+            s[2] = min(s[2], start)
+            s[3] = max(s[3], end)
+
+        for addr, (files, nbytes, start, end) in sorted(stats.items()):
+            secs = end - start
+            agenda.subtask("{}: {} file(s), {:.1f} MB in {:.1f}s ({:.1f} MB/s)".format(
+                addr,
+                files,
+                nbytes / 1e6,
+                secs,
+                nbytes / 1e6 / secs if secs > 0 else 0,
+            ))
+        return failed, sum(s[1] for s in stats.values())
+
+    def serial_fetch(self, conn, fname, local):
+        start = time.time()
+        if fname.startswith("~/"):
+            fname = fname[2:]
+        conn.get(fname, local=local)
+        return (os.path.getsize(local) if os.path.exists(local) else 0), start, time.time()
+
+    def close(self):
+        self.pool.shutdown()
+        for s in self.sessions:
+            s.close()
+
+def unstage(remote_dir, conns):
+    """
+    Move remote_dir back from its staging name on each of conns, unless
+    something already took its place.
+    """
+    staging = staging_dir(remote_dir)
+    for conn in conns:
+        conn.run("[ ! -e {dst} ] && mv {staging} {dst}".format(dst=remote_dir, staging=staging))
+
+class BackgroundCollector:
+    """
+    Runs a Collector on its own thread, so that the next experiment can start
+    while the previous one's results download. At most queue_size iterations
+    wait to be collected; past that, submit blocks until one is done.
+
+    Each submitted iteration directory is first moved to a staging name on its
+    hosts, so nothing the next iteration does can touch it, and moved back once
+    it has been downloaded.
+    """
+    def __init__(self, collector, queue_size=2):
+        self.collector = collector
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.failed = []
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def hosts(self, outputs):
+        return list(dict((conn.addr, conn) for conn, _ in outputs).values())
+
+    def stage(self, remote_dir, outputs):
+        """
+        Move remote_dir to its staging name on every host in outputs, and
+        return outputs with their paths pointing there.
+        """
+        staging = staging_dir(remote_dir)
+        moved = set()
+        for conn in self.hosts(outputs):
+            # if the staging name is taken (say, by a run that died mid
+            # collection), just collect from where the files are
+            res = conn.run("[ ! -e {staging} ] && mv {src} {staging}".format(src=remote_dir, staging=staging))
+            if not res.exited:
+                moved.add(conn.addr)
+        return [
+            (conn, staging + fname[len(remote_dir):] if conn.addr in moved and fname.startswith(remote_dir) else fname)
+            for conn, fname in outputs
+        ]
+
+    def unstage(self, remote_dir, outputs):
+        unstage(remote_dir, self.hosts(outputs))
+
+    def unstaged(self, remote_dir, outputs):
+        """
+        outputs with their paths pointing back out of the staging directory.
+        """
+        staging = staging_dir(remote_dir)
+        return [(conn, remote_dir + fname[len(staging):] if fname.startswith(staging) else fname) for conn, fname in outputs]
+
+    def submit(self, name, remote_dir, outputs, local_dir, process=None, done=None):
+        """
+        Queue outputs up for collection. process, if given, is called with the
+        (staged) outputs on the collector's thread first, and returns the
+        outputs to collect instead, so that post-processing them on their
+        hosts (see parse_on_hosts) doesn't hold up the next iteration. done,
+        if given, is called once it is over with the outputs that were
+        collected (at their usual paths) and the (remote file, exception) of
+        every file that failed.
+        """
+        self.queue.put((name, remote_dir, self.stage(remote_dir, outputs), local_dir, process, done, current_span()))
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            name, remote_dir, staged, local_dir, process, done, parent = job
+            # the collection shows up in the trace under the iteration it is of
+            adopt(parent)
+            outputs = staged
+            # anything raised here would kill the thread and leave submit
+            # blocked forever, so it all ends up in the summary instead
+            try:
+                if process:
+                    outputs = process(staged)
+                agenda.subtask("collecting results of {}".format(name))
+                failed = self.collector.collect(outputs, local_dir)
+                self.unstage(remote_dir, staged)
+            except Exception as e:
+                failed = [(fname, e) for _, fname in outputs]
+            self.failed.extend((name, fname, e) for fname, e in failed)
+            if done:
+                try:
+                    done(self.unstaged(remote_dir, outputs), failed)
+                except Exception as e:
+                    self.failed.append((name, remote_dir, e))
+
+    def finish(self):
+        """
+        Wait for everything submitted to be collected. Returns the
+        (iteration, remote file, exception) of every file that failed.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        return self.failed
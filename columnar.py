@@ -0,0 +1,129 @@
+import os
+import shutil
+
+# Optional columnar (Arrow) output for the parsed experiment data. pyarrow is
+# only needed when --format=parquet is asked for, so it is imported lazily and
+# callers check available() first.
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.dataset as pads
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+formats = ['csv', 'parquet']
+
+def available():
+    return pa is not None
+
+def unique_names(names):
+    """
+    Rename repeated column names the way R's read.csv does (rtt, rtt.1, ...).
+    """
+    seen = {}
+    out = []
+    for n in names:
+        if n in seen:
+            seen[n] += 1
+            n = f"{n}.{seen[n]}"
+        else:
+            seen[n] = 0
+        out.append(n)
+    return out
+
+def header_names(fname, delimiter):
+    with open(fname) as f:
+        return unique_names(f.readline().strip().split(delimiter))
+
+def column_types(names, key_columns, value_columns):
+    types = dict((names[c], pa.dictionary(pa.int32(), pa.string())) for c in key_columns)
+    types.update((names[c], pa.float64()) for c in value_columns)
+    return types
+
+def text_table_schema(fname, delimiter, key_columns=(), value_columns=()):
+    """
+    The schema read_text_table gives fname, from its header alone. Every column
+    has to be a key or a value column.
+    """
+    names = header_names(fname, delimiter)
+    types = column_types(names, key_columns, value_columns)
+    return pa.schema([(n, types[n]) for n in names])
+
+def union_schema(schemas):
+    """
+    A schema with every column of schemas, each where it first shows up.
+    """
+    return pa.unify_schemas(list(schemas))
+
+def conform(table, schema):
+    """
+    table with exactly the columns of schema, in its order; columns table
+    doesn't have are all null.
+    """
+    return pa.table([
+        table[f.name].cast(f.type) if f.name in table.column_names else pa.nulls(len(table), f.type)
+        for f in schema
+    ], schema=schema)
+
+def read_text_table(fname, delimiter, key_columns=(), value_columns=(), null_values=("",)):
+    """
+    Read one of our csv/space separated outputs. key_columns (positions of the
+    experiment setup columns repeated on every row) are dictionary encoded, and
+    value_columns are forced to floats so that files where a column happens to
+    be empty still share a schema.
+    """
+    names = header_names(fname, delimiter)
+    types = column_types(names, key_columns, value_columns)
+    return pacsv.read_csv(
+        fname,
+        read_options=pacsv.ReadOptions(column_names=names, skip_rows=1),
+        parse_options=pacsv.ParseOptions(delimiter=delimiter),
+        convert_options=pacsv.ConvertOptions(
+            column_types=types,
+            null_values=list(null_values),
+            strings_can_be_null=True,
+        ),
+    )
+
+def replace_path(tmp, path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+def write_feather(table, fname):
+    tmp = fname + ".tmp"
+    feather.write_feather(table, tmp)
+    os.replace(tmp, fname)
+
+def write_parquet(table, fname):
+    tmp = fname + ".tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, fname)
+
+def write_partitioned(tables, out_dir, partition_cols, schema=None):
+    """
+    Write tables (an iterable, consumed one at a time) as a single parquet
+    dataset under out_dir, hive-partitioned by partition_cols, so that it can be
+    opened as one table with arrow::open_dataset. That takes its schema from
+    one of the files, so tables whose columns differ need a schema covering
+    all of them, which every one of them is written with (see conform).
+    """
+    tmp = out_dir + ".tmp"
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    for i, table in enumerate(tables):
+        if schema is not None:
+            table = conform(table, schema)
+        pads.write_dataset(
+            table,
+            tmp,
+            format="parquet",
+            partitioning=partition_cols,
+            partitioning_flavor="hive",
+            basename_template=f"part-{i}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+    os.makedirs(tmp, exist_ok=True)
+    replace_path(tmp, out_dir)
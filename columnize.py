@@ -1,18 +1,49 @@
 #!/usr/bin/python3
 
+from bisect import bisect_right
 import sys
 
 delim = ":"
-cross_traffic_pattern = []
-if len(sys.argv) > 1:
-    for cross in sys.argv[1].split(","):
+
+def parse_cross_traffic_pattern(pattern):
+    """
+    "0:60=empty1,60:120=iperfc1" -> [(0, 60000, 'empty1'), (60000, 120000, 'iperfc1')]
+    """
+    cross_traffic_pattern = []
+    for cross in pattern.split(","):
         tr, name = cross.split("=")
         start,end = [int(x)*1000 for x in tr.split(":")]
         cross_traffic_pattern.append((start,end,name))
-    print_head = eval(sys.argv[2])
-else:
-    print_head = True
+    return cross_traffic_pattern
+
+class CrossTrafficIndex:
+    """
+    Finds the first window of a cross traffic pattern that a request falls
+    entirely within. Windows are kept sorted by start so a lookup is a bisect;
+    patterns whose windows overlap fall back to checking them in order.
+    """
+    def __init__(self, cross_traffic_pattern):
+        self.pattern = cross_traffic_pattern
+        self.order = sorted(range(len(cross_traffic_pattern)), key=lambda k: cross_traffic_pattern[k][0])
+        self.windows = [cross_traffic_pattern[k] for k in self.order]
+        self.starts = [w[0] for w in self.windows]
+        self.disjoint = all(a[1] <= b[0] for a, b in zip(self.windows, self.windows[1:]))
 
+    def label(self, start, end):
+        if not self.disjoint:
+            for (cross_start, cross_end, cross_name) in self.pattern:
+                if start >= cross_start and end <= cross_end:
+                    return cross_name
+            return "none"
+        # every window before k also starts before start; since they are
+        # disjoint, only a trailing run of them can also end after end
+        k = bisect_right(self.starts, start) - 1
+        best = None
+        while k >= 0 and self.windows[k][1] >= end:
+            if best is None or self.order[k] < self.order[best]:
+                best = k
+            k -= 1
+        return self.windows[best][2] if best is not None else "none"
 
 def flds(line):
     for f in line:
@@ -23,42 +54,62 @@ def flds(line):
             print('line', line, sp, file=sys.stderr)
             raise Exception()
 
-head = None
-start_time_col = None
-duration_col = None
-init_time = None
+def columnize(lines, out, cross_traffic_pattern=[], print_head=True):
+    """
+    Turn etg's "Field:value, ..." request log lines into space separated
+    columns written to out. Start and finish times are made relative to the
+    first request, and, given a cross_traffic_pattern, each request is labelled
+    with the first cross traffic window it ran entirely within (or "none").
+    The schema is taken from the first line; every other line must match it.
+    """
+    head = None
+    start_time_col = None
+    duration_col = None
+    init_time = None
+    index = CrossTrafficIndex(cross_traffic_pattern)
 
-for line in sys.stdin:
-    sp = line.strip().split()
-    if head is None:
-        fields, vals = zip(*flds(sp))
-        head = fields
-        for idx,field in enumerate(head):
-            if field == "StartTime(ms)":
-                start_time_col = idx
-            if field == "Duration(usec)":
-                duration_col = idx
-        if print_head:
-            actual_head = head
-            if cross_traffic_pattern:
-                actual_head = head + ("start","finish","during",)
-            print(" ".join(actual_head))
-    else:
-        fields, vals = zip(*flds(sp))
-        if head == fields:
+    for line in lines:
+        sp = line.strip().split()
+        if head is None:
+            fields, vals = zip(*flds(sp))
+            head = list(fields)
+            for idx,field in enumerate(head):
+                if field == "StartTime(ms)":
+                    start_time_col = idx
+                if field == "Duration(usec)":
+                    duration_col = idx
+            if print_head:
+                actual_head = head
+                if cross_traffic_pattern:
+                    actual_head = head + ["start","finish","during"]
+                out.write(" ".join(actual_head) + "\n")
+        else:
+            pairs = [f.partition(delim) for f in sp]
+            if not all(p[1] for p in pairs):
+                # let flds report the malformed field
+                list(flds(sp))
+            if [p[0] for p in pairs] != head:
+                raise ValueError("non-standard schema")
+            vals = [p[2].split(delim, 1)[0].split(",", 1)[0] for p in pairs]
             real_start = int(vals[start_time_col])
             duration = int(int(vals[duration_col]) / 1000)
             if not init_time:
                 init_time = real_start
             start = real_start - init_time
             end = start + duration
-            during = "none"
-            for (cross_start, cross_end, cross_name) in cross_traffic_pattern:
-                if start >= cross_start and end <= cross_end:
-                    during = cross_name
-                    break
-            vals = vals + (str(start),str(end), during)#(during, )
-            print(" ".join(vals))
-        else:
-            sys.stderr.write("non-standard schema")
-            sys.exit(1)
+            vals.extend((str(start), str(end), index.label(start, end)))
+            out.write(" ".join(vals) + "\n")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        cross_traffic_pattern = parse_cross_traffic_pattern(sys.argv[1])
+        print_head = eval(sys.argv[2])
+    else:
+        cross_traffic_pattern = []
+        print_head = True
+
+    try:
+        columnize(sys.stdin, sys.stdout, cross_traffic_pattern, print_head)
+    except ValueError:
+        sys.stderr.write("non-standard schema")
+        sys.exit(1)
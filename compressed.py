@@ -0,0 +1,92 @@
+import glob
+import gzip
+import io
+import shutil
+import subprocess
+
+# Logs can be compressed on the host that wrote them before they are collected
+# (see --compress-logs in eval.py), so an iteration's ccp.log may show up
+# locally as ccp.log.gz or ccp.log.zst. These helpers find and open a log
+# whichever form it is in. gzip is in the standard library; zstd uses the
+# zstandard module if it is installed, and the zstd command if it isn't.
+
+suffixes = {'gzip': '.gz', 'zstd': '.zst'}
+
+def log_name(path):
+    """
+    path without its compression suffix, if it has one
+    """
+    for s in suffixes.values():
+        if path.endswith(s):
+            return path[:-len(s)]
+    return path
+
+def is_compressed(path):
+    return log_name(path) != path
+
+def find_logs(dirname, name):
+    """
+    Every log called name under dirname, compressed or not. If a directory has
+    more than one version of a log, the uncompressed one is used.
+    """
+    found = {}
+    for s in [''] + list(suffixes.values()):
+        for path in glob.glob(dirname + "/**/" + name + s, recursive=True):
+            found.setdefault(log_name(path), path)
+    return list(found.values())
+
+class PipeReader(io.RawIOBase):
+    """
+    The stdout of cmd, as a (raw) file. Closing it after reading everything
+    raises if cmd failed, so a truncated or corrupt file isn't mistaken for a
+    short one.
+    """
+    def __init__(self, cmd):
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.proc.stdout.readinto(b)
+        if n == 0:
+            self.eof = True
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        if not self.eof:
+            # stopped reading early, nothing to check
+            self.proc.kill()
+        self.proc.stdout.close()
+        err = self.proc.stderr.read().decode(errors='replace').strip()
+        self.proc.stderr.close()
+        if self.proc.wait() != 0 and self.eof:
+            raise OSError("{} failed: {}".format(" ".join(self.proc.args), err))
+
+def open_zstd(path):
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+    if zstandard is not None:
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    if shutil.which('zstd') is None:
+        raise OSError("reading {} needs the zstandard module (pip3 install zstandard) or the zstd command".format(path))
+    return io.BufferedReader(PipeReader(['zstd', '-d', '-c', '-q', '--', path]))
+
+def open_log(path, mode='rb'):
+    """
+    Open a log for reading ('rb' or 'r'), decompressing it as it is read if it
+    is compressed. Compressed logs can't always be seeked in (check seekable()).
+    """
+    if path.endswith(suffixes['gzip']):
+        f = gzip.open(path, 'rb')
+    elif path.endswith(suffixes['zstd']):
+        f = open_zstd(path)
+    else:
+        return open(path, mode)
+    return f if mode == 'rb' else io.TextIOWrapper(f)
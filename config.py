@@ -1,10 +1,7 @@
-from collections import namedtuple
 import agenda
-import itertools
-import random
+import copy
 import toml
 import os
-import sys
 from util import *
 
 def read_config(args):
@@ -31,32 +28,26 @@ def read_config(args):
 
 def check_config(config):
     agenda.task("Checking config file")
-    topology = config['topology']
-    if 'cloudlab' not in topology:
-        nodes = ['sender', 'inbox', 'outbox', 'receiver']
-        for node in nodes:
-            assert node in topology, "Missing key topology.{}".format(node)
-            assert 'name' in topology[node], "topology.{} is missing 'name' key".format(node)
-            assert 'ifaces' in topology[node], "topology.{} is missing 'ifaces' key".format(node)
-            assert len(topology[node]['ifaces']) > 0, "topology.{} must have at least 1 interface".format(node)
-            for i,iface in enumerate(topology[node]['ifaces']):
-                assert 'dev' in iface, "topology.{} iface {} is missing 'dev' key".format(node, i)
-                assert 'addr' in iface, "topology.{} iface {} is missing 'addr' key".format(node, i)
-        assert len(topology['inbox']['ifaces']) > 1, "topology.inbox must have at least 2 interaces"
-
-        assert 'listen_port' in topology['inbox'], "topology.inbox must define listen_port"
-
-        num_self = 0
-        for node in topology:
-            if 'self' in topology[node] and topology[node]['self']:
-                num_self += 1
-        assert num_self > 0, "One node in topology section must be labeled with \"self = true\""
-        assert num_self == 1, "Only one node in topology section can be labeled self"
+    if isinstance(config['topology'], list):
+        assert len(config['topology']) > 0, "must specify at least one topology"
+        for topology in config['topology']:
+            check_topology(topology)
+        # each testbed kills its leftover experiment processes by name on all
+        # of its hosts, which would kill another testbed's on a shared one.
+        # This machine is the one labeled self (whatever its name), and runs
+        # all of a netns testbed.
+        seen = set()
+        for t in config['topology']:
+            hosts = set()
+            for node in t:
+                if node == 'netns' or (isinstance(t[node], dict) and t[node].get('self')):
+                    hosts.add('self')
+                elif isinstance(t[node], dict) and 'name' in t[node]:
+                    hosts.add(t[node]['name'])
+            assert not (hosts & seen), "testbeds can't share machines (including this one, labeled self or running a netns testbed)"
+            seen |= hosts
     else:
-        assert 'listen_port' in topology['inbox'], "topology.inbox must define listen_port"
-        nodes = ['sender', 'outbox', 'receiver']
-        for node in nodes:
-            assert node not in topology, "Don't use key topology.{} with cloudlab; it will be auto-populated".format(node)
+        check_topology(config['topology'])
 
     for k in config['sysctl']:
         v = config['sysctl'][k]
@@ -110,40 +101,48 @@ def check_config(config):
                     assert t['port'], "{} missing 'port (int)'".format(traffic_type)
                     assert t['rate'], "{} missing 'rate (int)'".format(traffic_type)
 
-def flatten(exps, dim):
-    def f(dct):
-        xs = [(k, dct[k]) for k in dct]
-        expl = [(a,b) for a,b in xs if type(b) == type([])]
-        done = [(a,b) for a,b in xs if type(b) != type([])]
-        if len(expl) > 0:
-            ks, bs = zip(*expl)
-        else:
-            ks, bs = ([], [])
-        bs = list(itertools.product(*bs))
-        expl = [dict(done + list(zip(ks, b))) for b in bs]
-        return expl
+def check_topology(topology):
+    if 'netns' in topology:
+        assert 'inbox' in topology and 'listen_port' in topology['inbox'], "topology.inbox must define listen_port"
+        for node in ['sender', 'outbox', 'receiver']:
+            assert node not in topology, "Don't use key topology.{} with netns; it will be auto-populated".format(node)
+    elif 'cloudlab' not in topology:
+        nodes = ['sender', 'inbox', 'outbox', 'receiver']
+        for node in nodes:
+            assert node in topology, "Missing key topology.{}".format(node)
+            assert 'name' in topology[node], "topology.{} is missing 'name' key".format(node)
+            assert 'ifaces' in topology[node], "topology.{} is missing 'ifaces' key".format(node)
+            assert len(topology[node]['ifaces']) > 0, "topology.{} must have at least 1 interface".format(node)
+            for i,iface in enumerate(topology[node]['ifaces']):
+                assert 'dev' in iface, "topology.{} iface {} is missing 'dev' key".format(node, i)
+                assert 'addr' in iface, "topology.{} iface {} is missing 'addr' key".format(node, i)
+        assert len(topology['inbox']['ifaces']) > 1, "topology.inbox must have at least 2 interaces"
+
+        assert 'listen_port' in topology['inbox'], "topology.inbox must define listen_port"
 
-    for e in exps:
-        es = f(e[dim])
-        for a in es:
-            n = e
-            n[dim] = a
-            yield n
+        num_self = 0
+        for node in topology:
+            if 'self' in topology[node] and topology[node]['self']:
+                num_self += 1
+        assert num_self > 0, "One node in topology section must be labeled with \"self = true\""
+        assert num_self == 1, "Only one node in topology section can be labeled self"
+    else:
+        assert 'listen_port' in topology['inbox'], "topology.inbox must define listen_port"
+        nodes = ['sender', 'outbox', 'receiver']
+        for node in nodes:
+            assert node not in topology, "Don't use key topology.{} with cloudlab; it will be auto-populated".format(node)
 
-def enumerate_experiments(config):
-    agenda.section("Starting experiments")
-    exp_args = config['experiment']
-    axes = list(exp_args.values())
-    ps = list(itertools.product(*axes))
-    exps = [dict(zip(exp_args.keys(), p)) for p in ps]
-    Experiment = namedtuple("Experiment", exp_args.keys())
-    exps = [Experiment(**x) for x in flatten(exps, 'alg')]
-    def skip_condition(_exp):
-        return \
-            (_exp.alg['name'] == 'nimbus' and _exp.sch == 'fifo') or\
-            (_exp.alg['name'] == 'nobundler' and _exp.sch != 'fifo')
-    #filtered_exps = [e for e in exps if not skip_condition(e)]
-    random.shuffle(exps)
-    return exps
-    #random.shuffle(filtered_exps)
-    #return filtered_exps
+def testbed_configs(config):
+    """
+    A config for each testbed the sweep can run on: [topology] declares one,
+    [[topology]] (repeated) declares several identical ones. They are named
+    testbed0, testbed1, ..., or None when there is only one.
+    """
+    topologies = config['topology'] if isinstance(config['topology'], list) else [config['topology']]
+    testbeds = []
+    for i, topology in enumerate(topologies):
+        c = dict(config)
+        c['topology'] = copy.deepcopy(topology)
+        c['testbed'] = "testbed{}".format(i) if len(topologies) > 1 else None
+        testbeds.append(c)
+    return testbeds
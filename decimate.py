@@ -0,0 +1,144 @@
+import numpy as np
+
+# Extrema-preserving decimation for the plotted time series. Rows (one per
+# sample, x in column x_col) are pushed in chunks as they are parsed and put
+# into fixed-width buckets along x; only a few representative rows per bucket
+# come back out, so a series can be capped at a target number of points
+# without losing its peaks:
+#
+# - minmax keeps, for every bucket, the rows holding each series' minimum and
+#   maximum.
+# - lttb (largest triangle three buckets) keeps the first and last rows, and
+#   one row per bucket: the one that forms the largest triangle with the row
+#   kept from the previous bucket and the mean of the next one.
+#
+# NaN values are ignored when picking rows.
+
+modes = ['minmax', 'lttb']
+
+def bucket_width(mode, span, num_series, points):
+    """
+    Bucket width that keeps at most about points rows of a series spanning
+    span along x.
+    """
+    if mode == 'minmax':
+        buckets = max(1, points // (2 * num_series))
+    else:
+        buckets = max(1, points - 2)
+    return span / buckets
+
+class Decimator:
+    def __init__(self, mode, width, x_col, y_cols):
+        assert mode in modes, f"unknown decimation {mode}"
+        self.mode = mode
+        self.width = width
+        self.x_col = x_col
+        self.y_cols = list(y_cols)
+        self.x0 = None
+        self.last_bucket = -np.inf
+        self.pending = None
+        # lttb: the row kept from the previous bucket, and a scale per series
+        self.prev = None
+        self.scale = np.zeros(len(self.y_cols))
+
+    def buckets(self, x):
+        if self.x0 is None:
+            finite = x[np.isfinite(x)]
+            if len(finite) == 0:
+                return np.full(len(x), self.last_bucket)
+            self.x0 = finite[0]
+        with np.errstate(invalid='ignore'):
+            b = np.floor((x - self.x0) / self.width)
+        b = np.where(np.isnan(b), -np.inf, b)
+        # x should only ever grow, but never let a bucket be reopened
+        b = np.maximum.accumulate(np.maximum(b, self.last_bucket))
+        self.last_bucket = b[-1]
+        return b
+
+    def push(self, rows, final=False):
+        """
+        Add rows (a 2d array, in x order) and return the rows kept out of the
+        buckets that can be decided on so far. The trailing bucket(s) are held
+        back until a later push, or until final is set.
+        """
+        bid = self.buckets(rows[:, self.x_col]) if len(rows) else np.empty(0)
+        if self.pending is not None:
+            rows = np.vstack((self.pending, rows))
+            bid = np.concatenate((self.pending_bid, bid))
+            self.pending = None
+        if len(rows) == 0:
+            return rows
+
+        starts = np.flatnonzero(np.concatenate(([True], bid[1:] != bid[:-1])))
+        # the last bucket may still grow, and lttb also needs the complete
+        # bucket after the one it decides on
+        hold = 0 if final else (1 if self.mode == 'minmax' else 2)
+        decide = max(0, len(starts) - hold)
+        if decide < len(starts):
+            self.pending, self.pending_bid = rows[starts[decide]:], bid[starts[decide]:]
+        if decide == 0:
+            return rows[:0]
+
+        if self.mode == 'minmax':
+            end = starts[decide] if decide < len(starts) else len(rows)
+            return rows[:end][self.minmax(rows[:end], starts[:decide])]
+        return rows[self.lttb(rows, starts, decide, final)]
+
+    def flush(self):
+        """
+        Rows kept from whatever is still held back, at the end of the series.
+        """
+        if self.pending is None:
+            return None
+        return self.push(self.pending[:0], final=True)
+
+    def minmax(self, rows, starts):
+        lens = np.diff(np.append(starts, len(rows)))
+        bucket = np.repeat(np.arange(len(starts)), lens)
+        keep = np.zeros(len(rows), dtype=bool)
+        for c in self.y_cols:
+            v = rows[:, c]
+            for reduce in (np.fmin, np.fmax):
+                ext = np.repeat(reduce.reduceat(v, starts), lens)
+                hit = np.flatnonzero(v == ext)
+                # the first row holding the extremum in each bucket (none at
+                # all if the series is NaN throughout)
+                _, first = np.unique(bucket[hit], return_index=True)
+                keep[hit[first]] = True
+        # a bucket where every value was NaN still gets its first row
+        empty = ~np.logical_or.reduceat(keep, starts)
+        keep[starts[empty]] = True
+        return keep
+
+    def lttb(self, rows, starts, decide, final):
+        x = rows[:, self.x_col]
+        ys = np.nan_to_num(rows[:, self.y_cols], nan=0.0, posinf=0.0, neginf=0.0)
+        # areas are summed across series, each relative to its own magnitude
+        self.scale = np.maximum(self.scale, np.abs(ys).max(axis=0))
+        scale = np.where(self.scale > 0, self.scale, 1)
+        ends = np.append(starts[1:], len(rows))
+        out = []
+        for k in range(decide):
+            s, e = starts[k], ends[k]
+            if self.prev is None:
+                # the series' first row is always kept, besides its bucket's
+                self.prev = (x[s], ys[s])
+                out.append(s)
+                s += 1
+            last = final and k == len(starts) - 1
+            if last:
+                # and so is its last, which the last bucket is weighed against
+                e -= 1
+                cx, cy = x[e], ys[e]
+            elif k + 1 < len(starts):
+                cx = x[starts[k + 1]:ends[k + 1]].mean()
+                cy = ys[starts[k + 1]:ends[k + 1]].mean(axis=0)
+            if s < e:
+                ax, ay = self.prev
+                area = np.abs((ax - cx) * (ys[s:e] - ay) - (ax - x[s:e, None]) * (cy - ay)) / scale
+                j = s + int(np.argmax(area.sum(axis=1)))
+                self.prev = (x[j], ys[j])
+                out.append(j)
+            if last and (not out or out[-1] != e):
+                out.append(e)
+        return out
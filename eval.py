@@ -2,17 +2,25 @@ import sys
 import argparse
 import agenda
 import os.path
-from collections import namedtuple
 import time
 import logging
-import io
 import subprocess
 import getpass
+import random
+import threading
 
 from cloudlab.cloudlab import make_cloudlab_topology
 from ccp import *
-from config import read_config, enumerate_experiments
-from parse_outputs import parse_outputs
+from collect import BackgroundCollector, Collector, compress_logs, install_host_parser, log_compressors, parse_on_hosts, staging_dir, unstage
+from config import read_config, testbed_configs
+from decimate import modes as decimate_modes
+from inbox_session import InboxSession
+from journal import COLLECTED, RAN, Journal
+from live import LiveCcpLog
+from netns import make_netns_topology
+from parse_outputs import default_points, parse_outputs
+from sweep import Sweep, orders
+from timing import open_trace, span, summary
 from traffic import *
 from topology import *
 from util import *
@@ -36,7 +44,7 @@ parser.add_argument('--headless', action='store_true', dest='headless',
 parser.add_argument('--overwrite-existing', action='store_true', dest='overwrite_existing',
         help="if supplied, if results already exist for a given experiment, the experiment will be re-run and results overwritten, be careful when supplying this!")
 parser.add_argument('--skip-existing', action='store_true', dest='skip_existing',
-        help="if supplied, if results already exist for a given experiment, that experiment will be skipped and results preserved, good for finishing an incomplete experiment")
+        help="if supplied, if results already exist for a given experiment, that experiment will be skipped and results preserved, good for finishing an incomplete experiment (experiments the journal shows were cut short are picked up where they stopped: re-collected if they ran, re-run otherwise)")
 parser.add_argument('--tcpprobe', action='store_true', dest='tcpprobe',
         help="if supplied, run tcpprobe at the sender")
 parser.add_argument('--tcpdump', action='store_true', dest='tcpdump',
@@ -44,7 +52,35 @@ parser.add_argument('--tcpdump', action='store_true', dest='tcpdump',
 parser.add_argument('--rows', type=str, help="rows to split graph upon", default='')
 parser.add_argument('--cols', type=str, help="cols to split graph upon", default='')
 parser.add_argument('--downsample', type=int, default=1, help="how much to downsample measurements")
+parser.add_argument('--decimate', type=str, choices=decimate_modes, help="reduce each plotted series to about --points points while keeping its peaks")
+parser.add_argument('--points', type=int, default=default_points, help="about how many points to keep per series with --decimate")
 parser.add_argument('--name', type=str, help="name of experiment directory", required=True)
+parser.add_argument('--collect-workers', type=int, default=8, dest='collect_workers',
+        help="how many result files to download at once")
+parser.add_argument('--compress-collect', action='store_true', dest='compress_collect',
+        help="if supplied, gzip result files on the remote hosts before downloading them")
+parser.add_argument('--compress-logs', type=str, choices=list(log_compressors), dest='compress_logs',
+        help="compress the ccp, inbox, outbox and mahimahi logs on their hosts once each iteration is over, and collect and keep them compressed (parse_outputs.py reads them as they are)")
+parser.add_argument('--parse-on-host', action='store_true', dest='parse_on_host',
+        help="parse the ccp and mahimahi logs on their hosts once each iteration is over, and only collect the parsed series")
+parser.add_argument('--keep-raw-logs', action='store_true', dest='keep_raw_logs',
+        help="with --parse-on-host, collect the logs as well")
+parser.add_argument('--live', action='store_true',
+        help="tail ccp.log while the traffic runs, showing its latest values every --live-interval seconds and parsing it as it comes in (unless --decimate is given), so it doesn't need parsing afterwards")
+parser.add_argument('--live-interval', type=float, default=5, dest='live_interval',
+        help="how often (in seconds) --live shows the latest values")
+parser.add_argument('--collect-queue', type=int, default=2, dest='collect_queue',
+        help="how many finished iterations may wait to be collected in the background while the next ones run (0 to collect each one before moving on)")
+parser.add_argument('--agent', action='store_true',
+        help="run a small agent on each host and control experiments through it instead of a new ssh command for every step")
+parser.add_argument('--order', type=str, choices=orders, default='shuffle',
+        help="shuffle: run the iterations in random order; grouped: run the ones sharing a scheduler, algorithm, rate and rtt back to back (in random order), keeping the same inbox and ccp running through them")
+parser.add_argument('--order-seed', type=int, dest='order_seed',
+        help="seed for the (pseudorandom) order the iterations run in, to repeat a previous run's order; random by default")
+parser.add_argument('--list', action='store_true',
+        help="list the iterations of the sweep, in the order they would run, and exit")
+parser.add_argument('--count', action='store_true',
+        help="count the iterations of the sweep and exit")
 parser.add_argument('--details', type=str, help="extra information to include in experiment report", default="")
 ###################################################################################################
 
@@ -54,9 +90,13 @@ def check_etg(config, node):
         "Failed to create distributions directory {}".format(config['distribution_dir'])
     )
 
-    for (dist_name, path) in config['distributions'].items():
-        remote_path = os.path.join(config['distribution_dir'], dist_name)
-        if not node.file_exists(remote_path):
+    dists = list(config['distributions'].items())
+    exists = node.run_batch(
+        "ls {}".format(os.path.join(config['distribution_dir'], dist_name))
+        for (dist_name, _) in dists
+    )
+    for (dist_name, path), res in zip(dists, exists):
+        if res.exited != 0:
             node.put(os.path.expanduser(path), remote=config['distribution_dir'])
 
 def check_inbox(config, inbox):
@@ -68,8 +108,8 @@ def check_receiver(config, receiver):
     if not receiver.prog_exists("mm-delay"):
         fatal_warn("Receiver does not have mahimahi installed.")
 
-def prepare_directories(config, conns):
-    agenda.task("Preparing result directories")
+def prepare_local_directory(config):
+    agenda.task("Preparing local result directory")
 
     local_experiment_dir = config['local_experiment_dir']
     if os.path.exists(local_experiment_dir):
@@ -87,7 +127,14 @@ def prepare_directories(config, conns):
 
     os.makedirs(local_experiment_dir, exist_ok=True)
 
-    for (addr, conn) in conns.items():
+    # Keep a copy of the config in the experiment directory for future reference
+    subprocess.check_output(f"cp {config['args'].config} {local_experiment_dir}", shell=True)
+
+def prepare_directories(config, conns):
+    agenda.task("Preparing result directories")
+
+    def prepare(host):
+        addr, conn = host
         if config['args'].verbose:
             agenda.subtask(addr)
 
@@ -106,20 +153,23 @@ def prepare_directories(config, conns):
             "Failed to create experiment directory {}".format(config['experiment_dir'])
         )
 
-    # Keep a copy of the config in the experiment directory for future reference
-    subprocess.check_output(f"cp {config['args'].config} {local_experiment_dir}", shell=True)
+    for_each_host(conns.items(), prepare, host=lambda h: h[0], serial=interacting(conns.values()))
 
 iteration_dirs = set()
 def prepare_iteration_dir(config, conns):
-    if config['iteration_dir'] in iteration_dirs:
+    key = (config['testbed'], config['iteration_dir'])
+    if key in iteration_dirs:
         fatal_error("Iteration directory not reset! This must be a bug.")
 
-    iteration_dirs.add(config['iteration_dir'])
-    for (_addr, conn) in conns.items():
-        expect(
+    iteration_dirs.add(key)
+    for_each_host(
+        conns.values(),
+        lambda conn: expect(
             conn.run("mkdir -p {}".format(config['iteration_dir'])),
             "Failed to create iteration directory {}".format(config['iteration_dir'])
-        )
+        ),
+        serial=interacting(conns.values())
+    )
 
     subprocess.call(f"mkdir -p {config['local_iteration_dir']}", shell=True)
 
@@ -134,133 +184,181 @@ def stop_interacting(machines):
         m.interact = False
         m.verbose = False
 
-###################################################################################################
-# Setup
-###################################################################################################
-
-if __name__ == "__main__":
-    args = parser.parse_args()
-
-    if args.interact:
-        warn("Running in interactive mode. Each command is printed before it's run.\nPress any key to continue executing the command or control-c to stop.", exit=False)
-
-    agenda.section("Read config")
-    config = read_config(args)
-    config['args'] = args
-    if config['args'].verbose and config['args'].verbose >= 2:
-        logging.basicConfig(level=logging.DEBUG)
-
+def setup_testbed(config):
+    """
+    Connect to and set up one testbed, for the iterations run on it.
+    """
+    args = config['args']
     if 'cloudlab' in config['topology']:
         config = make_cloudlab_topology(config, headless=args.headless)
+    elif 'netns' in config['topology']:
+        config = make_netns_topology(config)
 
-    topo = MahimahiTopo(config)
+    with span('connect'):
+        topo = MahimahiTopo(config)
 
-    topo.setup_routing(config)
+    with span('routing'):
+        topo.setup_routing(config)
     machines = topo.machines
     conns = topo.conns
 
-    disable_tcp_offloads(config, machines)
-    update_sysctl(machines, config)
+    with span('host_settings'):
+        disable_tcp_offloads(config, machines)
+        update_sysctl(machines, config)
 
     agenda.section("Setup")
-    prepare_directories(config, conns)
-    details_md = os.path.join(config['local_experiment_dir'], 'details.md')
-    results_md = os.path.join(config['local_experiment_dir'], 'results.md')
+    with span('prepare_directories'):
+        prepare_directories(config, conns)
     agenda.task("Fetch build logs")
-    topo.fetch_build_logs(config)
-
-    if not os.path.exists(details_md):
-        with open(details_md, 'w') as f:
-            f.write(args.details + "\n")
-    if not os.path.exists(results_md):
-        with open(results_md, 'w') as f:
-            f.write("TODO\n")
+    with span('build_logs'):
+        topo.fetch_build_logs(config)
 
     agenda.section("Synchronizing code versions")
     if not args.skip_git:
-        check_inbox(config, machines['inbox'])
-        check_receiver(config, machines['receiver'])
-
-    exps = enumerate_experiments(config)
-    total_exps = len(exps)
-
-    try:
-        with open('curr_url','r') as f:
-            sea_url = "Follow progress here: {}".format(f.read().strip())
-    except Exception as e:
-        warn("Unable to find current seashells url: {}".format(e), exit=False)
-        sea_url = ""
-
-    zulip_notify("""**{me}** started a new experiment: `{name}` ({total_exps} configs)
-```quote
-{details}
-```
-{sea_url}
-""".format(
-        me=getpass.getuser(),
-        name=config['experiment_name'],
-        details=args.details,
-        total_exps=total_exps,
-        sea_url=sea_url
-    ), dry=args.dry_run)
-
-    total_elapsed = 0
-
-    for i,exp in enumerate(exps):
-        if exp.alg['name'] == "nobundler" and not exp.sch in ["fifo", "sfq"]:
-            agenda.subtask("skipping...")
-            continue
+        with span('check_code'):
+            check_inbox(config, machines['inbox'])
+            check_receiver(config, machines['receiver'])
+    if args.compress_logs:
+        agenda.task("{} (--compress-logs)".format(args.compress_logs))
+        for conn in conns.values():
+            if not conn.prog_exists(args.compress_logs):
+                fatal_warn("{} does not have {} installed.".format(conn.addr, args.compress_logs))
+    if args.parse_on_host:
+        agenda.task("log parser (--parse-on-host)")
+        hosts = list(dict((m.addr, m) for m in (machines['inbox'], machines['outbox'])).values())
+        with span('install_parser'):
+            installed = for_each_host(hosts, install_host_parser, serial=interacting(hosts))
+        for conn, ok in zip(hosts, installed):
+            if not ok:
+                fatal_warn("{} can't parse logs: --parse-on-host needs python 3 with numpy and agenda there.".format(conn.addr))
+
+    session = InboxSession(config, topo) if args.order == 'grouped' else None
+    return (config, topo, session)
+
+def recollect(config, conns, iteration_name, collector, failed_collections):
+    """
+    Download again whichever outputs of an iteration that already ran never
+    made it here intact, for example because the last run died while
+    collecting them. Returns False (and does nothing) if they are on machines
+    this testbed doesn't have.
+    """
+    journal = config['journal']
+    local_dir = config['local_iteration_dir']
+    remote_dir = journal.get(iteration_name)['remote_dir']
+    missing = journal.missing(iteration_name, local_dir)
+    by_addr = dict((conn.addr, conn) for conn in conns.values())
+    if any(addr not in by_addr for addr, _ in missing):
+        return False
+
+    # files whose collection was cut short may still be in the staging directory
+    staging = staging_dir(remote_dir)
+    outputs = []
+    staged_on = set()
+    for addr in set(addr for addr, _ in missing):
+        conn = by_addr[addr]
+        fnames = [fname for a, fname in missing if a == addr]
+        found = conn.run_batch("test -e {}".format(fname) for fname in fnames)
+        for fname, res in zip(fnames, found):
+            if res.exited and fname.startswith(remote_dir):
+                fname = staging + fname[len(remote_dir):]
+                staged_on.add(conn)
+            outputs.append((conn, fname))
+
+    os.makedirs(local_dir, exist_ok=True)
+    failed = collector.collect(outputs, local_dir)
+    journal.collected(iteration_name, local_dir, outputs, [fname for fname, _ in failed])
+    unstage(remote_dir, staged_on)
+    for (fname, e) in failed:
+        warn("could not get file {}: {}".format(fname, e), exit=False)
+        failed_collections.append((iteration_name, fname, e))
+    return True
+
+def run_iteration(config, topo, session, exp, progress, collector, background, failed_collections):
+    """
+    Run one iteration of the sweep on the testbed topo, and collect (or queue
+    up the collection of) its results. Returns how long the experiment ran
+    for, or None if it was skipped. With a session (an InboxSession), the
+    inbox and ccp are left running for the next iteration if it can use them.
+    """
+    machines = topo.machines
+    conns = topo.conns
 
-        max_digits = len(str(total_exps))
-        progress = "{}/{}".format(str(i+1).zfill(max_digits), total_exps)
-        agenda.task("{} | {}".format(progress, exp))
+    agenda.task("{} | {}".format(progress, exp))
 
-        kill_leftover_procs(config, machines)
+    with span('kill_procs'):
+        kill_leftover_procs(config, machines, keep=session.keep(exp) if session else ())
 
-        #TODO get exact system time that each program starts
+    #TODO get exact system time that each program starts
 
-        bundle_traffic = list(create_traffic_config(exp.bundle_traffic, exp))
-        cross_traffic = list(create_traffic_config(exp.cross_traffic, exp))
+    bundle_traffic = list(create_traffic_config(exp.bundle_traffic, exp))
+    cross_traffic = list(create_traffic_config(exp.cross_traffic, exp))
 
-        name = exp.alg['name']
-        exp_alg_iteration_name = name + "." + ".".join("{}={}".format(k,v) for k,v in exp.alg.items() if k != 'name')
+    name = exp.alg['name']
+    exp_alg_iteration_name = name + "." + ".".join("{}={}".format(k,v) for k,v in exp.alg.items() if k != 'name')
 
-        iteration_name = "{sch}_{rate}_{rtt}/{alg}/b={bundle}_c={cross}/{seed}".format(
-            sch=exp.sch,
-            alg=exp_alg_iteration_name,
-            rate=exp.rate,
-            rtt=exp.rtt,
-            seed=exp.seed,
-            bundle="+".join(str(b) for b in bundle_traffic),
-            cross="+".join(str(c) for c in cross_traffic)
-        )
+    iteration_name = "{sch}_{rate}_{rtt}/{alg}/b={bundle}_c={cross}/{seed}".format(
+        sch=exp.sch,
+        alg=exp_alg_iteration_name,
+        rate=exp.rate,
+        rtt=exp.rtt,
+        seed=exp.seed,
+        bundle="+".join(str(b) for b in bundle_traffic),
+        cross="+".join(str(c) for c in cross_traffic)
+    )
 
-        config['iteration_dir'] = os.path.join(config['experiment_dir'], iteration_name)
-        config['local_iteration_dir'] = os.path.join(config['local_experiment_dir'], iteration_name)
-        if os.path.exists(config['local_iteration_dir']):
-            if config['args'].skip_existing:
-                agenda.subtask("skipping experiment")
-                continue
-            elif config['args'].overwrite_existing:
-                agenda.subtask("overwriting experiment")
-            else:
-                fatal_warn("Found existing results for this experiment, but unsure how to handle it. Please provide --skip-existing or --overwite-existing")
+    config['iteration_dir'] = os.path.join(config['experiment_dir'], iteration_name)
+    config['local_iteration_dir'] = os.path.join(config['local_experiment_dir'], iteration_name)
+    journal = config['journal']
+    stage = journal.stage(iteration_name)
+    if config['args'].skip_existing and stage is not None:
+        # pick up where the last run got to
+        if stage == COLLECTED and not journal.missing(iteration_name, config['local_iteration_dir']):
+            agenda.subtask("skipping experiment")
+            return None
+        elif stage in (RAN, COLLECTED):
+            agenda.subtask("results were not all collected, collecting them again")
+            if recollect(config, conns, iteration_name, collector, failed_collections):
+                return None
+            agenda.subtask("results are not on this testbed, running experiment again")
+        else:
+            agenda.subtask("experiment did not finish, running it again")
+    elif journal.started_here(iteration_name):
+        # another testbed failed partway through it, and handed it over
+        agenda.subtask("experiment failed on another testbed, running it again")
+    elif os.path.exists(config['local_iteration_dir']):
+        if config['args'].skip_existing:
+            agenda.subtask("skipping experiment")
+            return None
+        elif config['args'].overwrite_existing:
+            agenda.subtask("overwriting experiment")
+        else:
+            fatal_warn("Found existing results for this experiment, but unsure how to handle it. Please provide --skip-existing or --overwite-existing")
 
-        config['iteration_outputs'] = []
+    config['iteration_outputs'] = []
 
+    journal.started(iteration_name)
+    with span('prepare_iteration'):
         prepare_iteration_dir(config, conns)
 
-        ##### RUN EXPERIMENT
+    ##### RUN EXPERIMENT
 
-        start = time.time()
+    start = time.time()
 
-        # starting inbox is topology-independent
-        if exp.alg['name'] != "nobundler":
+    # starting inbox is topology-independent
+    ccp_log = None
+    with span('start_inbox'):
+        if exp.alg['name'] != "nobundler" and session:
+            session.start(exp)
+            ccp_log = session.log('ccp.log')
+        elif exp.alg['name'] != "nobundler":
             inbox_out = topo.start_inbox(exp.sch, config['parameters']['qdisc_buf_size'])
             ccp_out = start_ccp(config, machines['inbox'], exp.alg)
-            machines['inbox'].check_file('Inbox ready', inbox_out)
+            machines['inbox'].check_file('Inbox ready', inbox_out, timeout=startup_timeout)
             agenda.subtask("Inbox ready")
+            ccp_log = (ccp_out, 0, "")
         else:
+            if session:
+                session.stop()
             machines['inbox'].run(
                     "tc qdisc del dev {iface} root".format(
                         iface=get_iface(config, 'inbox')['dev']
@@ -272,6 +370,7 @@ if __name__ == "__main__":
                     ), sudo=True
             )
 
+    with span('start_capture'):
         if config['args'].tcpprobe:
             #TODO figure out how to check for and kill dd, it's a substring in other process names
             tcpprobe_out = start_tcpprobe(config, machines['sender'])
@@ -279,32 +378,250 @@ if __name__ == "__main__":
         if config['args'].tcpdump:
             config = start_tcpdump(config, machines)
 
+    live = None
+    if config['args'].live and ccp_log:
+        live = LiveCcpLog.start(
+            machines['inbox'],
+            *ccp_log,
+            os.path.join(config['local_iteration_dir'], 'ccp.log'),
+            config['args'].downsample,
+            # parsed on the host anyway, or can't be parsed until it is all there
+            write=not (config['args'].parse_on_host or config['args'].decimate),
+            interval=config['args'].live_interval,
+        )
+
+    with span('traffic'):
         c = topo.run_traffic(config, exp, bundle_traffic, cross_traffic)
-        if c is None:
-            continue
+    if c is None:
+        if live:
+            live.cancel()
+        return None
+    else:
+        config = c
+
+    elapsed = time.time() - start
+    agenda.subtask("Ran for {} seconds".format(elapsed))
+    with span('kill_procs'):
+        kill_leftover_procs(config, machines, keep=session.keep(exp) if session else ())
+    with span('live_stop'):
+        parsed = live.stop() if live else None
+    with span('teardown'):
+        if session and session.key:
+            # the session's ccp keeps logging, so its part of the log ends
+            # wherever the live parse stopped
+            session.finish_iteration({'ccp.log': parsed} if parsed is not None else {})
         else:
-            config = c
-
-        elapsed = time.time() - start
-        total_elapsed += elapsed
-        agenda.subtask("Ran for {} seconds".format(elapsed))
-        kill_leftover_procs(config, machines)
-        agenda.subtask("Remove qdisc")
-        machines['inbox'].run(
-                "tc qdisc del dev {iface} root".format(
-                    iface=get_iface(config,'inbox')['dev']
-                ), sudo=True
-        )
+            agenda.subtask("Remove qdisc")
+            machines['inbox'].run(
+                    "tc qdisc del dev {iface} root".format(
+                        iface=get_iface(config,'inbox')['dev']
+                    ), sudo=True
+            )
 
+    outputs = [(m, fname) for (m, fname) in config['iteration_outputs'] if 'self' not in config or m != config['self']]
+    def process(outputs):
+        if config['args'].parse_on_host:
+            agenda.subtask("parsing logs")
+            with span('parse_on_host'):
+                outputs = parse_on_hosts(
+                    outputs,
+                    config['args'].downsample,
+                    config['args'].decimate,
+                    config['args'].points if config['args'].decimate else default_points,
+                    keep_raw=config['args'].keep_raw_logs,
+                )
+        if config['args'].compress_logs:
+            agenda.subtask("compressing logs")
+            with span('compress_logs'):
+                outputs = compress_logs(outputs, config['args'].compress_logs)
+        return outputs
+    local_dir = config['local_iteration_dir']
+
+    if background:
+        # the logs are parsed and compressed on the collector's thread, while
+        # this testbed goes on with the next iteration; until then, the
+        # journal knows where the raw ones are
+        journal.ran(iteration_name, config['testbed'], config['iteration_dir'], outputs)
+        def collected(outputs, failed):
+            journal.ran(iteration_name, config['testbed'], config['iteration_dir'], outputs)
+            journal.collected(iteration_name, local_dir, outputs, [fname for fname, _ in failed])
+        agenda.subtask("queueing results for collection")
+        background.submit(iteration_name, config['iteration_dir'], outputs, local_dir, process=process, done=collected)
+    else:
+        outputs = process(outputs)
+        journal.ran(iteration_name, config['testbed'], config['iteration_dir'], outputs)
         agenda.subtask("collecting results")
-        for (m, fname) in config['iteration_outputs']:
-            if 'self' not in config or m != config['self']:
-                try:
-                    if fname.startswith("~/"):
-                        fname = fname[2:]
-                    m.get(fname, local=os.path.join(config['local_iteration_dir'], os.path.basename(fname)))
-                except Exception as e:
-                    warn("could not get file {}: {}".format(fname, e), exit=False)
+        failed = collector.collect(outputs, local_dir)
+        journal.collected(iteration_name, local_dir, outputs, [fname for fname, _ in failed])
+        for (fname, e) in failed:
+            warn("could not get file {}: {}".format(fname, e), exit=False)
+            failed_collections.append((iteration_name, fname, e))
+
+    return elapsed
+
+###################################################################################################
+# Setup
+###################################################################################################
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if args.interact:
+        warn("Running in interactive mode. Each command is printed before it's run.\nPress any key to continue executing the command or control-c to stop.", exit=False)
+
+    agenda.section("Read config")
+    config = read_config(args)
+    config['args'] = args
+    if config['args'].verbose and config['args'].verbose >= 2:
+        logging.basicConfig(level=logging.DEBUG)
+
+    sweep = Sweep(config['experiment'])
+    order_seed = args.order_seed if args.order_seed is not None else random.randrange(2**32)
+    if args.list or args.count:
+        if args.list:
+            for group in sweep.groups(args.order, order_seed):
+                for exp in group:
+                    print(exp)
+        print("{} iteration(s)".format(sweep.count()))
+        sys.exit(0)
+
+    prepare_local_directory(config)
+    config['journal'] = Journal(os.path.join(config['local_experiment_dir'], 'journal.jsonl'), dry=args.dry_run)
+    trace_path = os.path.join(config['local_experiment_dir'], 'trace.jsonl')
+    trace = open_trace(None if args.dry_run else trace_path, sys.argv)
+
+    testbeds = testbed_configs(config)
+    if args.interact and len(testbeds) > 1:
+        warn("Interactive mode only runs on one testbed, using the first", exit=False)
+        testbeds = testbeds[:1]
+
+    details_md = os.path.join(config['local_experiment_dir'], 'details.md')
+    results_md = os.path.join(config['local_experiment_dir'], 'results.md')
+    if not os.path.exists(details_md):
+        with open(details_md, 'w') as f:
+            f.write(args.details + "\n")
+    if not os.path.exists(results_md):
+        with open(results_md, 'w') as f:
+            f.write("TODO\n")
+
+    with span('setup'):
+        testbeds = for_each_host(testbeds, setup_testbed, host=lambda tb: tb['testbed'], serial=args.interact)
+
+    agenda.section("Starting experiments")
+    total_exps = sweep.count()
+    agenda.subtask("{} iteration(s), {} order (--order-seed {})".format(total_exps, args.order, order_seed))
+
+    try:
+        with open('curr_url','r') as f:
+            sea_url = "Follow progress here: {}".format(f.read().strip())
+    except Exception as e:
+        warn("Unable to find current seashells url: {}".format(e), exit=False)
+        sea_url = ""
+
+    zulip_notify("""**{me}** started a new experiment: `{name}` ({total_exps} configs{testbeds})
+```quote
+{details}
+```
+{sea_url}
+""".format(
+        me=getpass.getuser(),
+        name=config['experiment_name'],
+        details=args.details,
+        total_exps=total_exps,
+        testbeds=" on {} testbeds".format(len(testbeds)) if len(testbeds) > 1 else "",
+        sea_url=sea_url
+    ), dry=args.dry_run)
+
+    # every testbed takes the next iteration (with --order=grouped, the next
+    # group of them) as soon as it is done with its last; they are only
+    # generated as they are handed out
+    def numbered(groups):
+        i = 0
+        for group in groups:
+            yield [(i + k, exp) for k, exp in enumerate(group)]
+            i += len(group)
+    pending = numbered(sweep.groups(args.order, order_seed))
+    retry = []
+    work_lock = threading.Lock()
+    def next_group():
+        with work_lock:
+            if retry:
+                return retry.pop()
+            return next(pending, None)
+    max_digits = len(str(total_exps))
+    collector = Collector(workers=args.collect_workers, compress=args.compress_collect)
+    failed_collections = []
+    failed_testbeds = []
+    elapsed = []
+
+    def run_testbed(testbed):
+        tb_config, topo, session = testbed
+        if tb_config['testbed']:
+            thread_output.prefix = "[{}] ".format(tb_config['testbed'])
+        with span('testbed', testbed=tb_config['testbed']):
+            run_testbed_iterations(tb_config, topo, session)
+
+    def run_testbed_iterations(tb_config, topo, session):
+        background = BackgroundCollector(collector, args.collect_queue) if args.collect_queue > 0 else None
+        try:
+            failed = False
+            while not failed:
+                group = next_group()
+                if group is None:
+                    break
+                for k, (i, exp) in enumerate(group):
+                    progress = "{}/{}".format(str(i+1).zfill(max_digits), total_exps)
+                    try:
+                        with span('iteration', testbed=tb_config['testbed'], exp=str(exp)) as s:
+                            ran = run_iteration(tb_config, topo, session, exp, progress, collector, background, failed_collections)
+                            s.set(skipped=ran is None)
+                    except (Exception, SystemExit) as e:
+                        # leave the rest to the other testbeds, if there are any
+                        with work_lock:
+                            retry.append(group[k:])
+                        failed_testbeds.append((tb_config['testbed'], progress, e))
+                        failed = True
+                        break
+                    if ran is not None:
+                        elapsed.append(ran)
+            if session and not failed:
+                session.stop()
+        finally:
+            if background:
+                agenda.task("waiting for result collection to finish")
+                failed_collections.extend(background.finish())
+
+    if len(testbeds) == 1:
+        run_testbed(testbeds[0])
+    else:
+        capture_thread_output()
+        workers = [threading.Thread(target=run_testbed, args=(tb,), daemon=True) for tb in testbeds]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    collector.close()
+    total_elapsed = sum(elapsed)
+
+    agenda.section("Timing")
+    print("\n".join(summary(trace.totals)))
+    if trace.path:
+        agenda.subtask("trace in {} (python3 timing.py {})".format(trace.path, trace.path))
+    trace.close()
+
+    if failed_collections:
+        warn("{} file(s) could not be collected:\n{}".format(
+            len(failed_collections),
+            "\n".join("{}: {}: {}".format(name, fname, e) for (name, fname, e) in failed_collections),
+        ), exit=False)
+    if failed_testbeds:
+        warn("{} testbed(s) stopped early:\n{}".format(
+            len(failed_testbeds),
+            "\n".join("{}: at {}: {!r}".format(tb or "testbed", progress, e) for (tb, progress, e) in failed_testbeds),
+        ), exit=False)
+        not_run = sum(len(group) for group in retry + list(pending))
+        if not_run:
+            fatal_warn("{} iteration(s) were not run".format(not_run))
 
     zulip_notify("{total_exps} experiment(s) finished in **{elapsed}** seconds.".format(
         total_exps=total_exps,
@@ -314,9 +631,12 @@ if __name__ == "__main__":
     agenda.section("parsing results")
     if not args.dry_run:
         parse_args = {'downsample' : config['args'].downsample}
+        if config['args'].decimate:
+            parse_args['decimate'] = config['args'].decimate
+            parse_args['points'] = config['args'].points
         if config['args'].rows:
             parse_args['rows'] = config['args'].rows
         if config['args'].cols:
             parse_args['cols'] = config['args'].cols
         config['structure']['bundler_root'] = '.'
-        parse_outputs(config, parse_args)
+        parse_outputs(config, graph_kwargs=parse_args)
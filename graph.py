@@ -3,7 +3,19 @@ import os
 import subprocess
 import agenda
 
-def write_rmd(experiment_root, csv_name, num_ccp, downsample=None, interact=False, fields="zt, rout, rin, curr_rate, curr_q, elasticity2", rows=None, cols=None, **kwargs):
+read_fmts = {
+    # read.csv mangles column names with make.names, so do the same for arrow
+    # to keep column references in the plots identical across formats
+    'csv': 'read.csv("{path}", sep="{sep}"{na})',
+    'feather': 'as.data.frame(arrow::read_feather("{path}")) %>% setNames(make.names(names(.)))',
+    'parquet': 'as.data.frame(arrow::read_parquet("{path}")) %>% setNames(make.names(names(.)))',
+    'dataset': 'as.data.frame(collect(arrow::open_dataset("{path}"))) %>% setNames(make.names(names(.)))',
+}
+
+def read_expr(fmt, path, sep=",", na=""):
+    return read_fmts[fmt].format(path=path, sep=sep, na=na)
+
+def write_rmd(experiment_root, csv_name, num_ccp, downsample=None, interact=False, fields="zt, rout, rin, curr_rate, curr_q, elasticity2", rows=None, cols=None, fmt='csv', **kwargs):
     experiment_root = os.path.abspath(os.path.expanduser(experiment_root))
     experiment_name = os.path.basename(experiment_root)
 
@@ -36,7 +48,7 @@ def write_rmd(experiment_root, csv_name, num_ccp, downsample=None, interact=Fals
     mm_plt_fmt = """
 **{title}**
 ```{{r mm{i}, fig.width=15, fig.align='center', echo=FALSE}}
-df_m_{i} <- read.csv("{path}", sep=" ")  # header=FALSE, col.names=c("t", "total", "delay","bundle", "cross"))
+df_m_{i} <- {read_m}  # header=FALSE, col.names=c("t", "total", "delay","bundle", "cross"))
 df_m_{i} <- df_m_{i} %>% gather("measurement", "value", total, delay, bundle, cross)
 {remove}df_switch_{i} <- read.csv("{switch_path}", sep=",")
 plt_m_{i} <- ggplot(df_m_{i}, aes(x=t, y=value, color=measurement)) +
@@ -61,7 +73,7 @@ plt_m_{i} <- ggplot(df_m_{i}, aes(x=t, y=value, color=measurement)) +
         mm_plots.append(
             mm_plt_fmt.format(
                 i=i,
-                path=path,
+                read_m=read_expr('feather', path[:-len('.tmp')] + '.feather') if fmt == 'parquet' else read_expr('csv', path, sep=" "),
                 title=format_title(path.split(experiment_name)[1]),
                 switch_path=switch_path,
                 remove=remove,
@@ -89,7 +101,7 @@ plt_m_{i} <- ggplot(df_m_{i}, aes(x=t, y=value, color=measurement)) +
 #### Nimbus
 
 ```{{r plot1, fig.width=15, fig.height={fig_height}, fig.align='center', echo=FALSE}}
-df <- read.csv("{csv}", sep=",", na.strings=c("","none"))
+df <- {read_ccp}
 if (nrow(df) == 0) {{
     print("no ccp output")
 }} else {{
@@ -104,7 +116,7 @@ plt <- ggplot(df, aes(x=elapsed, y=value, color=measurement)) +
 }}
 ```
 """.format(
-            csv = os.path.join(experiment_root, csv_name),
+            read_ccp = read_expr('dataset' if fmt == 'parquet' else 'csv', os.path.join(experiment_root, csv_name), na=', na.strings=c("","none")'),
             fields = fields,
             wrap_str_check = "1" if wrap_str is not None else "0",
             wrap_str = wrap_str,
@@ -121,7 +133,7 @@ plt <- ggplot(df, aes(x=elapsed, y=value, color=measurement)) +
 #### Flow Completion Times
 
 ```{{r fcts, fig.width=15, fig.height=6, fig.align='center', echo=FALSE}}
-df_fct <- read.csv("{csv}", sep=" ")
+df_fct <- {read_fct}
 df_fct$Duration <- df_fct$Duration.usec. / 1e6
 bw <- 12e6 # TODO make this configurable
 df_fct$ofct <- (df_fct$Size / bw) + 0.05
@@ -130,7 +142,7 @@ df_fct$scheme <- paste(df_fct$sch, "_", df_fct$alg, sep="")
 fct_plt <- ggplot(df_fct, aes(x=NormFct, colour=scheme)) + stat_ecdf() + scale_x_log10()
 fct_plt
 ```""".format(
-            csv = fct_path,
+            read_fct = read_expr('parquet', os.path.join(experiment_root, 'fcts.parquet')) if fmt == 'parquet' else read_expr('csv', fct_path, sep=" "),
         )
     else:
         fct_plots = ""
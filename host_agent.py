@@ -0,0 +1,361 @@
+#!/usr/bin/python3
+
+import base64
+import itertools
+import json
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+
+# A small agent that runs on each experiment host, so that process control
+# doesn't need a new ssh exec channel (and a new shell) for every action.
+#
+# This file is copied to the host once per session and started over the
+# host's existing ssh connection; it then reads one json request per line on
+# stdin and writes json responses on stdout. Every request carries an id that
+# its response(s) echo back, and is handled on its own thread, so any number of
+# requests can be in flight at once over the one channel. The agent only needs
+# the python 3 standard library, and exits when the connection closes.
+#
+# Requests:
+#   run        cmd                    run cmd with bash; exit code, stdout, stderr
+#   spawn      cmd, stdout, stderr    start cmd detached from the agent; its pid
+#   poll       pids                   for each pid, whether it is running, its
+#                                     exit code if the agent started it, and
+#                                     the names of it and its live descendants
+#   wait_proc  name, timeout          pids of processes whose name matches the
+#                                     name regex (like pgrep), once there are any
+#   wait_file  path, text, timeout    whether a line containing text showed up
+#                                     in path
+#   read       path                   the file's contents, as a stream of chunks
+#   ping                              an empty response, to check the agent is alive
+
+read_chunk_size = 1024 * 1024
+poll_interval = 0.01
+# how long the client waits for a response before pinging the agent, and then
+# for the ping's response before giving up on it
+response_timeout = 10
+
+###################################################################################################
+# Agent (runs on the experiment host)
+###################################################################################################
+def processes():
+    """
+    {pid: (parent pid, name)} of every process on the host
+    """
+    procs = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(pid)) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the name is in parentheses, and can itself contain spaces and ')'
+        end = stat.rindex(")")
+        procs[int(pid)] = (int(stat[end + 2:].split()[1]), stat[stat.index("(") + 1:end])
+    return procs
+
+class Server:
+    def __init__(self, inp, out):
+        self.inp = inp
+        self.out = out
+        self.out_lock = threading.Lock()
+        self.children = {}
+
+    def send(self, msg):
+        line = json.dumps(msg) + "\n"
+        with self.out_lock:
+            self.out.write(line)
+            self.out.flush()
+
+    def serve(self):
+        for line in self.inp:
+            if not line.strip():
+                continue
+            req = json.loads(line)
+            threading.Thread(target=self.handle, args=(req,), daemon=True).start()
+
+    def handle(self, req):
+        try:
+            op = getattr(self, "op_" + req['op'])
+            res = op(req)
+            if res is not None:
+                res['id'] = req['id']
+                self.send(res)
+        except Exception as e:
+            self.send({'id': req['id'], 'error': "{}: {}".format(type(e).__name__, e)})
+
+    def op_run(self, req):
+        p = subprocess.run(
+            req['cmd'],
+            shell=True,
+            executable="/bin/bash",
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        return {
+            'exited': p.returncode,
+            'stdout': p.stdout.decode(errors='replace'),
+            'stderr': p.stderr.decode(errors='replace'),
+        }
+
+    def op_spawn(self, req):
+        with open(os.path.expanduser(req.get('stdout', "/dev/null")), 'ab') as o, \
+                open(os.path.expanduser(req.get('stderr', "/dev/null")), 'ab') as e:
+            p = subprocess.Popen(
+                req['cmd'],
+                shell=True,
+                executable="/bin/bash",
+                stdin=subprocess.DEVNULL,
+                stdout=o,
+                stderr=e,
+                start_new_session=True,
+            )
+        self.children[p.pid] = p
+        # reaped as soon as it exits, so it doesn't linger as a zombie that
+        # pgrep and pkill still see
+        threading.Thread(target=p.wait, daemon=True).start()
+        return {'pid': p.pid}
+
+    def op_poll(self, req):
+        procs = processes()
+        kids = {}
+        for c, (ppid, _) in procs.items():
+            kids.setdefault(ppid, []).append(c)
+        status = {}
+        for pid in req['pids']:
+            if pid in self.children:
+                code = self.children[pid].poll()
+                running = code is None
+            else:
+                code = None
+                running = pid in procs
+            # what it started (say, under sudo) may outlive it
+            tree = {}
+            parents = [pid]
+            while parents:
+                p = parents.pop()
+                if p in procs:
+                    tree[str(p)] = procs[p][1]
+                parents.extend(kids.get(p, []))
+            status[str(pid)] = {'running': running, 'exited': code, 'procs': tree}
+        return {'status': status}
+
+    def op_wait_proc(self, req):
+        name = re.compile(req['name'])
+        deadline = time.time() + req.get('timeout', 0)
+        while True:
+            pids = []
+            for pid in os.listdir("/proc"):
+                if not pid.isdigit():
+                    continue
+                try:
+                    with open("/proc/{}/comm".format(pid)) as f:
+                        comm = f.read().strip()
+                except OSError:
+                    continue
+                if name.search(comm):
+                    pids.append(int(pid))
+            if pids or time.time() >= deadline:
+                return {'pids': pids}
+            time.sleep(poll_interval)
+
+    def op_wait_file(self, req):
+        path = os.path.expanduser(req['path'])
+        text = req['text'].encode()
+        deadline = time.time() + req.get('timeout', 0)
+        offset = 0
+        rest = b""
+        while True:
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    buf = f.read()
+                offset += len(buf)
+                lines = (rest + buf).split(b"\n")
+                rest = lines.pop()
+                if any(text in l for l in lines) or text in rest:
+                    return {'found': True}
+            except OSError:
+                pass
+            if time.time() >= deadline:
+                return {'found': False}
+            time.sleep(poll_interval)
+
+    def op_read(self, req):
+        with open(os.path.expanduser(req['path']), 'rb') as f:
+            nbytes = 0
+            while True:
+                buf = f.read(read_chunk_size)
+                if not buf:
+                    break
+                nbytes += len(buf)
+                self.send({'id': req['id'], 'data': base64.b64encode(buf).decode()})
+        return {'done': True, 'bytes': nbytes}
+
+    def op_ping(self, req):
+        return {}
+
+###################################################################################################
+# Client (runs locally, one per ConnectionWrapper)
+###################################################################################################
+class AgentError(Exception):
+    pass
+
+class Agent:
+    """
+    Talks to the agent on one host. Requests can be made from any thread.
+    """
+    remote_path = ".bundler-agent.py"
+
+    def __init__(self, wfile, rfile, errfile=None, on_close=None):
+        self.wfile = wfile
+        self.rfile = rfile
+        self.errfile = errfile
+        self.on_close = on_close
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.waiting = {}
+        self.dead = None
+        self.reader = threading.Thread(target=self.read_responses, daemon=True)
+        self.reader.start()
+        # make sure it actually came up before anyone relies on it
+        self.run("true")
+
+    @classmethod
+    def start(cls, client):
+        """
+        Copy the agent to the host and start it on a new channel of client,
+        the host's (paramiko) ssh connection.
+        """
+        sftp = client.open_sftp()
+        try:
+            sftp.put(os.path.abspath(__file__), cls.remote_path)
+        finally:
+            sftp.close()
+        chan = client.get_transport().open_session()
+        chan.exec_command("python3 -u {}".format(cls.remote_path))
+
+        def close():
+            chan.shutdown_write()
+            chan.close()
+        return cls(chan.makefile('wb'), chan.makefile('rb'), chan.makefile_stderr('rb'), close)
+
+    def read_responses(self):
+        try:
+            for line in self.rfile:
+                msg = json.loads(line)
+                with self.lock:
+                    q = self.waiting.get(msg['id'])
+                if q is not None:
+                    q.put(msg)
+            err = self.errfile.read().decode(errors='replace').strip() if self.errfile else ""
+            self.dead = "agent exited{}".format(": " + err if err else "")
+        except Exception as e:
+            self.dead = "lost agent: {}".format(e)
+        self.fail(self.dead)
+
+    def fail(self, reason):
+        with self.lock:
+            self.dead = self.dead or reason
+            for q in self.waiting.values():
+                q.put(None)
+
+    def send(self, op, **args):
+        q = queue.Queue()
+        with self.lock:
+            if self.dead:
+                raise AgentError(self.dead)
+            i = next(self.ids)
+            self.waiting[i] = q
+            args.update(id=i, op=op)
+            self.wfile.write((json.dumps(args) + "\n").encode())
+            self.wfile.flush()
+        return i, q
+
+    def get(self, q):
+        """
+        The next message on q, or None if the agent is gone. A request like run
+        can take arbitrarily long, so a quiet agent is only given up on if it
+        doesn't answer a ping either.
+        """
+        while True:
+            try:
+                return q.get(timeout=response_timeout)
+            except queue.Empty:
+                pass
+            i, ping = self.send('ping')
+            try:
+                ping.get(timeout=response_timeout)
+            except queue.Empty:
+                self.fail("agent stopped responding")
+                return None
+            finally:
+                with self.lock:
+                    self.waiting.pop(i, None)
+
+    def responses(self, i, q):
+        try:
+            while True:
+                msg = self.get(q)
+                if msg is None:
+                    raise AgentError(self.dead)
+                if 'error' in msg:
+                    raise AgentError(msg['error'])
+                yield msg
+        finally:
+            with self.lock:
+                self.waiting.pop(i, None)
+
+    def request(self, op, **args):
+        res = self.responses(*self.send(op, **args))
+        try:
+            return next(res)
+        finally:
+            res.close()
+
+    def run(self, cmd):
+        return self.request('run', cmd=cmd)
+
+    def spawn(self, cmd, stdout="/dev/null", stderr="/dev/null"):
+        return self.request('spawn', cmd=cmd, stdout=stdout, stderr=stderr)['pid']
+
+    def poll(self, pids):
+        """
+        {pid: (running, exit code or None, {pid: name} of it and its live descendants)}
+        """
+        status = self.request('poll', pids=list(pids))['status']
+        return dict((int(p), (s['running'], s['exited'], dict((int(c), n) for c, n in s['procs'].items()))) for p, s in status.items())
+
+    def wait_proc(self, name, timeout=0):
+        return self.request('wait_proc', name=name, timeout=timeout)['pids']
+
+    def wait_file(self, path, text, timeout=0):
+        return self.request('wait_file', path=path, text=text, timeout=timeout)['found']
+
+    def read(self, path, out):
+        """
+        Stream the remote file at path into the (binary) file object out.
+        Returns how many bytes were copied.
+        """
+        for msg in self.responses(*self.send('read', path=path)):
+            if 'data' in msg:
+                out.write(base64.b64decode(msg['data']))
+            elif msg.get('done'):
+                return msg['bytes']
+
+    def close(self):
+        if self.on_close:
+            self.on_close()
+        else:
+            self.wfile.close()
+
+if __name__ == "__main__":
+    Server(sys.stdin, sys.stdout).serve()
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+import json
+import os
+import sys
+
+from compressed import log_name
+from parse_outputs import ccp_outputs, ccp_params, mm_log_pattern, mm_outputs, mm_params, parse_ccp_iteration, parse_mahimahi_iteration, record_parsed
+
+# Parses an iteration's ccp.log and downlink.log on the host that wrote them
+# (eval.py --parse-on-host), so that only the parsed series have to be
+# downloaded and parsed locally. It runs the very code parse_outputs.py would,
+# so this file and the modules it needs (below) are copied to each host once
+# per session; the host needs python 3 with numpy and agenda.
+#
+#   python3 host_parse.py <downsample> <decimate or ""> <points> <log>...
+#
+# The last line of stdout is a json object listing the logs that were parsed
+# and the outputs written. Which parameters each log was parsed with is kept
+# in host-parsed.json next to it, so that parse_outputs doesn't parse it again
+# if it is collected too.
+
+modules = [
+    'host_parse.py',
+    'parse_outputs.py',
+    'columnar.py',
+    'columnize.py',
+    'compressed.py',
+    'decimate.py',
+    'graph.py',
+    'manifest.py',
+]
+remote_dir = "~/.bundler-parse"
+
+def parse(log, sample_rate, decimate, points):
+    """
+    Parse one log like parse_outputs would. Returns the outputs written and
+    the parameters they were written with, or None if the log isn't parsed.
+    """
+    name = os.path.basename(log_name(log))
+    if name == 'ccp.log':
+        if parse_ccp_iteration(log, sample_rate, decimate, points) is None:
+            return None
+        return ccp_outputs(log), ccp_params(sample_rate, decimate, points)
+    matches = mm_log_pattern.search(log)
+    if name == 'downlink.log' and matches is not None:
+        rtt = int(int(matches.group('delay'))*2)
+        parse_mahimahi_iteration(log, rtt, sample_rate, decimate, points)
+        return mm_outputs(log), mm_params(rtt, sample_rate, decimate, points)
+    return None
+
+def main(args):
+    sample_rate, decimate, points = int(args[0]), args[1] or None, int(args[2])
+    parsed = []
+    outputs = []
+    for log in args[3:]:
+        res = parse(log, sample_rate, decimate, points)
+        if res is None:
+            continue
+        parsed.append(log)
+        outputs.extend(res[0])
+        fname = record_parsed(log, *res)
+        if fname not in outputs:
+            outputs.append(fname)
+    print(json.dumps({'parsed': parsed, 'outputs': outputs}))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
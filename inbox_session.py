@@ -0,0 +1,165 @@
+import agenda
+import json
+import os
+import re
+import shlex
+
+from ccp import get_ccp_binary_path, start_ccp
+from topology import get_iface
+from util import *
+
+def bundler_key(exp):
+    """
+    What an inbox and ccp started for exp depend on: iterations with the same
+    key can share them.
+    """
+    if exp.alg['name'] == "nobundler":
+        return None
+    return (exp.sch, json.dumps(exp.alg, sort_keys=True))
+
+class InboxSession:
+    """
+    Keeps one inbox and ccp running on a testbed across consecutive iterations
+    that would start them the same way (see bundler_key), instead of killing
+    and restarting them, and tearing down the qdisc, every time.
+
+    Both log to files of their own in the experiment directory; at the end of
+    each iteration, the part of each log written while it ran is copied into
+    the iteration directory as its inbox.log/ccp.log, as if they had been
+    started just for it. Since a reused ccp's part of the log has no
+    "[nimbus] starting" line, and its elapsed times go on from the iterations
+    before, it gets one made up (see ccp_head) saying what mode nimbus was in
+    and at what elapsed time the part starts.
+    """
+    logs = ['inbox.log', 'ccp.log']
+
+    def __init__(self, config, topo):
+        self.config = config
+        self.topo = topo
+        self.inbox = topo.machines['inbox']
+        self.key = None
+        self.dir = os.path.join(config['experiment_dir'], "inbox-session{}".format(
+            "-" + config['testbed'] if config.get('testbed') else ""
+        ))
+        self.offsets = None
+        # lines to put before each log's part
+        self.heads = {}
+        # nimbus's mode and elapsed time at the start of this iteration's part
+        # of ccp.log, as far as is known
+        self.mode = None
+        self.elapsed = None
+
+    def keep(self, exp):
+        """
+        Process names kill_leftover_procs should leave alone before exp runs.
+        """
+        if self.key is None or bundler_key(exp) != self.key:
+            return ()
+        return ("inbox", exp.alg['name'])
+
+    def alive(self, exp):
+        ccp_binary_name = get_ccp_binary_path(self.config, exp.alg['name']).split('/')[-1]
+        return self.inbox.wait_for_proc('inbox', 0) and self.inbox.wait_for_proc(ccp_binary_name, 0)
+
+    def start(self, exp):
+        """
+        Make sure an inbox and ccp for exp are running (starting them if the
+        ones running were for something else, or died), and mark where this
+        iteration's part of their logs begins.
+        """
+        config = self.config
+        key = bundler_key(exp)
+        reused = self.key is not None and self.key == key and self.alive(exp)
+        if reused:
+            agenda.subtask("Reusing inbox and ccp")
+        else:
+            self.mode = self.elapsed = None
+            self.stop()
+            expect(self.inbox.run("mkdir -p {d} && rm -f {d}/*".format(d=self.dir)), "Failed to create {}".format(self.dir))
+            inbox_out = self.topo.start_inbox(exp.sch, config['parameters']['qdisc_buf_size'], out=os.path.join(self.dir, 'inbox.log'))
+            start_ccp(config, self.inbox, exp.alg, out=os.path.join(self.dir, 'ccp.log'))
+            self.inbox.check_file('Inbox ready', inbox_out, timeout=startup_timeout)
+            agenda.subtask("Inbox ready")
+            self.key = key
+
+        prev = self.offsets
+        sizes = self.inbox.run_batch("stat -c %s {}".format(os.path.join(self.dir, log)) for log in self.logs)
+        self.offsets = [int(r.stdout.strip()) if not r.exited and r.stdout.strip().isdigit() else 0 for r in sizes]
+        self.heads = {}
+        if reused:
+            k = self.logs.index('ccp.log')
+            self.heads['ccp.log'] = self.ccp_head(prev[k], self.offsets[k])
+
+    def ccp_head(self, start, end):
+        """
+        A "[nimbus] starting" line for a part of ccp.log that starts at offset
+        end, with the mode nimbus is in there and the elapsed time of the last
+        line before it (found from the log since offset start), which
+        parse_outputs takes as where the part starts. Empty if there's no
+        nimbus mode in the log.
+        """
+        res = self.inbox.run_batch([
+            "tail -c +{} {} | head -c {} | awk '"
+            "/\\[nimbus\\] (starting|switched mode)/ {{ m = $0 }} "
+            "match($0, /elapsed: [0-9.]+/) {{ e = substr($0, RSTART + 9, RLENGTH - 9) }} "
+            "END {{ print e; print m }}'".format(start + 1, os.path.join(self.dir, 'ccp.log'), end - start)
+        ])[0]
+        if not res.exited:
+            lines = res.stdout.split("\n")
+            mode = re.search(r"flow_mode: ([^,]+)|switched mode ([A-Z]+)", lines[1] if len(lines) > 1 else "")
+            if mode:
+                self.mode = mode.group(1) or mode.group(2)
+            if re.fullmatch(r"[0-9.]+", lines[0]):
+                self.elapsed = lines[0]
+        if self.mode is None:
+            return ""
+        return "INFO [nimbus] starting, flow_mode: {},{} (ccp kept on from an earlier iteration)".format(
+            self.mode,
+            " elapsed: {},".format(self.elapsed) if self.elapsed is not None else "",
+        )
+
+    def log(self, name):
+        """
+        Where the log name is, where this iteration's part of it starts, and
+        the line (if any) that goes before that part.
+        """
+        return os.path.join(self.dir, name), self.offsets[self.logs.index(name)], self.heads.get(name, "")
+
+    def finish_iteration(self, lengths={}):
+        """
+        Copy this iteration's part of the logs into its directory, and add them
+        to its outputs.
+
+        lengths : {log: how many bytes of its part to copy}, for logs whose
+                  part should end somewhere other than their current end
+        """
+        config = self.config
+        outs = [os.path.join(config['iteration_dir'], log) for log in self.logs]
+        results = self.inbox.run_batch(
+            "{{ {}tail -c +{} {}{}; }} > {}".format(
+                "echo {}; ".format(shlex.quote(self.heads[log])) if self.heads.get(log) else "",
+                offset + 1,
+                os.path.join(self.dir, log),
+                " | head -c {}".format(lengths[log]) if log in lengths else "",
+                out,
+            )
+            for log, offset, out in zip(self.logs, self.offsets, outs)
+        )
+        for res, out in zip(results, outs):
+            expect(res, "Failed to write {}".format(out))
+            config['iteration_outputs'].append((self.inbox, out))
+
+    def stop(self):
+        """
+        Stop the inbox and ccp, if they are running, and remove the qdisc.
+        """
+        if self.key is None:
+            return
+        self.key = None
+        agenda.subtask("Stopping inbox and ccp")
+        kill_leftover_procs(self.config, self.topo.machines)
+        self.inbox.run(
+            "tc qdisc del dev {iface} root".format(
+                iface=get_iface(self.config, 'inbox')['dev']
+            ), sudo=True
+        )
@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+
+from manifest import file_hash
+
+# An append-only record of how far each iteration of a sweep got, kept in the
+# local experiment directory, so that a resumed run (--skip-existing) can pick
+# every iteration up at the stage it stopped at instead of guessing from which
+# directories exist.
+#
+# Every line is a json object for one stage of one iteration:
+#   started   : the iteration is about to run (anything recorded for it before
+#               no longer applies)
+#   ran       : its traffic finished; records where its outputs are, as
+#               [host, remote file] pairs, and on which testbed
+#   collected : (some of) its outputs were downloaded; records size, mtime and
+#               hash of the local copy of each one that was
+#
+# Lines are flushed and synced as they are written, and a torn last line (from
+# a crash mid-write) is ignored when reading the journal back.
+
+STARTED = 'started'
+RAN = 'ran'
+COLLECTED = 'collected'
+
+class Journal:
+    def __init__(self, path, dry=False):
+        self.path = path
+        self.dry = dry
+        self.lock = threading.Lock()
+        self.entries = {}
+        # iterations started by this run (rather than one whose journal this is
+        # picking up)
+        self.ours = set()
+        # whether the last line was torn, and the next record needs a line
+        # of its own
+        self.torn = False
+        if dry or not os.path.exists(path):
+            return
+        with open(path) as f:
+            for line in f:
+                self.torn = not line.endswith("\n")
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                self.apply(rec)
+
+    def apply(self, rec):
+        name = rec['iteration']
+        if rec['stage'] == STARTED:
+            self.entries[name] = {'stage': STARTED}
+            return
+        e = self.entries.setdefault(name, {'stage': STARTED})
+        e['stage'] = rec['stage']
+        if rec['stage'] == RAN:
+            e['testbed'] = rec.get('testbed')
+            e['remote_dir'] = rec['remote_dir']
+            e['outputs'] = rec['outputs']
+            e['files'] = {}
+        elif rec['stage'] == COLLECTED:
+            e.setdefault('files', {}).update(rec['files'])
+
+    def record(self, name, stage, **info):
+        rec = dict(info, iteration=name, stage=stage, time=time.time())
+        with self.lock:
+            self.apply(rec)
+            if self.dry:
+                return
+            with open(self.path, 'a') as f:
+                if self.torn:
+                    f.write("\n")
+                    self.torn = False
+                f.write(json.dumps(rec) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def stage(self, name):
+        e = self.entries.get(name)
+        return e['stage'] if e else None
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def started(self, name):
+        self.record(name, STARTED)
+        with self.lock:
+            self.ours.add(name)
+
+    def started_here(self, name):
+        with self.lock:
+            return name in self.ours
+
+    def ran(self, name, testbed, remote_dir, outputs):
+        """
+        outputs: the (connection, remote file) of every output to be collected
+        """
+        self.record(name, RAN, testbed=testbed, remote_dir=remote_dir, outputs=[[conn.addr, fname] for conn, fname in outputs])
+
+    def collected(self, name, local_dir, outputs, failed):
+        """
+        Record the outputs (as passed to ran) that were downloaded into
+        local_dir, i.e. all of them but the remote files in failed (which may
+        have been fetched from their staging directory, see collect.py).
+        """
+        failed = set(os.path.basename(f) for f in failed)
+        files = {}
+        for _, fname in outputs:
+            if os.path.basename(fname) in failed:
+                continue
+            local = os.path.join(local_dir, os.path.basename(fname))
+            if not os.path.isfile(local):
+                continue
+            st = os.stat(local)
+            files[os.path.basename(fname)] = [st.st_size, st.st_mtime_ns, file_hash(local)]
+        self.record(name, COLLECTED, files=files)
+
+    def missing(self, name, local_dir):
+        """
+        The [host, remote file] outputs of an iteration whose local copy is
+        missing or doesn't match what was collected. Hashes are only checked
+        for files whose size is right but mtime has changed.
+        """
+        e = self.entries[name]
+        missing = []
+        for addr, fname in e['outputs']:
+            base = os.path.basename(fname)
+            local = os.path.join(local_dir, base)
+            if base not in e['files'] or not os.path.isfile(local):
+                missing.append((addr, fname))
+                continue
+            size, mtime, h = e['files'][base]
+            st = os.stat(local)
+            if st.st_size != size or (st.st_mtime_ns != mtime and file_hash(local) != h):
+                missing.append((addr, fname))
+        return missing
@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from parse_outputs import NimbusLogStream, ccp_fields, ccp_log_header, ccp_log_prefix, ccp_outputs, ccp_params, default_points, record_parsed
+from util import thread_output, wait_until, warn
+
+# Live parsing of an iteration's ccp.log while its traffic runs (eval.py
+# --live). The log is tailed over the inbox's ssh connection, on a channel of
+# its own, and fed to the parser parse_outputs uses (NimbusLogStream) as it
+# comes in. The latest samples are kept in a ring buffer and shown as a line of
+# sparklines every few seconds. The parsed series also go to the iteration's
+# ccp.parsed and ccp_switch.parsed, unless they can't be made yet (--decimate
+# needs the whole log first), so there is nothing left to parse once the log
+# is collected.
+
+spark_chars = "▁▂▃▄▅▆▇█"
+spark_width = 24
+tail_chunk_size = 64 * 1024
+# how long stop waits for the tail to catch up with the end of the log
+catch_up_timeout = 10
+
+# the columns of the ring buffer, and the ones shown
+columns = ccp_log_header.split(",")
+shown = ['rin', 'rout', 'curr_q', 'elasticity2']
+
+def sparkline(values):
+    """
+    values (nan for none) as block characters, scaled to their range.
+    """
+    ok = ~np.isnan(values)
+    if not ok.any():
+        return " " * len(values)
+    lo, hi = np.nanmin(values), np.nanmax(values)
+    scaled = np.zeros(len(values), dtype=int)
+    if hi > lo:
+        scaled[ok] = np.minimum(((values[ok] - lo) / (hi - lo) * len(spark_chars)).astype(int), len(spark_chars) - 1)
+    return "".join(spark_chars[s] if k else " " for s, k in zip(scaled, ok))
+
+class Ring:
+    """
+    The latest rows of a stream of rows, up to size of them.
+    """
+    def __init__(self, size, ncols):
+        self.buf = np.full((size, ncols), np.nan)
+        self.n = 0
+
+    def push(self, rows):
+        size = len(self.buf)
+        kept = rows[-size:]
+        self.buf[(self.n + len(rows) - len(kept) + np.arange(len(kept))) % size] = kept
+        self.n += len(rows)
+
+    def latest(self):
+        size = len(self.buf)
+        if self.n < size:
+            return self.buf[:self.n]
+        return np.roll(self.buf, -(self.n % size), axis=0)
+
+class LiveCcpLog:
+    """
+    Tails the ccp.log at path on conn, from offset on, until stop.
+
+    head      : a line parsed before the log (see InboxSession.ccp_head)
+    local_log : where the log will be collected to, which says which iteration
+                it is; the parsed series are written next to it if write
+    """
+    def __init__(self, conn, path, offset, head, local_log, sample_rate, write=True, interval=5, history=10000):
+        self.conn = conn
+        self.path = path
+        self.offset = offset
+        self.local_log = local_log
+        self.sample_rate = sample_rate
+        self.write = write
+        self.interval = interval
+        self.ring = Ring(history, len(columns))
+        self.received = 0
+        self.lock = threading.Lock()
+        self.chan = None
+        self.thread = None
+
+        header, prepend = ccp_log_prefix(local_log)
+        self.outputs = ccp_outputs(local_log)
+        if write:
+            self.out = open(self.outputs[0] + ".part", 'wb')
+            self.out.write((header + "\n").encode())
+        else:
+            self.out = open(os.devnull, 'wb')
+        self.stream = NimbusLogStream(self.out, prepend, ccp_fields, sample_rate)
+        self.st = self.stream.st
+        self.st.on_rows = lambda rows: self.ring.push(rows[:, :len(columns)])
+        if head:
+            self.stream.feed((head + "\n").encode())
+
+    @classmethod
+    def start(cls, conn, path, offset, head, local_log, sample_rate, **kwargs):
+        """
+        Start tailing, or return None if the log isn't one that gets parsed.
+        """
+        if conn.dry or conn.interact or ccp_log_prefix(local_log) is None:
+            return None
+        live = cls(conn, path, offset, head, local_log, sample_rate, **kwargs)
+        live.chan = conn.client.get_transport().open_session()
+        live.chan.exec_command("tail -c +{} -F {} 2> /dev/null".format(offset + 1, path))
+        live.thread = threading.Thread(target=live.run, args=(getattr(thread_output, 'prefix', ''),), daemon=True)
+        live.thread.start()
+        return live
+
+    def run(self, prefix):
+        thread_output.prefix = prefix
+        shown_at = time.time()
+        while True:
+            try:
+                buf = self.chan.recv(tail_chunk_size)
+            except Exception:
+                break
+            if not buf:
+                break
+            with self.lock:
+                if self.stream is None:
+                    break
+                self.stream.feed(buf)
+                self.received += len(buf)
+            if time.time() - shown_at >= self.interval:
+                self.show()
+                shown_at = time.time()
+
+    def show(self):
+        with self.lock:
+            rows = self.ring.latest().copy()
+            mode = self.st.to_mode or (self.st.starting_mode or "").lower()
+        if len(rows) == 0:
+            return
+        buckets = np.array_split(rows, min(spark_width, len(rows)))
+        line = ["t={:.1f}s".format(rows[-1, 0])]
+        for name in shown:
+            c = columns.index(name)
+            means = np.array([np.nanmean(b[:, c]) if (~np.isnan(b[:, c])).any() else np.nan for b in buckets])
+            last = rows[~np.isnan(rows[:, c]), c]
+            line.append("{} {} {}".format(name, sparkline(means), "{:.4g}".format(last[-1]) if len(last) else "-"))
+        if mode:
+            line.append("mode {}".format(mode))
+        print("[live] " + "  ".join(line))
+
+    def cancel(self):
+        """
+        Stop tailing and throw away what was parsed.
+        """
+        if self.chan is not None:
+            self.chan.close()
+        with self.lock:
+            self.stream = None
+        self.out.close()
+        if self.write:
+            os.remove(self.outputs[0] + ".part")
+
+    def stop(self, size=None):
+        """
+        Stop tailing once size bytes of the log past offset (by default, all
+        of it there is now) have come in, and finish parsing. Returns how many
+        bytes were parsed, or None (and the parsed series are dropped) if the
+        tail didn't catch up.
+        """
+        if size is None:
+            res = self.conn.run_batch(["stat -c %s {}".format(self.path)])[0]
+            size = int(res.stdout.strip()) - self.offset if not res.exited and res.stdout.strip().isdigit() else None
+        caught_up = size is not None and wait_until(lambda: self.received >= size, catch_up_timeout)
+        self.chan.close()
+        self.thread.join()
+        if not caught_up:
+            warn("live parse of {} fell behind, it will be parsed once collected".format(self.path), exit=False)
+            self.cancel()
+            return None
+
+        with self.lock:
+            with open(self.outputs[1] + ".part" if self.write else os.devnull, 'w') as out_switch:
+                self.stream.finish(out_switch)
+            self.stream = None
+        self.out.close()
+        if self.write:
+            for fname in self.outputs:
+                os.replace(fname + ".part", fname)
+            record_parsed(self.local_log, self.outputs, ccp_params(self.sample_rate, None, default_points))
+        print("[live] parsed {:.1f} MB of ccp.log, {} sample(s)".format(self.received / 1e6, self.ring.n))
+        return self.received
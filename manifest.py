@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+
+# Bookkeeping for incremental parsing. For every source log parse_outputs has
+# parsed, the manifest (a json file in the experiment root) records the size,
+# mtime and content hash the log had along with the outputs made from it, so a
+# re-run only has to parse logs that are new or changed.
+
+hash_buf_size = 16 * 1024 * 1024
+
+def file_hash(fname):
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        while True:
+            buf = f.read(hash_buf_size)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+class Manifest:
+    def __init__(self, root, name="parse-manifest.json"):
+        self.root = root
+        self.path = os.path.join(root, name)
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def key(self, fname):
+        return os.path.relpath(fname, self.root)
+
+    def fresh(self, src, outputs, params=None):
+        """
+        Whether the outputs made from src are still up to date: src was parsed
+        before with the same params, every output is still there, and src has
+        the same contents. The hash is only computed when size or mtime moved.
+        """
+        e = self.entries.get(self.key(src))
+        if e is None or e['params'] != params:
+            return False
+        if sorted(e['outputs']) != sorted(self.key(o) for o in outputs):
+            return False
+        if not all(os.path.isfile(o) for o in outputs):
+            return False
+        st = os.stat(src)
+        if st.st_size != e['size']:
+            return False
+        if st.st_mtime_ns == e['mtime']:
+            return True
+        if file_hash(src) != e['hash']:
+            return False
+        # touched but unchanged (e.g. collected again), don't hash it next time
+        e['mtime'] = st.st_mtime_ns
+        return True
+
+    def record(self, src, outputs, params=None):
+        st = os.stat(src)
+        self.entries[self.key(src)] = {
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'hash': file_hash(src),
+            'params': params,
+            'outputs': [self.key(o) for o in outputs],
+        }
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
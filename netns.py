@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+
+import agenda
+import os
+import shlex
+import subprocess
+import sys
+
+from util import ConnectionWrapper, expect, fatal_warn, for_each_host
+
+# A testbed on a single Linux machine, for trying out the orchestration (and
+# timing it, see timing.py) without four real machines:
+#
+#   [topology]
+#       [topology.netns]
+#           # all optional
+#           prefix = "bnd"        # namespaces are bnd-sender, bnd-inbox, ...
+#           subnet = "10.77.0"    # the testbed's /24
+#           user = "..."          # ssh user and port for localhost
+#           port = 22
+#       [topology.inbox]
+#           listen_port = 28316
+#
+# Each host is a network namespace with veth interfaces plugged into a bridge,
+# which lives in a namespace of its own (<prefix>-lan), so the testbed is one
+# LAN just like the real ones, and nothing on the machine's own network
+# changes. As with cloudlab, the outbox and the receiver are the same host
+# (mahimahi and the outbox run there), and the inbox has two interfaces.
+#
+# The hosts are reached through ssh to localhost, so everything else works as
+# it does on real machines: each host's connection (NetnsConnection) runs its
+# commands in the host's namespace, as the ssh user. The namespaces only keep
+# the hosts' networks apart: they share the filesystem and the processes, so
+# the machine needs everything a real host does (bundler_root built, mahimahi,
+# passwordless sudo), and only one netns testbed can run on a machine at once
+# (killing one testbed's leftover processes would kill the other's).
+#
+# The namespaces are made afresh for every run, and left behind after it;
+# `python3 netns.py down` removes them (and `up` makes them, to poke at).
+
+roles = ['sender', 'inbox', 'outbox', 'receiver']
+# the namespace (host) each role runs in
+role_hosts = {'sender': 'sender', 'inbox': 'inbox', 'outbox': 'outbox', 'receiver': 'outbox'}
+host_devs = {'sender': ['eth0'], 'inbox': ['eth0', 'eth1'], 'outbox': ['eth0']}
+default_prefix = "bnd"
+default_subnet = "10.77.0"
+bridge = "br0"
+
+def netns_names(netns):
+    """
+    {host: namespace name} for the [topology.netns] table netns, and the
+    name of the namespace with the bridge.
+    """
+    prefix = netns.get('prefix', default_prefix)
+    return dict((h, "{}-{}".format(prefix, h)) for h in host_devs), "{}-lan".format(prefix)
+
+def make_netns_topology(config):
+    """
+    Fill in the hosts of a netns testbed's topology, keeping anything the
+    config sets for them (like the inbox's listen_port).
+    """
+    netns = config['topology']['netns']
+    subnet = netns.get('subnet', default_subnet)
+    names, _ = netns_names(netns)
+    addrs = {}
+    n = 0
+    for h, devs in host_devs.items():
+        addrs[h] = []
+        for dev in devs:
+            n += 1
+            addrs[h].append({'dev': dev, 'addr': "{}.{}".format(subnet, n)})
+    for role in roles:
+        h = role_hosts[role]
+        overrides = config['topology'].get(role, {})
+        config['topology'][role] = {'name': names[h], 'ifaces': [dict(i) for i in addrs[h]]}
+        config['topology'][role].update(overrides)
+    return config
+
+def setup_commands(topology):
+    """
+    The commands (to run as root) that make the namespaces of a netns
+    topology (filled in by make_netns_topology), after removing any left
+    from before.
+    """
+    prefix = topology['netns'].get('prefix', default_prefix)
+    names, lan = netns_names(topology['netns'])
+    ifaces = dict((topology[role]['name'], topology[role]['ifaces']) for role in roles)
+    cmds = teardown_commands(topology)
+    cmds += [
+        "ip netns add {}".format(lan),
+        "ip -n {} link set lo up".format(lan),
+        "ip -n {} link add {} type bridge".format(lan, bridge),
+        "ip -n {} link set {} up".format(lan, bridge),
+    ]
+    k = 0
+    for h in host_devs:
+        ns = names[h]
+        cmds += [
+            "ip netns add {}".format(ns),
+            "ip -n {} link set lo up".format(ns),
+        ]
+        if h == 'inbox':
+            # the inbox forwards out the interface packets came in on, which
+            # would otherwise get the sender redirected around it; and with
+            # two interfaces on one LAN, each answers ARP for its own address
+            cmds += ["ip netns exec {} sysctl -w net.ipv4.conf.{}.{}".format(ns, conf, setting) for conf in ['all', 'default'] for setting in [
+                "send_redirects=0",
+                "arp_ignore=1",
+                "arp_announce=2",
+            ]]
+        for iface in ifaces[ns]:
+            # made in this namespace and then moved, so the names only have to
+            # be unique here while they are
+            k += 1
+            host_end, lan_end = "{}h{}".format(prefix, k), "{}p{}".format(prefix, k)
+            cmds += [
+                "ip link add {} type veth peer name {}".format(host_end, lan_end),
+                "ip link set {} netns {}".format(host_end, ns),
+                "ip -n {} link set {} name {}".format(ns, host_end, iface['dev']),
+                "ip -n {} addr add {}/24 dev {}".format(ns, iface['addr'], iface['dev']),
+                "ip -n {} link set {} up".format(ns, iface['dev']),
+                "ip link set {} netns {}".format(lan_end, lan),
+                "ip -n {} link set {} master {}".format(lan, lan_end, bridge),
+                "ip -n {} link set {} up".format(lan, lan_end),
+            ]
+    return cmds
+
+def teardown_commands(topology):
+    """
+    The commands (to run as root) that remove a netns topology's namespaces,
+    and with them their interfaces.
+    """
+    names, lan = netns_names(topology['netns'])
+    return ["ip netns del {} 2> /dev/null || true".format(ns) for ns in list(names.values()) + [lan]]
+
+def in_netns(netns, cmd):
+    """
+    cmd (a shell command) run in the namespace netns, as the user running it.
+    """
+    return "sudo -n ip netns exec {} sudo -n -H -u \"$(id -un)\" -- bash -c {}".format(netns, shlex.quote(cmd))
+
+class NetnsConnection(ConnectionWrapper):
+    """
+    A host of a netns testbed: a connection to this machine whose commands run
+    in the network namespace netns. Files are this machine's own.
+    """
+    def __init__(self, netns, nickname, **kwargs):
+        self.netns = netns
+        super().__init__('localhost', nickname, **kwargs)
+
+    def remote_exec(self, full_cmd, *args, **kwargs):
+        return super().remote_exec(in_netns(self.netns, full_cmd), *args, **kwargs)
+
+def create_netns_connections(config):
+    """
+    Make the namespaces of a netns testbed and connect to its hosts, like
+    create_ssh_connections does to real ones.
+    """
+    agenda.task("Creating network namespaces")
+    args = config['args']
+    topology = config['topology']
+    netns = topology['netns']
+    kwargs = dict(user=netns.get('user'), port=netns.get('port'), dry=args.dry_run, verbose=args.verbose, interact=args.interact)
+
+    local = ConnectionWrapper('localhost', nickname='netns', **kwargs)
+    cmds = setup_commands(topology)
+    results = local.run_batch(cmds, sudo=True)
+    failed = [res for res in results if res.exited]
+    for res in failed:
+        expect(res, "Failed to set up network namespaces")
+    local.close()
+    if failed:
+        fatal_warn("Could not create the netns testbed (see above); `python3 netns.py down` removes what was made.")
+
+    # one connection per host, named (and nicknamed) as create_ssh_connections does
+    hosts = {}
+    for role in roles:
+        hosts.setdefault(topology[role]['name'], role)
+    def connect(ns):
+        agenda.subtask(ns)
+        return NetnsConnection(ns, nickname=hosts[ns], agent=args.agent, **kwargs)
+
+    conns = dict(zip(hosts, for_each_host(hosts, connect, host=lambda ns: ns, serial=args.interact)))
+    machines = dict((role, conns[topology[role]['name']]) for role in roles)
+    return (conns, machines)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Make or remove the namespaces of a netns testbed")
+    parser.add_argument("action", choices=["up", "down"])
+    parser.add_argument("--prefix", default=default_prefix)
+    parser.add_argument("--subnet", default=default_subnet)
+    args = parser.parse_args()
+
+    config = make_netns_topology({'topology': {'netns': {'prefix': args.prefix, 'subnet': args.subnet}}})
+    cmds = setup_commands(config['topology']) if args.action == "up" else teardown_commands(config['topology'])
+    sudo = [] if os.geteuid() == 0 else ["sudo"]
+    for cmd in cmds:
+        res = subprocess.run(sudo + ["bash", "-c", cmd], capture_output=True, text=True)
+        if res.returncode:
+            sys.exit("{} failed: {}".format(cmd, res.stderr.strip()))
+    if args.action == "up":
+        for role in roles:
+            print("{:<10} {:<12} {}".format(role, config['topology'][role]['name'], ", ".join(
+                "{} {}".format(i['dev'], i['addr']) for i in config['topology'][role]['ifaces'])))
@@ -1,157 +1,775 @@
+from concurrent.futures import ProcessPoolExecutor
+from columnize import columnize, parse_cross_traffic_pattern
+from compressed import find_logs, log_name, open_log
+from decimate import Decimator, bucket_width, modes as decimate_modes
 from graph import write_rmd
+import columnar
+from manifest import Manifest
 import agenda
 import glob
+import itertools
+import json
+import numpy as np
 import os
 import re
-import subprocess
-import sys
-
-def parse_nimbus_log(f, out, out_switch, header, prepend, fields, sample_rate):
-    i=0
-    e2 = None
-    xtcp_regions = []
-    to_mode = None
-    last_switch = 0
-    xmax = 0
-    starting_mode = None
-    for l in f:
+import shutil
+
+# a log that starts partway through ccp's run (an iteration's part of a ccp.log
+# that was kept running, see inbox_session.py) says where in its starting line
+start_elapsed_expr = re.compile("elapsed: ([0-9.]+)")
+# and which mode it started in
+flow_mode_expr = re.compile("flow_mode: ([^,]+)")
+
+# the log is read (and its rows written) this much at a time
+nimbus_block_size = 1024 * 1024
+
+class NimbusLogState:
+    def __init__(self):
+        self.i = 0
+        self.e2 = None
+        self.xmax = 0
+        self.xtcp_regions = []
+        self.to_mode = None
+        self.last_switch = 0
+        self.starting_mode = None
+        # elapsed time at the start of the log
+        self.start = 0
+        self.decimator = None
+        # called with the rows of every block before they are written
+        self.on_rows = None
+        # whether blocks are parsed a column at a time where they can be
+        self.columns = True
+
+# numbers this big or bigger are left to the line parser: past them,
+# str(round(v, 3)) isn't just v's digits to 3 decimal places
+nimbus_max_value = 1e11
+# and so are numbers wider than this (with a sign, dot and trailing comma)
+nimbus_token_width = 20
+powers_of_ten = 10 ** np.arange(19, dtype=np.int64)
+# smaller blocks (say, of a live log fed a little at a time) are parsed a line
+# at a time, as numpy's overhead per block outweighs what it saves on them
+nimbus_columns_min_size = 64 * 1024
+
+def find_all(arr, pattern, anchor=0):
+    """
+    Where in arr (a block as uint8) pattern (bytes) starts. Candidates are
+    found by pattern[anchor], so that is best a char that is rare in arr.
+    """
+    at = np.flatnonzero(arr[anchor:len(arr) - len(pattern) + 1 + anchor] == pattern[anchor])
+    for j in range(len(pattern)):
+        if j != anchor:
+            at = at[arr[at + j] == pattern[j]]
+    return at
+
+def lines_with(arr, ends, pattern, anchor=0):
+    """
+    Which of the lines (ending at ends) of arr contain pattern, as a mask.
+    """
+    mask = np.zeros(len(ends), dtype=bool)
+    mask[np.searchsorted(ends, find_all(arr, pattern, anchor))] = True
+    return mask
+
+def nimbus_tokens(arr, sp, starts, ends, tokens):
+    """
+    The given (0-based) space separated tokens of the lines from starts to
+    ends of arr (whose spaces are at sp), less any trailing comma: an array of
+    chars with a column per token, line by line, padded with zeros. None if a
+    line is too short, or a token empty or too wide.
+    """
+    tokens = np.asarray(tokens)
+    q = np.searchsorted(sp, starts)
+    # token t runs from after the line's t-th space to its (t+1)-th
+    sp = np.append(sp, np.full(tokens.max() + 1, len(arr)))
+    b = np.where(tokens == 0, starts[:, None], sp[q[:, None] + np.maximum(tokens - 1, 0)] + 1).ravel()
+    e = np.minimum(sp[q[:, None] + tokens], ends[:, None]).ravel()
+    if len(e) == 0 or (e <= b).any():
+        return None
+    e -= arr[e - 1] == ord(',')
+    w = e - b
+    if w.max() > nimbus_token_width:
+        return None
+    # past its end a token reads the zero after arr
+    pos = np.arange(w.max())[:, None]
+    return np.append(arr, np.uint8(0))[np.where(pos < w, b + pos, len(arr))]
+
+def parse_thousandths(chars):
+    """
+    round(float(t), 3) of every token t (a column of chars, see
+    nimbus_tokens) as a whole number of thousandths, and whether it is a
+    negative zero. None unless every token is a plain decimal number (say,
+    -1.25), and not too big.
+    """
+    n = chars.shape[1]
+    neg = chars[0] == ord('-')
+    signed = neg | (chars[0] == ord('+'))
+    m = np.zeros(n, dtype=np.int64)
+    digits = np.zeros(n, dtype=np.int64)
+    decimals = np.zeros(n, dtype=np.int64)
+    dots = np.zeros(n, dtype=np.int64)
+    for p, c in enumerate(chars):
+        d = c - np.uint8(ord('0'))
+        digit = d <= 9
+        dot = c == ord('.')
+        ok = digit | dot | (c == 0)
+        if p == 0:
+            ok |= signed
+        if not ok.all():
+            return None
+        m = np.where(digit, m * 10 + d, m)
+        digits += digit
+        dots += dot
+        decimals += digit & (dots > 0)
+    if (dots > 1).any() or digits.min() == 0 or digits.max() > 15:
+        return None
+    # exactly float(t), as m and the power of ten are exact doubles
+    x = m / powers_of_ten[decimals].astype(np.float64)
+    if x.max() >= nimbus_max_value:
+        return None
+    k = m * powers_of_ten[np.maximum(3 - decimals, 0)]
+    more = decimals > 3
+    if more.any():
+        # round() rounds the exact double, which x * 1000 is only close to;
+        # the few that are too close to a tie to tell are left to round()
+        y = x[more] * 1000
+        rounded = np.rint(y)
+        close = np.abs(y - np.floor(y) - 0.5) <= 4 * np.spacing(y)
+        if close.any():
+            signs = np.where(neg[more][close], -1, 1)
+            rounded[close] = [abs(round(round(float(v), 3) * 1000)) for v in x[more][close] * signs]
+        k[more] = rounded.astype(np.int64)
+    return np.where(neg, -k, k), neg & (k == 0)
+
+def format_thousandths(k, negzero):
+    """
+    str() of the floats k / 1000 (or -0.0 where negzero), as an array of chars
+    with a column per value, padded with zeros.
+    """
+    ip, fp = np.divmod(np.abs(k), 1000)
+    nd = len(str(int(ip.max(initial=0))))
+    out = np.zeros((nd + 5, len(k)), dtype=np.uint8)
+    out[0] = np.where((k < 0) | negzero, ord('-'), 0)
+    for p in range(nd, 0, -1):
+        ip, d = np.divmod(ip, 10)
+        out[p] = ord('0') + d
+    # leading zeros are left out, but not the ones digit
+    lead = np.cumsum(out[1:nd] != ord('0'), axis=0) == 0
+    out[1:nd][lead] = 0
+    out[nd + 1] = ord('.')
+    out[nd + 2] = ord('0') + fp // 100
+    out[nd + 3] = np.where(fp % 100 != 0, ord('0') + fp // 10 % 10, 0)
+    out[nd + 4] = np.where(fp % 10 != 0, ord('0') + fp % 10, 0)
+    return out
+
+def parse_nimbus_columns(block, prepend, fields, sample_rate, st, keep):
+    """
+    parse_nimbus_lines, done with numpy over the whole block: every value of
+    a field is pulled out, rounded and written at once. Returns None, having
+    left st as it was, if the block has anything it doesn't handle the same
+    way (non-ASCII text, a number it can't read exactly, a line that is more
+    than one kind); the line parser does those.
+    """
+    if not block.isascii():
+        return None
+    arr = np.frombuffer(block, np.uint8)
+    ends = np.append(np.flatnonzero(arr == ord('\n')), len(arr))
+    starts = np.append(0, ends[:-1] + 1)
+    rin = lines_with(arr, ends, b'rin', 2)
+    elasticity = lines_with(arr, ends, b'elasticity_inf', 9)
+    mode = lines_with(arr, ends, b'switched mode', 1) | lines_with(arr, ends, b'[nimbus] starting', 16)
+    if (rin & elasticity).any() or ((rin | elasticity) & mode).any():
+        return None
+    sp = np.flatnonzero(arr == ord(' '))
+
+    # every rin line counts towards sample_rate, and the counted ones are
+    # written
+    ri = np.flatnonzero(rin)
+    sampled = np.flatnonzero((st.i + np.arange(len(ri))) % sample_rate == 0)
+    rs = ri[sampled]
+    # elasticity lines set e2 for the next rin line, if they come while the
+    # count is on a written one
+    ei = np.flatnonzero(elasticity)
+    group = np.searchsorted(ri, ei)
+    active = (st.i + group) % sample_rate == 0
+    ei, group = ei[active], group[active]
+    # strip() would shift the tokens of a line that starts with whitespace
+    if (arr[np.minimum(starts[np.append(rs, ei)], len(arr) - 1)] <= ord(' ')).any():
+        return None
+
+    idx = [field - 1 for field in fields]
+    # the values, with elapsed (sp[8]) after them for xmax
+    k = np.zeros((0, len(idx) + 1), dtype=np.int64)
+    negzero = np.zeros(k.shape, dtype=bool)
+    if len(rs):
+        res = nimbus_tokens(arr, sp, starts[rs], ends[rs], idx + [8])
+        res = parse_thousandths(res) if res is not None else None
+        if res is None:
+            return None
+        k, negzero = (a.reshape(len(rs), len(idx) + 1) for a in res)
+    # e2 as each rin line sees it, and as the next block will
+    e2 = np.zeros(len(ri) + 1, dtype=np.int64)
+    e2neg = np.zeros(len(ri) + 1, dtype=bool)
+    e2set = np.zeros(len(ri) + 1, dtype=bool)
+    if st.e2 is not None:
+        if not abs(st.e2) < nimbus_max_value:
+            return None
+        e2[0], e2neg[0], e2set[0] = round(st.e2 * 1000), np.signbit(st.e2), True
+    if len(ei):
+        res = nimbus_tokens(arr, sp, starts[ei], ends[ei], [13])
+        res = parse_thousandths(res) if res is not None else None
+        if res is None:
+            return None
+        # the last one before a rin line is the one it sees
+        last = np.append(group[1:] != group[:-1], True)
+        e2[group[last]] = res[0][last]
+        e2neg[group[last]] = res[1][last]
+        e2set[group[last]] = True
+
+    if len(ri):
+        st.i += len(ri)
+        st.e2 = None
+    if e2set[-1]:
+        st.e2 = -0.0 if e2neg[-1] else e2[-1] / 1000
+    if len(rs):
+        st.xmax = float(block[starts[rs[-1]]:ends[rs[-1]]].replace(b",", b"").split(b" ")[8])
+    for j in np.flatnonzero(mode):
+        l = block[starts[j]:ends[j]].decode()
         if '[nimbus] starting' in l:
-            mode_expr = re.compile("flow_mode: ([^,]+)")
-            res = mode_expr.search(l)
-            starting_mode = res.groups()[0]
+            parse_nimbus_starting(l, st)
+        if 'switched mode' in l:
+            parse_nimbus_switch(l, st)
+
+    # a zero elasticity is falsy, so it is left blank like a missing one
+    present = e2set[sampled] & (e2[sampled] != 0)
+    k, negzero, e2, e2neg = k[:, :-1], negzero[:, :-1], e2[sampled], e2neg[sampled]
+    if keep:
+        return np.column_stack((np.where(negzero, -0.0, k / 1000), np.where(present, e2 / 1000, np.nan), present))
+    n = len(rs)
+    if n == 0:
+        return b""
+    # a row's chars are prepend, the values each followed by a comma, e2 and
+    # a newline, with the padding squeezed out at the end
+    values = format_thousandths(k.ravel(), negzero.ravel())
+    values = np.concatenate((values, np.full((1, values.shape[1]), ord(','), np.uint8)))
+    values = values.reshape(len(values), n, len(idx)).transpose(1, 2, 0).reshape(n, -1)
+    e2 = format_thousandths(e2, e2neg).T * present[:, None]
+    head = np.frombuffer(prepend.encode() + b",", np.uint8)
+    text = np.concatenate((np.broadcast_to(head, (n, len(head))), values, e2, np.full((n, 1), ord('\n'), np.uint8)), axis=1).ravel()
+    return text[text != 0].tobytes()
+
+def parse_nimbus_lines(block, prepend, fields, sample_rate, st, keep):
+    """
+    Parse a block a line at a time. Returns the rows: as text (bytes), or as
+    values (see write_nimbus_rows) if keep.
+    """
+    idx = [field - 1 for field in fields]
+    rows = []
+    for l in block.decode().split("\n"):
+        if '[nimbus] starting' in l:
+            parse_nimbus_starting(l, st)
         if 'elasticity_inf' in l:
-            if i % sample_rate == 0:
+            if st.i % sample_rate == 0:
                 try:
                     sp = l.strip().split(" ")
-                    e2 = round(float(sp[13].replace(",", "")),3)
-                except:
+                    st.e2 = round(float(sp[13].replace(",", "")),3)
+                except (IndexError, ValueError):
                     pass
         if 'rin' in l:
             try:
-                if i % sample_rate == 0:
+                if st.i % sample_rate == 0:
                     sp = l.strip().replace(",", "").split(" ")
-                    xmax = float(sp[8])
-                    out.write(
-                        prepend + "," +
-                        ','.join([str(round(float(sp[field-1]),3)) for field in fields]) +
-                        ',' + (str(e2) if e2 else '') +
-                        "\n"
-                    )
-                e2=None
-                i+=1
-            except:
+                    st.xmax = float(sp[8])
+                    row = [round(float(sp[k]),3) for k in idx]
+                    if keep:
+                        # a zero elasticity is falsy, so it is left blank like a missing one
+                        rows.append(row + ([st.e2, 1] if st.e2 else [np.nan, 0]))
+                    else:
+                        rows.append(prepend + "," + ",".join([str(v) for v in row]) + "," + (str(st.e2) if st.e2 else "") + "\n")
+                st.e2 = None
+                st.i += 1
+            except (IndexError, ValueError):
                 continue
         if 'switched mode' in l:
-            sp = l.strip().split(" ")
-
-            if sp[7] == 'XTCP,':
-                elapsed = float(sp[11].replace(",", ""))
-                from_mode = 'delay'
-                to_mode = 'xtcp'
-                #delay_threshold = ''
-            else:
-                elapsed = float(sp[13].replace(",", ""))
-                from_mode = 'xtcp'
-                to_mode = 'delay'
-                #delay_threshold = float(sp[7].replace(",", ""))
-
-            if from_mode == 'xtcp':
-                xtcp_regions.append((last_switch, elapsed))
-            last_switch = elapsed
-            #out_switch.write("{elapsed},{from_mode},{to_mode},{thresh}\n".format(
-            #    elapsed=elapsed,
-            #    from_mode=from_mode,
-            #    to_mode=to_mode,
-            #    thresh=delay_threshold,
-            #))
-    if to_mode == 'xtcp':
-        xtcp_regions.append((last_switch, 'Inf'))
-
-    out_switch.write("xmin,xmax,ymin,ymax\n")
-    for (xmin,xmax) in xtcp_regions:
-        out_switch.write("{},{},-Inf,Inf\n".format(xmin,xmax))
-    if not xtcp_regions and starting_mode == "XTCP":
-        out_switch.write("{},{},-Inf,Inf\n".format(0, xmax))
-
-def parse_ccp_logs(dirname, sample_rate, replot):
-    agenda.subtask("ccp logs")
-    fields = [9,17,19,27,29,35,13]
-    log_header = "elapsed,rtt,zt,rout,rin,curr_rate,curr_q,elasticity2"
-    pattern = re.compile(r'(?P<sch>[a-z]+)_(?P<bw>[\d]+)_(?P<delay>[\d]+)/(?P<alg>[a-z_]+).(?P<args>[a-z_]+=[a-zA-Z_0-9].+)?/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/ccp.log')
+            parse_nimbus_switch(l, st)
+    if keep:
+        return np.array(rows)
+    return "".join(rows).encode()
 
-    g = glob.glob(dirname + "/**/ccp.log", recursive=True)
+def parse_nimbus_block(block, out, prepend, fields, sample_rate, st):
+    """
+    Parse one block (bytes) of complete lines, carrying the sample counter,
+    pending elasticity value and mode-switch state in st from block to block.
+    A block goes to parse_nimbus_columns, and to parse_nimbus_lines if that
+    can't take it (or st.columns is off); both write the same rows.
+    """
+    # rows are kept as values only if something needs them, else as text
+    keep = st.decimator is not None or st.on_rows is not None
+    rows = None
+    if st.columns and len(block) >= nimbus_columns_min_size:
+        rows = parse_nimbus_columns(block, prepend, fields, sample_rate, st, keep)
+    if rows is None:
+        rows = parse_nimbus_lines(block, prepend, fields, sample_rate, st, keep)
+    if not keep:
+        out.write(rows)
+        return
+    if len(rows):
+        if st.decimator is not None:
+            rows = st.decimator.push(rows)
+        if st.on_rows is not None:
+            st.on_rows(rows)
+        write_nimbus_rows(out, prepend, rows.tolist())
 
-    global_out_fname = os.path.join(dirname, 'ccp.parsed')
-    if not replot and os.path.isfile(global_out_fname):
-        return global_out_fname, len(g)
+def write_nimbus_rows(out, prepend, rows):
+    """
+    rows are the output fields, then elasticity and whether it is present.
+    """
+    out.write("".join(
+        prepend + "," + ",".join(str(v) for v in row[:-2]) + "," + (str(row[-2]) if row[-1] else "") + "\n"
+        for row in rows
+    ).encode())
 
-    for exp in g:
-        exp_root = "/".join(exp.split("/")[:-1])
-        old_header = None
-        matches = pattern.search(exp)
-        if matches is not None and 'nimbus' in exp:
-            print(exp)
-            with open(exp) as f, open(os.path.join(exp_root, "ccp.parsed"), 'w') as out, open(os.path.join(exp_root, "ccp_switch.parsed"), 'w') as out_switch:
-                sch, bw, delay, args, bg, cross, seed, alg = matches.group('sch', 'bw', 'delay', 'args', 'bg', 'cross', 'seed', 'alg')
-                args = [a.split("=") for a in args.split(".")] if args else []
-                exp_header = f"sch,alg,rate,rtt,{','.join(a[0] for a in args)},bundle,cross,seed"
-                header = exp_header + "," + log_header
-                if old_header and old_header != header:
-                    exit("headers do not align")
-                old_header = header
-                out.write(header + "\n")
-                bg = bg if bg != '' else 'None'
-                cross = cross if cross != '' else 'None'
-                prepend = f"{sch},{alg},{bw},{delay},{','.join(a[1] for a in args)},{bg},{cross},{seed}"
-                parse_nimbus_log(f, out, out_switch, header, prepend, fields, sample_rate)
-        else:
-            print(f"skipping {exp}, no regex match")
+def nimbus_log_span(f, window=1024*1024):
+    """
+    elapsed time between the first and last rin lines of f (sp[8]), found by
+    only reading the start and end of the file. None if it can't be found.
+    If f can't seek (a compressed log), it is read to the end instead, and
+    left there.
+    """
+    def elapsed(lines):
+        for l in lines:
+            sp = l.strip().split(b" ")
+            if b'rin' in l and len(sp) > 8:
+                try:
+                    return float(sp[8].replace(b",", b""))
+                except ValueError:
+                    continue
+        return None
+
+    if f.seekable():
+        size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        head = f.read(window)
+        f.seek(max(0, size - window))
+        tail = f.read()
+        f.seek(0)
+    else:
+        head = tail = f.read(window)
+        while True:
+            buf = f.read(window)
+            if not buf:
+                break
+            tail = (tail + buf)[-window:]
+    first = elapsed(head.split(b"\n")[:-1])
+    last = elapsed(reversed(tail.split(b"\n")[1:]))
+    if first is None or last is None or last <= first:
+        return None
+    return last - first
+
+def parse_nimbus_starting(l, st):
+    st.starting_mode = flow_mode_expr.search(l).groups()[0]
+    res = start_elapsed_expr.search(l)
+    if res:
+        st.start = st.last_switch = float(res.groups()[0])
+
+def parse_nimbus_switch(l, st):
+    sp = l.strip().split(" ")
+
+    if sp[7] == 'XTCP,':
+        elapsed = float(sp[11].replace(",", ""))
+        from_mode = 'delay'
+        st.to_mode = 'xtcp'
+    else:
+        elapsed = float(sp[13].replace(",", ""))
+        from_mode = 'xtcp'
+        st.to_mode = 'delay'
+
+    if from_mode == 'xtcp':
+        st.xtcp_regions.append((st.last_switch, elapsed))
+    st.last_switch = elapsed
+
+def parse_nimbus_log(f, out, out_switch, header, prepend, fields, sample_rate, decimate=None, points=None, span=None):
+    """
+    Parse a nimbus log f (opened in binary mode): every sample_rate-th
+    measurement becomes a row of prepend, its fields rounded to 3 decimals and
+    the elasticity last seen before it, written to out (binary too), and the
+    XTCP regions go to out_switch. The log is read and parsed a block at a
+    time, so memory stays bounded however big it is. With decimate, the rows
+    are further reduced to about points per series (see decimate.py); span is
+    nimbus_log_span of the log, which is found from f if it can seek.
+    """
+    decimator = None
+    if decimate is not None:
+        if span is None and f.seekable():
+            span = nimbus_log_span(f)
+        if span is not None:
+            num_series = len(fields)
+            decimator = Decimator(decimate, bucket_width(decimate, span, num_series, points), 0, range(1, num_series + 1))
+    stream = NimbusLogStream(out, prepend, fields, sample_rate, decimator)
+    while True:
+        buf = f.read(nimbus_block_size)
+        if not buf:
+            break
+        stream.feed(buf)
+    stream.finish(out_switch)
+
+class NimbusLogStream:
+    """
+    parse_nimbus_log for a log that arrives a piece at a time (say, while it is
+    still being written): feed it the log's bytes in any chunks, then finish.
+    Only complete lines are parsed as they come in, so the output is the same
+    however the log is cut up.
+    """
+    def __init__(self, out, prepend, fields, sample_rate, decimator=None):
+        self.out = out
+        self.prepend = prepend
+        self.fields = fields
+        self.sample_rate = sample_rate
+        self.st = NimbusLogState()
+        self.st.decimator = decimator
+        self.rest = b''
+
+    def feed(self, buf):
+        buf = self.rest + buf
+        end = buf.rfind(b'\n')
+        if end < 0:
+            self.rest = buf
+            return
+        self.rest = buf[end + 1:]
+        parse_nimbus_block(buf[:end], self.out, self.prepend, self.fields, self.sample_rate, self.st)
+
+    def finish(self, out_switch):
+        """
+        Parse whatever is left of the log and write the mode switches to
+        out_switch (text).
+        """
+        st = self.st
+        if self.rest:
+            parse_nimbus_block(self.rest, self.out, self.prepend, self.fields, self.sample_rate, st)
+            self.rest = b''
+        if st.decimator is not None:
+            rows = st.decimator.flush()
+            if rows is not None:
+                if st.on_rows is not None:
+                    st.on_rows(rows)
+                write_nimbus_rows(self.out, self.prepend, rows.tolist())
+
+        if st.to_mode == 'xtcp':
+            st.xtcp_regions.append((st.last_switch, 'Inf'))
+
+        out_switch.write("xmin,xmax,ymin,ymax\n")
+        for (xmin,xmax) in st.xtcp_regions:
+            out_switch.write("{},{},-Inf,Inf\n".format(xmin,xmax))
+        if not st.xtcp_regions and st.starting_mode == "XTCP":
+            out_switch.write("{},{},-Inf,Inf\n".format(st.start, st.xmax))
+
+ccp_fields = [9,17,19,27,29,35,13]
+ccp_log_header = "elapsed,rtt,zt,rout,rin,curr_rate,curr_q,elasticity2"
+ccp_log_pattern = re.compile(r'(?P<sch>[a-z]+)_(?P<bw>[\d]+)_(?P<delay>[\d]+)/(?P<alg>[a-z_]+).(?P<args>[a-z_]+=[a-zA-Z_0-9].+)?/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/ccp.log(\.gz|\.zst)?$')
+
+def ccp_log_prefix(exp):
+    """
+    The header of ccp.parsed for the ccp.log exp, and the experiment setup
+    columns that go at the start of each of its lines, both from exp's path.
+    None if exp isn't a nimbus log of an iteration.
+    """
+    matches = ccp_log_pattern.search(exp)
+    if matches is None or 'nimbus' not in exp:
+        return None
+    sch, bw, delay, args, bg, cross, seed, alg = matches.group('sch', 'bw', 'delay', 'args', 'bg', 'cross', 'seed', 'alg')
+    args = [a.split("=") for a in args.split(".")] if args else []
+    exp_header = f"sch,alg,rate,rtt,{','.join(a[0] for a in args)},bundle,cross,seed"
+    bg = bg if bg != '' else 'None'
+    cross = cross if cross != '' else 'None'
+    prepend = f"{sch},{alg},{bw},{delay},{','.join(a[1] for a in args)},{bg},{cross},{seed}"
+    return exp_header + "," + ccp_log_header, prepend
+
+def parse_ccp_iteration(exp, sample_rate, decimate=None, points=None):
+    """
+    Parse a single iteration's ccp.log (which may be compressed) into
+    ccp.parsed and ccp_switch.parsed next to it. Returns the header that was
+    written, or None if the log was skipped. Must stay a module-level function
+    so it can be sent to a worker.
+    """
+    exp_root = os.path.dirname(exp)
+    prefix = ccp_log_prefix(exp)
+    if prefix is None:
+        print(f"skipping {exp}, no regex match")
+        return None
+    header, prepend = prefix
+
+    print(exp)
+    span = None
+    if decimate is not None:
+        with open_log(exp) as f:
+            if not f.seekable():
+                # a compressed log can't be skipped through, so this takes a
+                # pass over it of its own
+                span = nimbus_log_span(f)
+    with open_log(exp) as f, open(os.path.join(exp_root, "ccp.parsed"), 'wb') as out, open(os.path.join(exp_root, "ccp_switch.parsed"), 'w') as out_switch:
+        out.write((header + "\n").encode())
+        parse_nimbus_log(f, out, out_switch, header, prepend, ccp_fields, sample_rate, decimate, points, span)
+    return header
+
+def ccp_outputs(exp):
+    exp_root = os.path.dirname(exp)
+    return [os.path.join(exp_root, "ccp.parsed"), os.path.join(exp_root, "ccp_switch.parsed")]
 
+def ccp_params(sample_rate, decimate, points):
+    return [sample_rate, decimate, points]
+
+# logs that were parsed before they were collected, on their host
+# (eval.py --parse-on-host, see host_parse.py) or as they were written
+# (eval.py --live, see live.py), are recorded in this file next to them
+host_parsed_name = "host-parsed.json"
+
+def record_parsed(exp, outputs, params):
+    """
+    Record that the log exp was parsed into outputs with params.
+    """
+    fname = os.path.join(os.path.dirname(exp), host_parsed_name)
+    try:
+        with open(fname) as f:
+            entries = json.load(f)
+    except (FileNotFoundError, ValueError):
+        entries = {}
+    entries[os.path.basename(log_name(exp))] = {
+        'params': params,
+        'outputs': [os.path.basename(o) for o in outputs],
+    }
+    with open(fname + ".tmp", 'w') as f:
+        json.dump(entries, f)
+    os.replace(fname + ".tmp", fname)
+    return fname
+
+def host_parsed(exp, outputs, params):
+    """
+    Whether the log exp was already parsed into outputs, with params, before
+    it was collected (see record_parsed), and the outputs are all there.
+    """
+    try:
+        with open(os.path.join(os.path.dirname(exp), host_parsed_name)) as f:
+            e = json.load(f).get(os.path.basename(log_name(exp)))
+    except (FileNotFoundError, ValueError):
+        return False
+    return (
+        e is not None and
+        e['params'] == params and
+        e['outputs'] == [os.path.basename(o) for o in outputs] and
+        all(os.path.isfile(o) for o in outputs)
+    )
+
+def parse_ccp_logs(dirname, sample_rate, replot, manifest, workers=1, decimate=None, points=None):
+    agenda.subtask("ccp logs")
+
+    g = find_logs(dirname, "ccp.log")
     global_out_fname = os.path.join(dirname, 'ccp.parsed')
-    subprocess.call(f"rm -f {global_out_fname}", shell=True)
-    g = glob.glob(dirname + "/**/ccp.parsed", recursive=True)
-    tail = 1
+
+    params = ccp_params(sample_rate, decimate, points)
+    todo = []
     for exp in g:
-        if exp != global_out_fname:
-            subprocess.call(f"tail -n +{tail} {exp} >> {global_out_fname}", shell=True)
-            if tail == 1:
-                tail = 2
+        if not replot and manifest.fresh(exp, ccp_outputs(exp), params):
+            continue
+        if not replot and host_parsed(exp, ccp_outputs(exp), params):
+            manifest.record(exp, ccp_outputs(exp), params)
+            continue
+        todo.append(exp)
+    print(f"{len(todo)}/{len(g)} ccp logs new or changed")
+
+    if workers > 1 and len(todo) > 1:
+        # each worker picks up a contiguous shard of iteration directories
+        chunksize = max(1, len(todo) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            headers = list(pool.map(parse_ccp_iteration, todo, itertools.repeat(sample_rate), itertools.repeat(decimate), itertools.repeat(points), chunksize=chunksize))
+    else:
+        headers = [parse_ccp_iteration(exp, sample_rate, decimate, points) for exp in todo]
+    for exp, header in zip(todo, headers):
+        if header is not None:
+            manifest.record(exp, ccp_outputs(exp), params)
+
+    # logs parsed on their hosts only send back their ccp.parsed
+    g = [exp for exp in glob.glob(dirname + "/**/ccp.parsed", recursive=True) if exp != global_out_fname]
+    if todo or not os.path.isfile(global_out_fname) or any(out_of_date(exp, global_out_fname) for exp in g):
+        merge_parsed(g, global_out_fname)
 
     return global_out_fname, len(g)
 
-def parse_mahimahi_logs(dirname, sample_rate, replot, bundler_root):
+merge_buf_size = 16 * 1024 * 1024
+
+def merge_parsed(fnames, out_fname):
+    """
+    Concatenate the csv files fnames into out_fname, keeping only the first
+    file's header; every other header must match it. The merged file is built
+    next to out_fname and renamed over it, so a crash never leaves a partial
+    file behind.
+    """
+    tmp_fname = out_fname + ".tmp"
+    header = None
+    with open(tmp_fname, 'wb') as out:
+        for fname in fnames:
+            with open(fname, 'rb') as f:
+                h = f.readline()
+                if not h:
+                    continue
+                if header is None:
+                    header = h
+                    out.write(h)
+                elif h != header:
+                    os.remove(tmp_fname)
+                    exit(f"headers do not align: {fname}")
+                shutil.copyfileobj(f, out, merge_buf_size)
+    os.replace(tmp_fname, out_fname)
+
+mm_aggs = "5000:6000=bundle,8000:9000=cross"
+mm_log_pattern = re.compile(r'(?P<sch>[a-z]+)_(?P<bw>[\d]+)_(?P<delay>[\d]+)/(?P<alg>[a-zA-Z]+).(?P<args>[a-z_]+=[a-zA-Z_0-9].+)?/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/downlink.log(\.gz|\.zst)?$')
+
+def parse_port_aggs(aggs):
+    """
+    "5000:6000=bundle,8000:9000=cross" -> [(5000, 6000, 'bundle'), (8000, 9000, 'cross')]
+    """
+    out = []
+    for agg in aggs.split(","):
+        ports, name = agg.split("=")
+        lo, hi = ports.split(":")
+        out.append((int(lo), int(hi), name))
+    return out
+
+def parse_downlink_log(f, out, ms_per_bin, aggs, sample_rate=1, decimate=None, points=None):
+    """
+    In-process version of mahimahi's mm-graph --plot-direction ingress: bins
+    an mm-link log (f, binary) by ms_per_bin and writes, per bin, the ingress
+    throughput in Mbit/s (total and per port range in aggs) and the mean
+    queueing delay in ms of the packets that left the link in that bin.
+    Arrivals are "<ts> + <bytes> [port]" and departures
+    "<ts> - <bytes> <delay> [port]"; bins count from the log's base
+    timestamp, and lines from before it (a log with the wrong base) are left
+    out with a warning. The bins are then thinned like the ccp series: every
+    sample_rate'th is kept, and with decimate about points per series are.
+    """
+    base = None
+    early = 0
+    total = {}
+    delay_sum = {}
+    delay_cnt = {}
+    by_port = [{} for _ in aggs]
+    for l in f:
+        if l.startswith(b'#'):
+            if l.startswith(b'# base timestamp:'):
+                base = int(l.split(b':')[1])
+            continue
+        sp = l.split()
+        if len(sp) < 3:
+            continue
+        ts = int(sp[0])
+        if base is None:
+            base = ts
+        if ts < base:
+            early += 1
+            continue
+        b = (ts - base) // ms_per_bin
+        if sp[1] == b'+':
+            size = int(sp[2])
+            total[b] = total.get(b, 0) + size
+            if len(sp) > 3:
+                port = int(sp[3])
+                for (lo, hi, _), agg in zip(aggs, by_port):
+                    if lo <= port < hi:
+                        agg[b] = agg.get(b, 0) + size
+                        break
+        elif sp[1] == b'-' and len(sp) > 3:
+            delay_sum[b] = delay_sum.get(b, 0) + int(sp[3])
+            delay_cnt[b] = delay_cnt.get(b, 0) + 1
+
+    if early:
+        agenda.failure("{}: {} lines are from before the base timestamp ({}), left out".format(getattr(f, 'name', 'downlink log'), early, base))
+
+    bins = max(max(total, default=-1), max(delay_sum, default=-1)) + 1
+    mbps = 8 / (ms_per_bin * 1000)
+    rows = []
+    for b in range(0, bins, sample_rate):
+        row = [b * ms_per_bin / 1000, total.get(b, 0) * mbps, delay_sum.get(b, 0) / delay_cnt.get(b, 1)]
+        row.extend(agg.get(b, 0) * mbps for agg in by_port)
+        rows.append(row)
+    if decimate is not None and len(rows) > points:
+        num_series = 2 + len(aggs)
+        d = Decimator(decimate, bucket_width(decimate, rows[-1][0] - rows[0][0], num_series, points), 0, range(1, num_series + 1))
+        rows = d.push(np.array(rows), final=True).tolist()
+
+    out.write(" ".join(["t", "total", "delay"] + [name for _, _, name in aggs]) + "\n")
+    for row in rows:
+        out.write(" ".join(str(round(v, 3)) for v in row) + "\n")
+
+def parse_mahimahi_iteration(exp, rtt, sample_rate=1, decimate=None, points=None):
+    """
+    Write mm-graph.tmp next to exp (a downlink.log, which may be compressed),
+    binned by rtt. Must stay a module-level function so it can be sent to a
+    worker.
+    """
+    outf = os.path.join(os.path.dirname(exp), 'mm-graph.tmp')
+    with open_log(exp) as f, open(outf + '.part', 'w') as out:
+        parse_downlink_log(f, out, rtt, parse_port_aggs(mm_aggs), sample_rate, decimate, points)
+    os.replace(outf + '.part', outf)
+
+def mm_outputs(exp):
+    return [os.path.join(os.path.dirname(exp), 'mm-graph.tmp')]
+
+def mm_params(rtt, sample_rate, decimate, points):
+    return [rtt, mm_aggs, sample_rate, decimate, points]
+
+def parse_mahimahi_logs(dirname, sample_rate, replot, manifest, workers=1, decimate=None, points=None):
     agenda.subtask("mahimahi logs")
-    pattern = re.compile(r'(?P<sch>[a-z]+)_(?P<bw>[\d]+)_(?P<delay>[\d]+)/(?P<alg>[a-zA-Z]+).(?P<args>[a-z_]+=[a-zA-Z_0-9].+)?/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/downlink.log')
-    g = glob.glob(dirname + "/**/downlink.log", recursive=True)
+    g = find_logs(dirname, "downlink.log")
+    todo = []
     for exp in g:
-        matches = pattern.search(exp)
+        matches = mm_log_pattern.search(exp)
         if matches is not None:
             delay = int(matches.group('delay'))
             rtt = int(delay*2)
-            print(rtt,exp)
-            exp_root = "/".join(exp.split("/")[:-1])
-            exp_root = os.path.dirname(exp)
-            if not replot and os.path.isfile(os.path.join(exp_root, 'mm-graph.tmp')):
+            outputs = mm_outputs(exp)
+            params = mm_params(rtt, sample_rate, decimate, points)
+            if not replot and manifest.fresh(exp, outputs, params):
+                continue
+            if not replot and host_parsed(exp, outputs, params):
+                manifest.record(exp, outputs, params)
                 continue
-            subprocess.check_output(f"{bundler_root}/mahimahi/scripts/mm-graph {exp} {rtt} --fake --plot-direction ingress --agg \"5000:6000=bundle,8000:9000=cross\"", shell=True, executable="/bin/bash")
-            subprocess.check_output("mv /tmp/mm-graph.tmp {}".format(exp_root), shell=True)
+            print(rtt,exp)
+            todo.append((exp, rtt))
         else:
             print(f"skipping {exp}, no regex match")
 
-def parse_etg_logs(dirname, replot):
+    logs = [exp for exp, _ in todo]
+    rtts = [rtt for _, rtt in todo]
+    if workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(parse_mahimahi_iteration, logs, rtts, itertools.repeat(sample_rate), itertools.repeat(decimate), itertools.repeat(points)))
+    else:
+        for exp, rtt in todo:
+            parse_mahimahi_iteration(exp, rtt, sample_rate, decimate, points)
+    for exp, rtt in todo:
+        manifest.record(exp, mm_outputs(exp), mm_params(rtt, sample_rate, decimate, points))
+
+def parse_etg_iteration(exp, exp_out, prefix, cross_traffic_pattern):
+    """
+    Columnize one etg request log into exp_out, with prefix (the experiment
+    setup, in etg's "field:value," form) added to every line. Must stay a
+    module-level function so it can be sent to a worker.
+    """
+    with open_log(exp, 'r') as f, open(exp_out + '.part', 'w') as out:
+        columnize((prefix + l for l in f), out, parse_cross_traffic_pattern(cross_traffic_pattern))
+    os.replace(exp_out + '.part', exp_out)
+
+etg_cross_traffic_pattern = "0:60=empty1,60:120=iperfc1,120:150=empty2,150:210=cbr32,210:250=empty3"
+
+def parse_etg_logs(dirname, replot, manifest, cross_traffic_pattern=etg_cross_traffic_pattern, workers=1):
     agenda.subtask("etg logs")
     outf = os.path.join(dirname, "fcts.data")
-    if not replot and os.path.isfile(outf):
-        return
-    if replot and os.path.isfile(outf):
-        os.remove(outf)
-    g = glob.glob(dirname + "/**/*reqs.out", recursive=True)
-    some = None
-    cross_traffic_pattern = "0:60=empty1,60:120=iperfc1,120:150=empty2,150:210=cbr32,210:250=empty3"
-    print_head = True
+    g = find_logs(dirname, "*reqs.out")
+    parsed = []
+    todo = []
     for exp in g:
+        exp_out = log_name(exp)[:-len("reqs.out")] + "fcts.parsed"
+        parsed.append(exp_out)
+        if not replot and manifest.fresh(exp, [exp_out], cross_traffic_pattern):
+            continue
         print(exp)
-        some = True
         exp_root = "/".join(exp.split("/")[:-1])
         exp_root = os.path.dirname(exp)
         exp_root = exp_root.split(dirname)[-1].split("/")
@@ -164,25 +782,98 @@ def parse_etg_logs(dirname, replot):
         if not alg_sp:
             alg = alg_sp[0]
         sch, bw, rtt = setup.split("_")
-        subprocess.check_output(f"awk '{{print \"sch:{sch}, bw:{bw}, rtt:{rtt}, alg:{alg}, traffic:{traffic}, seed:{seed} \"$0}}' {exp} | python3 columnize.py \"{cross_traffic_pattern}\" {print_head}>> tmp", shell=True)
-        print_head = False
-    if some:
-        subprocess.call(f"mv tmp {outf}", shell=True)
+        todo.append((exp, exp_out, f"sch:{sch}, bw:{bw}, rtt:{rtt}, alg:{alg}, traffic:{traffic}, seed:{seed} "))
+
+    if workers > 1 and len(todo) > 1:
+        # request logs are small, so hand them out in batches
+        chunksize = max(1, len(todo) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(parse_etg_iteration, *zip(*todo), itertools.repeat(cross_traffic_pattern), chunksize=chunksize))
+    else:
+        for exp, exp_out, prefix in todo:
+            parse_etg_iteration(exp, exp_out, prefix, cross_traffic_pattern)
+    for exp, exp_out, _ in todo:
+        manifest.record(exp, [exp_out], cross_traffic_pattern)
+
+    if parsed and (todo or not os.path.isfile(outf)):
+        merge_parsed(parsed, outf)
 
-def parse_outputs(config, replot=False, interact=False, graph_kwargs={}):
+# sch, bw, rtt, alg, traffic, seed (see parse_etg_logs) and during
+etg_key_columns = [0, 1, 2, 3, 4, 5, -1]
+
+def out_of_date(src, outf):
+    return os.path.exists(src) and (not os.path.exists(outf) or os.path.getmtime(outf) < os.path.getmtime(src))
+
+def write_columnar_outputs(dirname, replot):
+    """
+    Convert the text outputs into Arrow formats: all the per-iteration
+    ccp.parsed files become one parquet dataset (ccp.dataset, partitioned by
+    sch and alg), each mm-graph.tmp gets an mm-graph.feather next to it, and
+    fcts.data becomes fcts.parquet. The experiment key columns are dictionary
+    encoded. Outputs older than their text version are rebuilt. Returns the
+    path of the ccp dataset.
+    """
+    agenda.subtask("columnar outputs")
+    global_out_fname = os.path.join(dirname, 'ccp.dataset')
+    if replot or out_of_date(os.path.join(dirname, 'ccp.parsed'), global_out_fname):
+        num_values = len(ccp_log_header.split(","))
+        # (file, key columns, value columns) of every iteration's ccp.parsed;
+        # which key columns there are depends on the algorithm's arguments
+        exps = []
+        for exp in glob.glob(dirname + "/**/ccp.parsed", recursive=True):
+            if os.path.dirname(exp) == dirname:
+                continue
+            with open(exp) as f:
+                num_cols = len(f.readline().split(","))
+            if num_cols < num_values:
+                continue
+            num_keys = num_cols - num_values
+            exps.append((exp, range(num_keys), range(num_keys, num_cols)))
+        schema = columnar.union_schema(columnar.text_table_schema(exp, ",", keys, values) for exp, keys, values in exps) if exps else None
+        tables = (columnar.read_text_table(exp, ",", keys, values, null_values=("", "none")) for exp, keys, values in exps)
+        columnar.write_partitioned(tables, global_out_fname, ["sch", "alg"], schema)
+
+    for exp in glob.glob(dirname + "/**/mm-graph.tmp", recursive=True):
+        outf = os.path.join(os.path.dirname(exp), "mm-graph.feather")
+        if replot or out_of_date(exp, outf):
+            columnar.write_feather(columnar.read_text_table(exp, " "), outf)
+
+    fcts = os.path.join(dirname, "fcts.data")
+    outf = os.path.join(dirname, "fcts.parquet")
+    if os.path.isfile(fcts) and (replot or out_of_date(fcts, outf)):
+        columnar.write_parquet(columnar.read_text_table(fcts, " ", etg_key_columns), outf)
+
+    return global_out_fname
+
+default_points = 5000
+
+def parse_outputs(config, replot=False, interact=False, graph_kwargs={}, workers=1, fmt='csv', cross_traffic_pattern=etg_cross_traffic_pattern):
     experiment_root = os.path.abspath(os.path.expanduser(config['local_experiment_dir']))
     agenda.task(f'parsing experiment_root: {experiment_root}')
 
+    if fmt == 'parquet' and not columnar.available():
+        agenda.failure("--format=parquet needs pyarrow (pip3 install pyarrow), falling back to csv")
+        fmt = 'csv'
+
     if 'downsample' in graph_kwargs:
         sample_rate = graph_kwargs['downsample']
     else:
         sample_rate = 1
+    decimate = graph_kwargs.get('decimate')
+    points = graph_kwargs.get('points', default_points)
 
-    global_out_fname, num_ccp = parse_ccp_logs(experiment_root, sample_rate, replot)
-    parse_mahimahi_logs(experiment_root, sample_rate, replot, config['structure']['bundler_root'])
-    parse_etg_logs(experiment_root, replot)
+    # only logs that are new or changed since the last run get parsed again
+    manifest = Manifest(experiment_root)
+    global_out_fname, num_ccp = parse_ccp_logs(experiment_root, sample_rate, replot, manifest, workers=workers, decimate=decimate, points=points)
+    manifest.save()
+    parse_mahimahi_logs(experiment_root, sample_rate, replot, manifest, workers=workers, decimate=decimate, points=points)
+    manifest.save()
+    parse_etg_logs(experiment_root, replot, manifest, cross_traffic_pattern, workers=workers)
+    manifest.save()
+    if fmt == 'parquet':
+        global_out_fname = write_columnar_outputs(experiment_root, replot)
 
-    write_rmd(experiment_root, global_out_fname, num_ccp, **graph_kwargs)
+    write_rmd(experiment_root, global_out_fname, num_ccp, fmt=fmt, **graph_kwargs)
 
 if __name__ == "__main__":
     import argparse
@@ -191,15 +882,20 @@ if __name__ == "__main__":
     parser.add_argument("root", help="Root directory containing all experiments to be plotted")
     parser.add_argument("--bundler_root", type=str, help="Bundler root directory", default="~/bundler-scripts")
     parser.add_argument("--downsample", type=int, help="Downsamples to 1/N of all log lines for faster plotting")
+    parser.add_argument("--decimate", help="Reduce each plotted series while keeping its peaks", choices=decimate_modes)
+    parser.add_argument("--points", type=int, help="About how many points to keep per series with --decimate", default=default_points)
     parser.add_argument("--fields", help="Which fields to plot")
     parser.add_argument("--rows", help="(Column name) by which to split into a grid vertically")
     parser.add_argument("--cols", help="(Column name) by which to split into a grid horizontally")
     parser.add_argument('--replot', help="Force replot",action="store_true")
     parser.add_argument("--interact", help="enable interactive mode for graphs",action="store_true")
+    parser.add_argument("--workers", type=int, help="Number of processes to parse logs with", default=1)
+    parser.add_argument("--format", help="Format to hand the parsed data to R in (parquet needs pyarrow)", choices=columnar.formats, default='csv')
+    parser.add_argument("--cross_traffic_pattern", help="start:end=name,... windows (in seconds) to label flows with", default=etg_cross_traffic_pattern)
     args = parser.parse_args()
-    graph_kwargs = dict((k,v) for k,v in vars(args).items() if (v and not k=='root' and not k=='replot'))
+    graph_kwargs = dict((k,v) for k,v in vars(args).items() if (v and not k in ('root', 'replot', 'workers', 'format', 'cross_traffic_pattern')))
 
     config = {}
     config['local_experiment_dir'] = args.root
     config['structure'] = {'bundler_root': args.bundler_root}
-    parse_outputs(config, replot=args.replot, interact=args.interact, graph_kwargs=graph_kwargs)
+    parse_outputs(config, replot=args.replot, interact=args.interact, graph_kwargs=graph_kwargs, workers=args.workers, fmt=args.format, cross_traffic_pattern=args.cross_traffic_pattern)
@@ -0,0 +1,211 @@
+import bisect
+import hashlib
+import itertools
+from collections import namedtuple
+
+# Lazy enumeration of the iterations of an experiment sweep. The [experiment]
+# section of the config gives a list of values for every axis (the cartesian
+# product of which is the sweep; algs with list-valued parameters count as one
+# value per combination of them), and may also have include/exclude rules:
+#
+#   [[experiment.exclude]]
+#       alg = "nobundler"
+#       sch = { not = ["fifo", "sfq"] }
+#
+# A rule matches an iteration if every axis it names matches: a value matches
+# itself, a list matches any of its elements, {not = ...} anything the inside
+# doesn't match, and for alg a string matches the alg's name and a table the
+# alg's parameters. Iterations matching an exclude rule are dropped and, if
+# there are include rules, so is any iteration that matches none of them.
+#
+# Rules are checked against partial iterations as the axes are assigned, so
+# whole blocks of the sweep are skipped (or counted) without being generated.
+# Iterations are handed out one at a time in a seeded pseudorandom order, which
+# doesn't need the sweep to be materialized either.
+
+# how the iterations can be ordered:
+#   shuffle : entirely at random
+#   grouped : iterations that share a scheduler, algorithm, rate and rtt (and
+#             so can keep the same inbox and ccp running) back to back, the
+#             groups and the iterations in each in random order
+orders = ['shuffle', 'grouped']
+group_axes = ['sch', 'alg', 'rate', 'rtt']
+rule_keys = ['include', 'exclude']
+
+default_excludes = [
+    # without bundler, only the fifo and sfq schedulers are run
+    {'alg': 'nobundler', 'sch': {'not': ['fifo', 'sfq']}},
+]
+
+def alg_variants(alg):
+    keys = [k for k in alg if isinstance(alg[k], list)]
+    for vals in itertools.product(*(alg[k] for k in keys)):
+        variant = dict(alg)
+        variant.update(zip(keys, vals))
+        yield variant
+
+def value_matches(want, got):
+    if isinstance(want, dict) and set(want) == {'not'}:
+        return not value_matches(want['not'], got)
+    if want == got:
+        return True
+    if isinstance(got, dict) and 'name' in got:
+        # an alg, by name or by parameters
+        if isinstance(want, dict):
+            return all(k in got and value_matches(v, got[k]) for k, v in want.items())
+        if isinstance(want, str):
+            return got['name'] == want
+    return isinstance(want, list) and any(value_matches(w, got) for w in want)
+
+def rule_state(rule, point):
+    """
+    Whether rule matches point (a dict of the axes assigned so far): True or
+    False, or None if that depends on axes that aren't assigned yet.
+    """
+    decided = True
+    for axis, want in rule.items():
+        if axis not in point:
+            decided = False
+        elif not value_matches(want, point[axis]):
+            return False
+    return True if decided else None
+
+def digest(*parts):
+    return int.from_bytes(hashlib.blake2b(repr(parts).encode(), digest_size=8).digest(), 'big')
+
+class Permutation:
+    """
+    A pseudorandom permutation of range(n), computed an index at a time (a
+    small Feistel network over the next even power of two, walking the cycle
+    until it lands back in range).
+    """
+    rounds = 4
+
+    def __init__(self, n, *seed):
+        self.n = n
+        bits = max(2, (n - 1).bit_length())
+        bits += bits % 2
+        self.half = bits // 2
+        self.mask = (1 << self.half) - 1
+        self.keys = [digest(*seed, r) for r in range(self.rounds)]
+
+    def __call__(self, i):
+        while True:
+            l, r = i >> self.half, i & self.mask
+            for k in self.keys:
+                l, r = r, l ^ (digest(k, r) & self.mask)
+            i = (l << self.half) | r
+            if i < self.n:
+                return i
+
+class Sweep:
+    def __init__(self, experiment):
+        self.includes = list(experiment.get('include', []))
+        self.excludes = list(experiment.get('exclude', [])) + default_excludes
+        names = [k for k in experiment if k not in rule_keys]
+        for rule in self.includes + self.excludes:
+            for axis in rule:
+                assert axis in names, "experiment include/exclude rule on unknown axis {}".format(axis)
+        self.Experiment = namedtuple("Experiment", names)
+        self.values = dict(
+            (k, [v for alg in experiment[k] for v in alg_variants(alg)] if k == 'alg' else list(experiment[k]))
+            for k in names
+        )
+        # the group axes first, so that each group is one block of indices
+        self.group_names = [k for k in group_axes if k in names]
+        self.inner_names = [k for k in names if k not in group_axes]
+
+    def state(self, point):
+        """
+        'out' if nothing under point can be in the sweep, 'in' if everything
+        can, None if it depends on axes that aren't assigned yet.
+        """
+        ex = [rule_state(r, point) for r in self.excludes]
+        if any(s is True for s in ex):
+            return 'out'
+        inc = [rule_state(r, point) for r in self.includes]
+        if inc and all(s is False for s in inc):
+            return 'out'
+        if any(s is None for s in ex) or (inc and not any(s is True for s in inc)):
+            return None
+        return 'in'
+
+    def size(self, names):
+        n = 1
+        for k in names:
+            n *= len(self.values[k])
+        return n
+
+    def blocks(self):
+        """
+        The sweep as blocks of iterations, found without enumerating any more
+        of it than the rules need: (point, level) for each, where point has
+        the first level axes assigned and everything under it is in the sweep.
+        """
+        names = self.group_names + self.inner_names
+        blocks = []
+        def walk(level, point):
+            s = self.state(point)
+            if s == 'out':
+                return
+            if s == 'in':
+                blocks.append((dict(point), level))
+                return
+            for v in self.values[names[level]]:
+                point[names[level]] = v
+                walk(level + 1, point)
+            del point[names[level]]
+        walk(0, {})
+        return blocks
+
+    def count(self):
+        """
+        How many iterations are in the sweep.
+        """
+        names = self.group_names + self.inner_names
+        return sum(self.size(names[level:]) for _, level in self.blocks())
+
+    def decode(self, names, i, point):
+        for k in reversed(names):
+            vals = self.values[k]
+            i, j = divmod(i, len(vals))
+            point[k] = vals[j]
+        return point
+
+    def groups(self, order, seed):
+        """
+        Yield the iterations of the sweep, as lists: one iteration each with
+        the shuffle order, a group of them each with the grouped order. The
+        order only depends on seed.
+        """
+        if order == 'shuffle':
+            # a permutation of just the iterations in the sweep, numbered
+            # block by block
+            names = self.group_names + self.inner_names
+            blocks = self.blocks()
+            starts = [0]
+            for _, level in blocks:
+                starts.append(starts[-1] + self.size(names[level:]))
+            perm = Permutation(starts[-1], seed)
+            for k in range(starts[-1]):
+                i = perm(k)
+                b = bisect.bisect_right(starts, i) - 1
+                point, level = blocks[b]
+                yield [self.Experiment(**self.decode(names[level:], i - starts[b], dict(point)))]
+            return
+
+        num_groups, group_size = self.size(self.group_names), self.size(self.inner_names)
+        perm = Permutation(num_groups, seed)
+        for k in range(num_groups):
+            g = perm(k)
+            point = self.decode(self.group_names, g, {})
+            if self.state(point) == 'out':
+                continue
+            inner = Permutation(group_size, seed, g)
+            group = []
+            for j in range(group_size):
+                full = self.decode(self.inner_names, inner(j), dict(point))
+                if self.state(full) == 'in':
+                    group.append(self.Experiment(**full))
+            if group:
+                yield group
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+import gzip
+import random
+import sys
+
+# Synthetic logs in the formats the parsers read, for benchmarking them (see
+# bench.py) without a testbed. Every generator writes about size bytes of log
+# to a file, the same bytes for the same seed, and takes a few knobs for the
+# mix of lines (see the defaults in mixes):
+#
+#   ccp      : a nimbus ccp.log: measurement lines (the "rin" lines parsed into
+#              ccp.parsed), elasticity lines, mode switches, and other lines
+#              the parser skips
+#   downlink : a mahimahi downlink.log: arrivals (with a port, as in the bundle
+#              and cross traffic port ranges), departures and delivery
+#              opportunities
+#   etg      : an etg request log (*reqs.out), "Field:value," records
+#   fcts     : space separated flow completion times, as categorize.py reads
+#   times    : space separated rows with a wall clock time column, as
+#              translate-time.py reads
+#   udping   : a gzipped udping log, as cloud/parse_udping.py reads
+#
+#   python3 synth.py <kind> <output> [--size MB] [--seed N] [--mix k=v,...]
+
+mixes = {
+    'ccp': {
+        # elasticity lines per measurement line
+        'elasticity': 0.3,
+        # mode switches per measurement line
+        'switches': 0.001,
+        # lines the parser skips, per measurement line
+        'other': 0.5,
+        # ms between measurement lines
+        'interval': 10,
+    },
+    'downlink': {
+        # link rate (Mbit/s) and round trip time (ms)
+        'rate': 96,
+        'rtt': 50,
+        # fraction of the link's delivery opportunities that are used
+        'load': 0.9,
+        # fraction of arrivals from the cross traffic ports
+        'cross': 0.2,
+    },
+    'etg': {
+        # mean request size (bytes)
+        'size': 50000,
+    },
+    'fcts': {},
+    'times': {},
+    'udping': {
+        # how many source ports are pinging
+        'ports': 8,
+    },
+}
+
+chunk_lines = 10000
+# bumped whenever what a generator writes changes, so bench.py makes its logs
+# again instead of reusing ones it kept
+version = 2
+
+def clock(ms):
+    """
+    "HH:MM:SS.mmm" of ms past midnight
+    """
+    s, ms = divmod(int(ms), 1000)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return "{:02d}:{:02d}:{:02d}.{:03d}".format(h % 24, m, s, ms)
+
+def write_lines(f, size, lines):
+    """
+    Write lines (an iterator of str, newline included) to f until size bytes
+    are written. Returns how many were.
+    """
+    written = 0
+    while written < size:
+        chunk = "".join(line for _, line in zip(range(chunk_lines), lines)).encode()
+        if not chunk:
+            break
+        f.write(chunk)
+        written += len(chunk)
+    return written
+
+def ccp_lines(r, mix):
+    prefix = "Oct 18 {} INFO [nimbus] "
+    ms = 36000000
+    elapsed = 0.0
+    rate = 12e6
+    mode = "XTCP"
+    yield (prefix + "starting, sid: 1, flow_mode: {}, use_switching: true, bw_est_mode: true\n").format(clock(ms), mode)
+    while True:
+        ms += mix['interval']
+        elapsed += mix['interval'] / 1000
+        rate = max(1e5, rate * r.uniform(0.98, 1.02))
+        rin = rate * r.uniform(0.9, 1.1)
+        rout = rate * r.uniform(0.9, 1.1)
+        t = clock(ms)
+        # the values the parser keeps (ccp_fields) are the 9th, 13th, 17th,
+        # 19th, 27th, 29th and 35th words
+        yield (prefix + "flow measurement, elapsed: {:.3f}, sid: 1, curr_q: {:.1f}, mode: {}, rtt: {:.6f}, "
+            "zt: {:.3f}, zout: {:.3f}, us: {:.3f}, bw_est: {:.3f}, rout: {:.3f}, rin: {:.3f}, "
+            "min_rtt: {:.6f}, delay_thresh: {:.6f}, curr_rate: {:.3f},\n").format(
+            t,
+            elapsed,
+            r.uniform(0, 200),
+            mode,
+            r.uniform(0.05, 0.08),
+            r.uniform(0, rate),
+            r.uniform(0, rate),
+            r.uniform(0, 1),
+            rate,
+            rout,
+            rin,
+            0.05,
+            r.uniform(0.05, 0.07),
+            rate,
+        )
+        if r.random() < mix['elasticity']:
+            yield (prefix + "elasticity_inf, sid: 1, fr: 5.000, mag: {:.3f}, elasticity2: {:.6f}, expected_peak: {:.3f},\n").format(
+                t, r.uniform(0, 1e6), r.uniform(0, 4), r.uniform(0, 1e6))
+        if r.random() < mix['switches']:
+            if mode == "XTCP":
+                mode = "DELAY"
+                yield (prefix + "switched mode DELAY, delay_thresh: {:.6f}, sid: 1, elapsed: {:.3f}, rtt: {:.6f},\n").format(
+                    t, r.uniform(0.05, 0.07), elapsed, r.uniform(0.05, 0.08))
+            else:
+                mode = "XTCP"
+                yield (prefix + "switched mode XTCP, sid: 1, elapsed: {:.3f}, rtt: {:.6f},\n").format(t, elapsed, r.uniform(0.05, 0.08))
+        other = mix['other']
+        while other > 0 and r.random() < other:
+            yield (prefix + "pulse, sid: 1, elapsed: {:.3f}, pulse_size: {:.3f},\n").format(t, elapsed, r.uniform(0, 0.25) * rate)
+            other -= 1
+
+def downlink_lines(r, mix):
+    # as mm-link writes them, the base timestamp and the lines' timestamps
+    # are ms since the init timestamp
+    yield "# mahimahi mm-link (downlink) [trace.mm] > downlink.log\n"
+    yield "# init timestamp: {}\n".format(1539000000000)
+    yield "# base timestamp: {}\n".format(0)
+    # one delivery opportunity is an MTU
+    per_ms = mix['rate'] * 1e6 / 8 / 1000 / 1500
+    ts = 0
+    owed = 0.0
+    queue = 0
+    while True:
+        ts += 1
+        owed += per_ms
+        while owed >= 1:
+            owed -= 1
+            yield "{} # 1500\n".format(ts)
+            if r.random() < mix['load']:
+                port = r.randrange(8000, 9000) if r.random() < mix['cross'] else r.randrange(5000, 6000)
+                yield "{} + 1500 {}\n".format(ts, port)
+                queue += 1
+            if queue and r.random() < mix['load'] * 1.05:
+                queue -= 1
+                yield "{} - 1500 {} {}\n".format(ts, int(mix['rtt']) // 2 + r.randrange(0, 20), r.randrange(5000, 6000))
+
+def etg_lines(r, mix):
+    start = 1539000000000
+    i = 0
+    while True:
+        i += 1
+        start += r.randrange(1, 40)
+        size = int(r.expovariate(1 / mix['size'])) + 1
+        yield "ReqIndex:{}, Size(B):{}, Fanout:1, StartTime(ms):{}, Duration(usec):{}, Speed(Mbps):{:.3f},\n".format(
+            i, size, start, int(size * r.uniform(0.5, 3)), r.uniform(1, 96))
+
+def fcts_lines(r, mix):
+    yield "fct size sch alg\n"
+    while True:
+        size = int(r.expovariate(1 / 50000)) + 1
+        yield "{:.3f} {} {} {}\n".format(size * r.uniform(0.002, 0.02), size, r.choice(["fifo", "sfq", "fqcodel"]), r.choice(["nimbus", "copa", "nobundler"]))
+
+def times_lines(r, mix):
+    yield "time rtt port\n"
+    us = 36000000000
+    while True:
+        us += r.randrange(100, 20000)
+        yield "{}{:03d} {:.3f} {}\n".format(clock(us // 1000), us % 1000, r.uniform(50, 80), r.randrange(4000, 4100))
+
+def udping_lines(r, mix):
+    ms = 36000000
+    while True:
+        ms += r.randrange(1, 20)
+        yield "Sep 04 {} INFO Ping response, time: {:.3f}, local: 0.0.0.0:{}, from: 10.0.0.2:5000\n".format(
+            clock(ms), r.uniform(50, 80), 4000 + r.randrange(int(mix['ports'])))
+
+generators = {
+    'ccp': ccp_lines,
+    'downlink': downlink_lines,
+    'etg': etg_lines,
+    'fcts': fcts_lines,
+    'times': times_lines,
+    'udping': udping_lines,
+}
+
+def generate(kind, path, size, seed=0, **mix):
+    """
+    Write about size bytes of a kind of log to path. mix overrides the kind's
+    defaults in mixes. Returns the bytes written (uncompressed).
+    """
+    unknown = set(mix) - set(mixes[kind])
+    if unknown:
+        raise ValueError("{} logs have no {} (they have {})".format(kind, ", ".join(sorted(unknown)), ", ".join(mixes[kind]) or "nothing to set"))
+    m = dict(mixes[kind])
+    m.update(mix)
+    lines = generators[kind](random.Random(seed), m)
+    with (gzip.open(path, 'wb', compresslevel=1) if kind == 'udping' else open(path, 'wb')) as f:
+        return write_lines(f, size, lines)
+
+def parse_mix(s):
+    """
+    "elasticity=0.5,other=0" -> {'elasticity': 0.5, 'other': 0.0}
+    """
+    mix = {}
+    for kv in filter(None, s.split(",")):
+        k, v = kv.split("=")
+        mix[k] = float(v)
+    return mix
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic log")
+    parser.add_argument("kind", choices=sorted(generators))
+    parser.add_argument("output")
+    parser.add_argument("--size", type=float, default=16, help="how much log to write (MB)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", type=parse_mix, default={}, help="line mix, k=v,... (see mixes in synth.py)")
+    args = parser.parse_args()
+    try:
+        n = generate(args.kind, args.output, int(args.size * 1e6), args.seed, **args.mix)
+    except ValueError as e:
+        sys.exit(str(e))
+    print("{}: {:.1f} MB of {} log".format(args.output, n / 1e6, args.kind))
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+
+import columnar
+
+header = "sch,alg,rate,rtt,{},bundle,cross,seed,elapsed,rtt,zt,rout,rin,curr_rate,curr_q,elasticity2\n"
+
+@unittest.skipUnless(columnar.available(), "needs pyarrow")
+class PartitionedTest(unittest.TestCase):
+    def test_different_args(self):
+        # ccp.parsed of two algorithms with different arguments
+        exps = [
+            (header.format("alpha") + "sfq,nimbus,96,50,0.5,x,y,1,0.1,50,1,2,3,4,5,none\n", 8),
+            (header.format("beta,gamma") + "fifo,copa,96,50,7,8,x,y,1,0.2,50,1,2,3,4,5,6\n", 9),
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            fnames = []
+            for i, (text, _) in enumerate(exps):
+                fnames.append(os.path.join(d, "{}.parsed".format(i)))
+                with open(fnames[-1], 'w') as f:
+                    f.write(text)
+            cols = [(fname, range(keys), range(keys, keys + 8)) for fname, (_, keys) in zip(fnames, exps)]
+            schema = columnar.union_schema(columnar.text_table_schema(fname, ",", k, v) for fname, k, v in cols)
+            tables = (columnar.read_text_table(fname, ",", k, v, null_values=("", "none")) for fname, k, v in cols)
+            out = os.path.join(d, "ccp.dataset")
+            columnar.write_partitioned(tables, out, ["sch", "alg"], schema)
+
+            rows = columnar.pads.dataset(out, partitioning="hive").to_table().to_pylist()
+        rows = dict((r['alg'], r) for r in rows)
+        self.assertEqual(rows['nimbus']['alpha'], '0.5')
+        self.assertIsNone(rows['nimbus']['beta'])
+        self.assertEqual((rows['copa']['beta'], rows['copa']['gamma']), ('7', '8'))
+        self.assertIsNone(rows['copa']['alpha'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import numpy as np
+import unittest
+
+from decimate import Decimator, bucket_width
+
+class MinmaxTest(unittest.TestCase):
+    def rows(self, n, y2):
+        x = np.arange(n, dtype=float)
+        return np.column_stack((x, np.sin(x), y2))
+
+    def test_all_nan_column(self):
+        # a block of ccp rows with no elasticity_inf lines before it
+        d = Decimator('minmax', 10, 0, [1, 2])
+        rows = self.rows(100, np.full(100, np.nan))
+        kept = np.vstack((d.push(rows), d.flush()))
+        self.assertEqual(len(kept), 20)
+        for b in range(10):
+            bucket = rows[b * 10:(b + 1) * 10, 1]
+            self.assertIn(bucket.min(), kept[:, 1])
+            self.assertIn(bucket.max(), kept[:, 1])
+
+    def test_nan_bucket(self):
+        # a column that is NaN in some buckets only
+        y2 = np.where(np.arange(100) < 50, np.nan, np.arange(100.0))
+        d = Decimator('minmax', 10, 0, [2])
+        kept = np.vstack((d.push(self.rows(100, y2)), d.flush()))
+        # the first row of every NaN bucket, then each bucket's min and max
+        self.assertEqual(kept[:, 0].tolist(), [0, 10, 20, 30, 40, 50, 59, 60, 69, 70, 79, 80, 89, 90, 99])
+
+class LttbTest(unittest.TestCase):
+    def decimate(self, rows, points, chunks=1):
+        d = Decimator('lttb', bucket_width('lttb', rows[-1, 0] - rows[0, 0], 1, points), 0, [1])
+        kept = [d.push(c) for c in np.array_split(rows, chunks)] + [d.flush()]
+        return np.vstack([k for k in kept if k is not None])
+
+    def test_points(self):
+        x = np.arange(1000, dtype=float)
+        rows = np.column_stack((x, np.sin(x / 10)))
+        kept = self.decimate(rows, 100)
+        self.assertEqual(len(kept), 100)
+        self.assertEqual(kept[0].tolist(), rows[0].tolist())
+        self.assertEqual(kept[-1].tolist(), rows[-1].tolist())
+        # pushing the rows in chunks picks the same ones
+        self.assertEqual(self.decimate(rows, 100, chunks=7).tolist(), kept.tolist())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from parse_outputs import NimbusLogState, NimbusLogStream, ccp_fields, mm_aggs, parse_downlink_log, parse_nimbus_columns, parse_port_aggs
+import synth
+
+# A short mm-link downlink log binned by 100ms, and what mm-graph --fake
+# --plot-direction ingress --agg 5000:6000=bundle,8000:9000=cross makes of it:
+# per bin, ingress (arrival) throughput in Mbit/s, in total and per port range,
+# and the mean queueing delay of the packets that left in it. Line timestamps,
+# like the base timestamp, count from the init timestamp.
+downlink_log = b"""# mahimahi mm-link (downlink) [96.mm] > downlink.log
+# init timestamp: 1539000000000
+# base timestamp: 12
+12 # 1500
+12 + 1500 5000
+40 + 1500 8000
+52 - 1500 20 5000
+80 + 1000 4000
+111 - 1500 30 8000
+112 # 1500
+112 + 1500 5500
+170 - 1000 10 4000
+312 + 1500 8500
+"""
+
+# bin 0 (12-111): 4000 bytes in (1500 bundle, 1500 cross), delays 20 and 30
+# bin 1 (112-211): 1500 bytes in (bundle), delay 10
+# bin 2: nothing
+# bin 3: 1500 bytes in (cross)
+mm_graph_output = """t total delay bundle cross
+0.0 0.32 25.0 0.12 0.12
+0.1 0.12 10.0 0.12 0.0
+0.2 0.0 0.0 0.0 0.0
+0.3 0.12 0.0 0.0 0.12
+"""
+
+mm_graph = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mahimahi", "scripts", "mm-graph")
+
+def parse(log, ms_per_bin=100):
+    out = io.StringIO()
+    parse_downlink_log(io.BytesIO(log), out, ms_per_bin, parse_port_aggs(mm_aggs))
+    return out.getvalue()
+
+def table(text):
+    lines = text.strip().split("\n")
+    return lines[0].split(), [[float(v) for v in l.split()] for l in lines[1:]]
+
+class DownlinkLogTest(unittest.TestCase):
+    def test_fixture(self):
+        self.assertEqual(parse(downlink_log), mm_graph_output)
+
+    @unittest.skipUnless(os.path.isfile(mm_graph) and shutil.which("perl"), "needs the mahimahi submodule's mm-graph")
+    def test_mm_graph(self):
+        with tempfile.TemporaryDirectory() as d:
+            log = os.path.join(d, "downlink.log")
+            with open(log, 'wb') as f:
+                f.write(downlink_log)
+            subprocess.check_output([mm_graph, log, "100", "--fake", "--plot-direction", "ingress", "--agg", mm_aggs])
+        with open("/tmp/mm-graph.tmp") as f:
+            want_header, want = table(f.read())
+        header, got = table(parse(downlink_log))
+        self.assertEqual(header, want_header)
+        self.assertEqual(len(got), len(want))
+        for row, want_row in zip(got, want):
+            for v, w in zip(row, want_row):
+                self.assertAlmostEqual(v, w, places=3)
+
+    def test_before_base(self):
+        log = downlink_log.replace(b"# base timestamp: 12\n", b"# base timestamp: 112\n")
+        with mock.patch('parse_outputs.agenda') as agenda:
+            out = parse(log)
+        # the 6 lines before 112 are warned about, not binned
+        agenda.failure.assert_called_once()
+        self.assertIn(" 6 lines", agenda.failure.call_args[0][0])
+        self.assertEqual(out, "t total delay bundle cross\n0.0 0.12 10.0 0.12 0.0\n0.1 0.0 0.0 0.0 0.0\n0.2 0.12 0.0 0.0 0.12\n")
+
+def measurement(rtt="0.065338", rin="12792942.189", q="51.8", elapsed="0.010"):
+    return "Oct 18 10:00:00.010 INFO [nimbus] flow measurement, elapsed: {}, sid: 1, curr_q: {}, mode: XTCP, rtt: {}, zt: 4926154.369, zout: 9535162.602, us: 0.303, bw_est: 12165322.489, rout: 11972068.022, rin: {}, min_rtt: 0.050000, delay_thresh: 0.059532, curr_rate: 12165322.489,\n".format(elapsed, q, rtt, rin)
+
+def elasticity(e2):
+    return "Oct 18 10:00:00.040 INFO [nimbus] elasticity_inf, sid: 1, fr: 5.000, mag: 567510.741, elasticity2: {}, expected_peak: 967540.250,\n".format(e2)
+
+# lines the column parser reads itself: numbers that round up, down, to
+# -0.0 and on ties, zero and negative elasticities, mode switches
+nimbus_columns_log = "".join([
+    "Oct 18 10:00:00.000 INFO [nimbus] starting, sid: 1, flow_mode: XTCP, use_switching: true, bw_est_mode: true\n",
+    measurement(),
+    elasticity("0.954464"),
+    measurement(rtt="0.0005", q="7"),
+    elasticity("0.000"),
+    measurement(rtt="1.0005", rin="99999999999.9999"),
+    elasticity("-1.2345"),
+    elasticity("2.675"),
+    measurement(rtt="-0.0004", q="+2.5"),
+    "Oct 18 10:00:01.940 INFO [nimbus] switched mode DELAY, delay_thresh: 0.052889, sid: 1, elapsed: 1.940, rtt: 0.052795,\n",
+    measurement(rtt=".5", q="5.", elapsed="2.000"),
+    elasticity("0.0004999"),
+    "Oct 18 10:00:02.000 INFO [nimbus] pulse, sid: 1, elapsed: 2.000, pulse_size: 2167341.102,\n",
+    measurement(rtt="2.5004", elapsed="2.010"),
+    "Oct 18 10:00:03.000 INFO [nimbus] switched mode XTCP, sid: 1, elapsed: 3.000, rtt: 0.052795,\n",
+    measurement(rtt="0.0015", elapsed="3.010"),
+]).encode()
+
+# lines it leaves to the line parser
+nimbus_lines_log = "".join([
+    measurement(rtt="1e-3"),
+    measurement(rtt="nan"),
+    measurement(rin="123456789012.5"),
+    " " + measurement(),
+    "Oct 18 10:00:00.010 INFO [nimbus] rin too short\n",
+    elasticity("0.5").replace("expected_peak", "rin"),
+    measurement(q="1,2"),
+    measurement(q="\u00b5"),
+]).encode()
+
+def parse_nimbus(log, sample_rate, columns, chunk, keep=False):
+    out = io.BytesIO()
+    switch = io.StringIO()
+    rows = []
+    stream = NimbusLogStream(out, "sfq,nimbus", ccp_fields, sample_rate)
+    stream.st.columns = columns
+    if keep:
+        stream.st.on_rows = rows.append
+    for i in range(0, len(log), chunk):
+        stream.feed(log[i:i + chunk])
+    stream.finish(switch)
+    return out.getvalue(), switch.getvalue(), np.concatenate(rows) if rows else None
+
+class NimbusLogTest(unittest.TestCase):
+    @mock.patch('parse_outputs.nimbus_columns_min_size', 0)
+    def check(self, log, chunks):
+        for sample_rate in (1, 2, 3):
+            for chunk in chunks:
+                for keep in (False, True):
+                    want = parse_nimbus(log, sample_rate, False, chunk, keep)
+                    got = parse_nimbus(log, sample_rate, True, chunk, keep)
+                    self.assertEqual(got[0], want[0], (sample_rate, chunk, keep))
+                    self.assertEqual(got[1], want[1], (sample_rate, chunk, keep))
+                    np.testing.assert_array_equal(got[2], want[2])
+
+    def test_columns(self):
+        st = NimbusLogState()
+        self.assertIsNotNone(parse_nimbus_columns(nimbus_columns_log, "", ccp_fields, 1, st, False))
+        for l in nimbus_lines_log.split(b"\n")[:-1]:
+            self.assertIsNone(parse_nimbus_columns(l, "", ccp_fields, 1, NimbusLogState(), False), l)
+        self.check(nimbus_columns_log, (len(nimbus_columns_log), 1, 300))
+
+    def test_lines(self):
+        log = nimbus_columns_log + nimbus_lines_log + nimbus_columns_log
+        self.check(log, (len(log), 1, 300))
+
+    def test_synth(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "ccp.log")
+            synth.generate('ccp', path, 1, 1)
+            with open(path, 'rb') as f:
+                log = f.read(256 * 1024)
+        self.check(log, (len(log), 4096))
+
+if __name__ == "__main__":
+    unittest.main()
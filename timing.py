@@ -0,0 +1,184 @@
+import itertools
+import json
+import sys
+import threading
+import time
+
+# Timing of what eval.py spends its time on. Every phase of an iteration (and
+# of setting up a testbed), every remote command and every file transfer is a
+# span; spans nest, each one recording the span that was open on its thread
+# when it started (for_each_host and the background collector carry that over
+# to their threads, see adopt). Finished spans are appended to a json-lines
+# trace in the experiment directory, one object per line:
+#
+#   run   : a new run of eval.py started (its id, start time and arguments)
+#   span  : name, id, parent id, run id, start, duration (s), plus whatever the
+#           span was given: host, command, bytes, iteration, ...
+#
+# and added up per name, for the summary table printed at the end of a run.
+# `python3 timing.py <trace>` prints that table again for the last run in a
+# trace (or for a given --run), to compare runs.
+#
+# Until a trace is opened (see open_trace), spans cost next to nothing.
+
+current = threading.local()
+active = None
+
+class Trace:
+    def __init__(self, path=None, argv=None):
+        self.path = path
+        self.run = "{:.6f}".format(time.time())
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.totals = {}
+        self.file = open(path, 'a') if path else None
+        self.write({'type': 'run', 'run': self.run, 'start': time.time(), 'argv': argv or []})
+
+    def write(self, rec):
+        if self.file is None:
+            return
+        line = json.dumps(rec) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def record(self, rec):
+        with self.lock:
+            add(self.totals, rec)
+        self.write(rec)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def add(totals, rec):
+    t = totals.setdefault(rec['name'], [0, 0.0, 0.0, 0])
+    t[0] += 1
+    t[1] += rec['duration']
+    t[2] = max(t[2], rec['duration'])
+    t[3] += rec.get('bytes', 0) or 0
+
+def summary(totals):
+    """
+    totals ({name: [count, total s, max s, bytes]}) as table rows, the
+    phases that took longest first.
+    """
+    lines = ["{:<24} {:>8} {:>10} {:>9} {:>9} {:>10}".format("phase", "count", "total (s)", "mean (s)", "max (s)", "MB")]
+    for name, (count, total, longest, nbytes) in sorted(totals.items(), key=lambda t: -t[1][1]):
+        lines.append("{:<24} {:>8} {:>10.2f} {:>9.3f} {:>9.3f} {:>10}".format(
+            name,
+            count,
+            total,
+            total / count,
+            longest,
+            "{:.1f}".format(nbytes / 1e6) if nbytes else "",
+        ))
+    return lines
+
+class Span:
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """
+        Add to what the span records, e.g. bytes once they are known.
+        """
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = getattr(current, 'stack', None)
+        if stack is None:
+            stack = current.stack = []
+        self.id = next(self.trace.ids)
+        self.parent = stack[-1] if stack else getattr(current, 'base', None)
+        stack.append(self.id)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, typ, exc, tb):
+        duration = time.time() - self.start
+        current.stack.pop()
+        rec = dict(self.attrs)
+        rec.update(type='span', name=self.name, id=self.id, parent=self.parent, run=self.trace.run, start=self.start, duration=duration)
+        if typ is not None:
+            rec['error'] = typ.__name__
+        self.trace.record(rec)
+        return False
+
+class NullSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, exc, tb):
+        return False
+
+null_span = NullSpan()
+
+def open_trace(path, argv=None):
+    """
+    Start recording spans to the trace at path (None to only keep the totals).
+    """
+    global active
+    active = Trace(path, argv)
+    return active
+
+def span(name, **attrs):
+    """
+    A context manager timing whatever runs inside it as a span called name.
+    """
+    if active is None:
+        return null_span
+    return Span(active, name, attrs)
+
+def current_span():
+    """
+    The id of the span open on this thread, to hand to adopt on another one.
+    """
+    stack = getattr(current, 'stack', None)
+    return stack[-1] if stack else getattr(current, 'base', None)
+
+def adopt(parent):
+    """
+    Make the spans this thread starts (outside of any other) children of
+    parent, a span id from current_span.
+    """
+    current.base = parent
+
+def read_summary(path, run=None):
+    """
+    The totals of one run (by default the last one) in the trace at path.
+    """
+    runs = {}
+    last = None
+    with open(path) as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get('type') == 'run':
+                last = rec['run']
+                runs.setdefault(last, {})
+            elif rec.get('type') == 'span':
+                add(runs.setdefault(rec['run'], {}), rec)
+    run = run or last
+    if run not in runs:
+        sys.exit("no run {} in {}".format(run, path))
+    return run, runs[run]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize a timing trace written by eval.py")
+    parser.add_argument("trace", help="trace.jsonl in an experiment directory")
+    parser.add_argument("--run", help="which run to summarize (by default the last one)")
+    args = parser.parse_args()
+    run, totals = read_summary(args.trace, args.run)
+    print("run {}".format(run))
+    print("\n".join(summary(totals)))
@@ -1,31 +1,41 @@
 import agenda
 import re
+from timing import span
 from util import *
 from cloudlab.cloudlab import make_cloudlab_topology
+from netns import create_netns_connections
 from traffic import *
 
 def create_ssh_connections(config):
     agenda.task("Creating SSH connections")
-    conns = {}
-    machines = {}
     args = config['args']
-    for (role, details) in [(r, d) for r, d in config['topology'].items() if r in ("sender", "inbox", "outbox", "receiver")]:
-        hostname = details['name']
-        is_self = 'self' in details and details['self']
-        if is_self:
-            agenda.subtask(hostname)
-            conns[hostname] = ConnectionWrapper('localhost', nickname=role, dry=args.dry_run, verbose=args.verbose, interact=args.interact)
+    roles = [(r, d) for r, d in config['topology'].items() if r in ("sender", "inbox", "outbox", "receiver")]
+    # the role each host's connection is made for (and nicknamed after)
+    hosts = {}
+    for (role, details) in roles:
+        if 'self' in details and details['self']:
+            hosts[details['name']] = (role, details)
+        else:
+            hosts.setdefault(details['name'], (role, details))
+
+    def connect(hostname):
+        role, details = hosts[hostname]
+        agenda.subtask(hostname)
+        if 'self' in details and details['self']:
+            return ConnectionWrapper('localhost', nickname=role, dry=args.dry_run, verbose=args.verbose, interact=args.interact, agent=args.agent)
+        user = None
+        port = None
+        if 'user' in details:
+            user = details['user']
+        if 'port' in details:
+            port = details['port']
+        return ConnectionWrapper(hostname, nickname=role, user=user, port=port, dry=args.dry_run, verbose=args.verbose, interact=args.interact, agent=args.agent)
+
+    conns = dict(zip(hosts, for_each_host(hosts, connect, host=lambda h: h, serial=args.interact)))
+    machines = dict((role, conns[details['name']]) for (role, details) in roles)
+    for hostname, (role, details) in hosts.items():
+        if 'self' in details and details['self']:
             config['self'] = conns[hostname]
-        elif not hostname in conns:
-            agenda.subtask(hostname)
-            user = None
-            port = None
-            if 'user' in details:
-                user = details['user']
-            if 'port' in details:
-                port = details['port']
-            conns[hostname] = ConnectionWrapper(hostname, nickname=role, user=user, port=port, dry=args.dry_run, verbose=args.verbose, interact=args.interact)
-        machines[role] = conns[hostname]
 
     return (conns, machines)
 
@@ -49,10 +59,10 @@ ip_addr_rgx = re.compile(r"\w+:\W*(?P<dev>\w+).*inet (?P<addr>[0-9]+\.[0-9]+\.[0
 # populate interface names and ips
 def get_interfaces(config, machines):
     agenda.section("Get node interfaces")
-    for m in machines:
+    def probe(m):
         if m == 'self' or 'ifaces' in config['topology'][m]:
             agenda.subtask(f"{machines[m].addr}: {config['topology'][m]['ifaces']}")
-            continue
+            return
         agenda.task(machines[m].addr)
         conn = machines[m]
         ifaces_raw = conn.run("ip -4 -o addr").stdout.strip().split("\n")
@@ -63,6 +73,7 @@ def get_interfaces(config, machines):
         config['topology'][m]['ifaces'] = ifaces
         agenda.subtask(f"{machines[m].addr}: {config['topology'][m]['ifaces']}")
 
+    for_each_host(machines, probe, host=lambda m: machines[m].addr, serial=interacting(machines.values()))
     return config
 
 # clone the bundler repository
@@ -71,9 +82,7 @@ def init_repo(config, machines):
     root = config['structure']['bundler_root']
     clone = f'git clone --recurse-submodules https://github.com/bundler-project/evaluation {root}'
 
-    for m in machines:
-        if m == 'self':
-            continue
+    def init(m):
         agenda.task(f"init {m}: {machines[m].addr}")
         agenda.subtask("cloning eval repo")
         if not machines[m].file_exists(root):
@@ -88,6 +97,8 @@ def init_repo(config, machines):
             #stdout=f"{config['structure']['bundler_root']}/{m}.out.mk",
             #stderr=f"{config['structure']['bundler_root']}/{m}.err.mk")
 
+    for_each_host([m for m in machines if m != 'self'], init, host=lambda m: machines[m].addr, serial=interacting(machines.values()))
+
 def bootstrap_topology(config, machines):
     config = get_interfaces(config, machines)
     init_repo(config, machines)
@@ -97,7 +108,10 @@ class MahimahiTopo:
     MahimahiConfig = namedtuple('MahimahiConfig', ['rtt', 'rate', 'ecmp', 'sfq', 'num_bdp'])
 
     def __init__(self, config):
-        conns, machines = create_ssh_connections(config)
+        if 'netns' in config['topology']:
+            conns, machines = create_netns_connections(config)
+        else:
+            conns, machines = create_ssh_connections(config)
         self.conns = conns
         self.machines = machines
         self.config = config
@@ -107,17 +121,21 @@ class MahimahiTopo:
         if self.machines is None or 'local_experiment_dir' not in config:
             raise Exception("Tried to fetch build logs without connecting")
 
-        for m in self.machines:
+        # with several testbeds, keep each one's logs apart
+        local_prefix = f"{config['testbed']}." if config.get('testbed') else ""
+        def fetch(m):
             agenda.subtask(f"fetch from {m}")
             root = config['structure']['bundler_root']
             if root.startswith("~/"):
                 root = root[2:]
             self.machines[m].get(
                 f"{root}/{m}.out.mk",
-                f"{config['local_experiment_dir']}/{m}.out.mk")
+                f"{config['local_experiment_dir']}/{local_prefix}{m}.out.mk")
             self.machines[m].get(
                 f"{root}/{m}.err.mk",
-                f"{config['local_experiment_dir']}/{m}.err.mk")
+                f"{config['local_experiment_dir']}/{local_prefix}{m}.err.mk")
+
+        for_each_host(self.machines, fetch, host=lambda m: self.machines[m].addr, serial=interacting(self.machines.values()))
 
     def setup_routing(self, config):
         """
@@ -147,52 +165,31 @@ class MahimahiTopo:
         )
 
         agenda.subtask("inbox")
-        expect(
-            machines['inbox'].run(
-                "sysctl net.ipv4.ip_forward=1",
-                sudo=True
-            ),
-            "Failed to set IP forwarding at inbox"
-        )
-        expect(
-            machines['inbox'].run(
-                "ip route del {receiver}; ip route add {receiver} dev {inbox_send_iface}".format(
-                    receiver = get_iface(config, 'receiver')['addr'],
-                    inbox_send_iface = get_iface(config, 'inbox')['dev']
-                ),
-                sudo=True
+        forward, route_fwd, route_rev = machines['inbox'].run_batch([
+            "sysctl net.ipv4.ip_forward=1",
+            "ip route del {receiver}; ip route add {receiver} dev {inbox_send_iface}".format(
+                receiver = get_iface(config, 'receiver')['addr'],
+                inbox_send_iface = get_iface(config, 'inbox')['dev']
             ),
-            "Failed to set forward route at inbox"
-        )
-        expect(
-            machines['inbox'].run(
-                "ip route del {sender}; ip route add {sender} dev {inbox_recv_iface}".format(
-                    sender = get_iface(config, 'sender')['addr'],
-                    inbox_recv_iface = get_iface(config, 'inbox')['dev']
-                ),
-                sudo=True
+            "ip route del {sender}; ip route add {sender} dev {inbox_recv_iface}".format(
+                sender = get_iface(config, 'sender')['addr'],
+                inbox_recv_iface = get_iface(config, 'inbox')['dev']
             ),
-            "Failed to set reverse route at inbox"
-        )
+        ], sudo=True)
+        expect(forward, "Failed to set IP forwarding at inbox")
+        expect(route_fwd, "Failed to set forward route at inbox")
+        expect(route_rev, "Failed to set reverse route at inbox")
 
         agenda.subtask("outbox")
-        expect(
-            machines['outbox'].run(
-                "ip route del {sender_addr}; ip route add {sender_addr} via {inbox_addr}".format(
-                    sender_addr = get_iface(config, 'sender')['addr'],
-                    inbox_addr = get_iface(config, 'inbox')['addr']
-                ), sudo=True
-            ),
-            "Failed to set routing tables at outbox"
-        )
-
-        expect(
-            machines['outbox'].run(
-                "sysctl net.ipv4.ip_forward=1",
-                sudo=True
+        route, forward = machines['outbox'].run_batch([
+            "ip route del {sender_addr}; ip route add {sender_addr} via {inbox_addr}".format(
+                sender_addr = get_iface(config, 'sender')['addr'],
+                inbox_addr = get_iface(config, 'inbox')['addr']
             ),
-            "Failed to set IP forwarding at outbox"
-        )
+            "sysctl net.ipv4.ip_forward=1",
+        ], sudo=True)
+        expect(route, "Failed to set routing tables at outbox")
+        expect(forward, "Failed to set IP forwarding at outbox")
 
     def run_traffic(self, config, exp, bundle_traffic, cross_traffic):
         machines = self.machines
@@ -204,8 +201,9 @@ class MahimahiTopo:
             ecmp=None
         )
 
-        bundle_out = list(start_multiple_server(config, machines['sender'], bundle_traffic))
-        cross_out = list(start_multiple_server(config, machines['receiver'], cross_traffic))
+        with span('start_servers'):
+            bundle_out = list(start_multiple_server(config, machines['sender'], bundle_traffic))
+            cross_out = list(start_multiple_server(config, machines['receiver'], cross_traffic))
 
         bundle_client = list(start_multiple_client(
             config,
@@ -230,13 +228,17 @@ class MahimahiTopo:
             nobundler = (exp.alg['name'] == "nobundler"),
         )
 
-    def start_inbox(self, qtype, q_buffer_size):
+    """
+    out : where the inbox logs to; by default inbox.log in the iteration
+          directory, which is then added to the iteration's outputs
+    """
+    def start_inbox(self, qtype, q_buffer_size, out=None):
         config = self.config
         inbox = self.machines['inbox']
 
         agenda.subtask("Starting inbox")
 
-        inbox_out = os.path.join(config['iteration_dir'], "inbox.log")
+        inbox_out = out or os.path.join(config['iteration_dir'], "inbox.log")
         res = inbox.run(
             "{path} --iface={iface} --port={port} --sample_rate={sample} --qtype={qtype} --buffer={buf}".format(
                 path=get_inbox_binary(config),
@@ -252,12 +254,11 @@ class MahimahiTopo:
             stderr=inbox_out,
         )
 
-        if not config['args'].dry_run:
-            time.sleep(10)
-        inbox.check_proc('inbox', inbox_out)
-        inbox.check_file('Wait for CCP to install datapath program', inbox_out)
+        inbox.check_proc('inbox', inbox_out, timeout=startup_timeout)
+        inbox.check_file('Wait for CCP to install datapath program', inbox_out, timeout=startup_timeout)
 
-        config['iteration_outputs'].append((inbox, inbox_out))
+        if out is None:
+            config['iteration_outputs'].append((inbox, inbox_out))
         return inbox_out
 
     def start_outbox(self, config):
@@ -388,13 +389,14 @@ done
         outbox.run('chmod +x {}'.format(mm_outer_path))
         
         agenda.subtask("Starting traffic in emulation env ({})".format(emulation_env))
-        expect(
-            outbox.run(
-                mm_outer_path,
-                wd=config['iteration_dir'],
-            ),
-            "Failed to start mahimahi shell on receiver"
-        )
+        with span('mahimahi', rate=emulation_env.rate, rtt=emulation_env.rtt, paths=n_paths):
+            expect(
+                outbox.run(
+                    mm_outer_path,
+                    wd=config['iteration_dir'],
+                ),
+                "Failed to start mahimahi shell on receiver"
+            )
 
         for j in range(n_paths):
             config['iteration_outputs'] += [
@@ -1,8 +1,6 @@
-import sys
 import agenda
 from collections import namedtuple
 import os
-import time
 import io
 
 from util import *
@@ -76,10 +74,7 @@ class IperfTraffic(Traffic):
             "Failed to start iperf server on {}".format(node.addr)
         )
 
-        if not config['args'].dry_run:
-            time.sleep(1)
-
-        node.check_file('Server listening on TCP port', iperf_out)
+        node.check_ports([self.port], iperf_out, timeout=startup_timeout)
         config['iteration_outputs'].append((node, iperf_out))
         return iperf_out
 
@@ -156,12 +151,9 @@ class CBRTraffic(Traffic):
             "Failed to start iperf server on {}".format(node.addr)
         )
 
-        if not config['args'].dry_run:
-            time.sleep(2)
-
-        node.check_file('Server listening on TCP port', iperf_out)
-        node.check_proc("ccp_const", ccp_out)
-        node.check_file('starting CCP', ccp_out)
+        node.check_ports([self.port], iperf_out, timeout=startup_timeout)
+        node.check_proc("ccp_const", ccp_out, timeout=startup_timeout)
+        node.check_file('starting CCP', ccp_out, timeout=startup_timeout)
         config['iteration_outputs'].append((node, iperf_out))
         config['iteration_outputs'].append((node, ccp_out))
         return iperf_out
@@ -258,17 +250,8 @@ class PoissonTraffic(Traffic):
             "Failed to start poisson servers on {}".format(node.addr)
         )
 
-        if not config['args'].dry_run:
-            time.sleep(1)
-            num_servers_running = int(node.run("pgrep -c etgServer").stdout.strip())
-        else:
-            num_servers_running = self.num_conns
-        if num_servers_running != self.num_conns:
-            fatal_warn("self pattern requested {} servers, but only {} are running properly.".format(self.num_conns, num_servers_running), exit=False)
-            with io.BytesIO() as f:
-                node.get(node.local_path(etg_out), local=f)
-                print(f.getvalue().decode("utf-8"))
-            sys.exit(1)
+        ports = range(int(self.start_port), int(self.start_port) + int(self.num_conns))
+        node.check_ports(ports, etg_out, timeout=startup_timeout)
 
         config['iteration_outputs'].append((node, etg_out))
         return etg_out
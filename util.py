@@ -2,7 +2,15 @@ import sys
 import agenda
 from fabric import Connection, Result
 from termcolor import colored
+from host_agent import Agent, AgentError
+from timing import adopt, current_span, span
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import io
 import os
+import re
+import threading
+import time
 
 ###################################################################################################
 # Helpers
@@ -12,8 +20,22 @@ class FakeResult(object):
         self.exited = 0
         self.stdout = '(dryrun)'
 
+class BatchResult(object):
+    def __init__(self, command, exited, stdout='', stderr=''):
+        self.command = command
+        self.exited = exited
+        self.stdout = stdout
+        self.stderr = stderr
+
 class ConnectionWrapper(Connection):
-    def __init__(self, addr, nickname, user=None, port=None, verbose=True, dry=False, interact=False):
+    """
+    agent : if true, start a host_agent on the machine and send commands, process
+            checks and downloads through it rather than opening an ssh exec
+            channel for each, and start background commands with it rather
+            than in screen. If the agent can't be started (or dies, or hangs),
+            everything goes back to plain ssh.
+    """
+    def __init__(self, addr, nickname, user=None, port=None, verbose=True, dry=False, interact=False, agent=False):
         super().__init__(
             addr,
             forward_agent=True,
@@ -29,13 +51,81 @@ class ConnectionWrapper(Connection):
         # Start the ssh connection
         super().open()
 
+        self.agent = None
+        # pid: command, of the background commands the agent started
+        self.spawned = {}
+        if agent and not dry:
+            self.start_agent()
+
+    def start_agent(self):
+        try:
+            self.agent = Agent.start(self.client)
+        except Exception as e:
+            warn("Could not start agent on {}, falling back to ssh: {}".format(self.addr, e), exit=False)
+
+    def agent_failed(self, e):
+        warn("Lost agent on {}, falling back to ssh: {}".format(self.addr, e), exit=False)
+        self.agent = None
+
+    def remote_exec(self, full_cmd, *args, hide=False, pty=True, **kwargs):
+        if self.agent is not None and not args and not kwargs:
+            try:
+                r = self.agent.run(full_cmd)
+            except AgentError as e:
+                self.agent_failed(e)
+            else:
+                if not hide:
+                    sys.stdout.write(r['stdout'])
+                    sys.stderr.write(r['stderr'])
+                return BatchResult(full_cmd, r['exited'], r['stdout'], r['stderr'])
+        return super().run(full_cmd, *args, hide=hide, warn=True, pty=pty, **kwargs)
+
+    def spawn(self, full_cmd):
+        """
+        Start full_cmd in the background through the agent, keeping its pid.
+        None if the agent has failed.
+        """
+        try:
+            pid = self.agent.spawn(full_cmd)
+        except AgentError as e:
+            self.agent_failed(e)
+            return None
+        self.spawned[pid] = full_cmd
+        return BatchResult(full_cmd, 0)
+
+    def poll_spawned(self):
+        """
+        Agent.poll of the background commands the agent started, forgetting
+        those that are gone, along with everything they started.
+        """
+        if self.agent is None or not self.spawned:
+            return {}
+        try:
+            status = self.agent.poll(list(self.spawned.copy()))
+        except AgentError as e:
+            self.agent_failed(e)
+            return {}
+        for pid, (running, _, procs) in status.items():
+            if not running and not procs:
+                self.spawned.pop(pid, None)
+        return status
+
+    def spawned_exited(self, proc_name):
+        """
+        Whether the agent started commands mentioning proc_name, and they have
+        all exited.
+        """
+        pids = [pid for pid, cmd in self.spawned.copy().items() if proc_name in cmd]
+        return bool(pids) and not any(running for running, _, _ in self.agent.poll(pids).values())
+
     """
     Run a command on the remote machine
 
     verbose    : if true, print the command before running it, and any output it produces
                  (if not redirected)
                  if false, capture anything produced in stdout and save in result (res.stdout)
-    background : if true, start the process in the background via nohup.
+    background : if true, start the process in the background: through the agent if there
+                 is one (which keeps its pid, see check_proc), else in a detached screen.
                  if output is not directed to a file or pty=True, this won't work
     stdin      : string of filename for stdin (default /dev/stdin as expected)
     stdout     : ""
@@ -51,13 +141,12 @@ class ConnectionWrapper(Connection):
     """
     def run(self, cmd, *args, stdin="/dev/stdin", stdout="/dev/stdout", stderr="/dev/stderr", ignore_out=False, wd=None, sudo=False, background=False, pty=True, **kwargs):
         # Prepare command string
-        pre = ""
+        cd = ""
         if wd:
-            pre += "cd {} && ".format(wd)
-        if background:
-            pre += "screen -d -m "
+            cd = "cd {} && ".format(wd)
         #escape the strings
         cmd = cmd.replace("\"", "\\\"")
+        pre = ""
         if sudo:
             pre += "sudo "
         pre += "bash -c \""
@@ -76,6 +165,12 @@ class ConnectionWrapper(Connection):
         )
 
         full_cmd += "\""
+        # without the agent to start it, a background command runs in a
+        # detached screen
+        screen = cd + "screen -d -m " + full_cmd
+        full_cmd = cd + full_cmd
+        if background and self.agent is None:
+            full_cmd = screen
 
         # Prepare arguments for invoke/fabric
         if background:
@@ -90,10 +185,87 @@ class ConnectionWrapper(Connection):
             input("")
 
         if not self.dry:
-            return super().run(full_cmd, *args, hide=(not self.verbose), warn=True, pty=pty, **kwargs)
+            with span('cmd', host=self.addr, command=full_cmd) as s:
+                res = None
+                if background and self.agent is not None:
+                    res = self.spawn(full_cmd)
+                    if res is None:
+                        full_cmd = screen
+                if res is None:
+                    res = self.remote_exec(full_cmd, *args, hide=(not self.verbose), pty=pty, **kwargs)
+                s.set(exited=res.exited, bytes=len(res.stdout or '') + len(res.stderr or ''))
+                return res
         else:
             return FakeResult()
 
+    """
+    Run several commands on the remote machine in one go: they are put in a
+    single script, which is sent over one exec instead of a round trip per
+    command. The commands run in order, each in its own subshell with stdin
+    from /dev/null, whether or not the ones before them succeeded.
+
+    sudo : if true, run the whole script with sudo
+    wd   : cd into this directory before running any of the commands
+
+    returns a result struct (see run) for each command, in order
+    """
+    def run_batch(self, cmds, sudo=False, wd=None):
+        cmds = list(cmds)
+        if not cmds:
+            return []
+
+        if self.dry or self.verbose:
+            for cmd in cmds:
+                print("[{}] (batch){}{}".format(
+                    self.nickname.ljust(10),
+                    " (sudo) " if sudo else " ",
+                    cmd,
+                ))
+
+        if self.interact:
+            input("")
+
+        if self.dry:
+            return [FakeResult() for _ in cmds]
+
+        # each command's output goes to a scratch file, and is sent back as
+        # one "<index> <exit code> <base64 stdout> <base64 stderr>" line
+        script = ['d=$(mktemp -d) || exit 1', 'trap \'rm -rf "$d"\' EXIT']
+        if wd:
+            script.append("cd {} || exit 1".format(wd))
+        for i, cmd in enumerate(cmds):
+            script.append('(\n{}\n) > "$d/out" 2> "$d/err" < /dev/null'.format(cmd))
+            script.append('echo "{} $? $(base64 -w0 < "$d/out") $(base64 -w0 < "$d/err")"'.format(i))
+        encoded = base64.b64encode("\n".join(script).encode()).decode()
+        with span('batch', host=self.addr, commands=cmds) as s:
+            res = self.remote_exec(
+                "echo {} | base64 -d | {}bash".format(encoded, "sudo " if sudo else ""),
+                hide=True,
+                pty=False,
+            )
+            s.set(exited=res.exited, bytes=len(res.stdout or '') + len(res.stderr or ''))
+
+        results = [None] * len(cmds)
+        for line in res.stdout.splitlines():
+            sp = line.split(" ")
+            if len(sp) != 4 or not sp[0].isdigit() or int(sp[0]) >= len(cmds):
+                continue
+            i = int(sp[0])
+            results[i] = BatchResult(
+                cmds[i],
+                int(sp[1]),
+                base64.b64decode(sp[2]).decode(errors='replace'),
+                base64.b64decode(sp[3]).decode(errors='replace'),
+            )
+        for i, cmd in enumerate(cmds):
+            if results[i] is None:
+                # the script died before getting to this command
+                results[i] = BatchResult(cmd, res.exited or 1, '', res.stderr)
+            elif self.verbose:
+                sys.stdout.write(results[i].stdout)
+                sys.stderr.write(results[i].stderr)
+        return results
+
     def file_exists(self, fname):
         res = self.run("ls {}".format(fname))
         return res.exited == 0
@@ -102,9 +274,54 @@ class ConnectionWrapper(Connection):
         res = self.run("which {}".format(prog))
         return res.exited == 0
 
-    def check_proc(self, proc_name, proc_out):
-        res = self.run("pgrep {}".format(proc_name))
-        if res.exited != 0:
+    def wait_for_file(self, grep, where, timeout):
+        with span('wait_file', host=self.addr, file=where, text=grep):
+            if self.agent is not None and not self.interact:
+                if self.verbose:
+                    print("[{}] (agent) wait for \"{}\" in {}".format(self.nickname.ljust(10), grep, where))
+                try:
+                    # the agent watches the file itself, so this is one round trip
+                    return self.agent.wait_file(where, grep, timeout)
+                except AgentError as e:
+                    self.agent_failed(e)
+            return wait_until(lambda: self.run("grep -q \"{}\" {}".format(grep, where)).exited == 0, timeout)
+
+    def wait_for_proc(self, proc_name, timeout):
+        with span('wait_proc', host=self.addr, proc=proc_name):
+            if self.agent is not None and not self.interact:
+                if self.verbose:
+                    print("[{}] (agent) wait for process {}".format(self.nickname.ljust(10), proc_name))
+                try:
+                    deadline = time.time() + timeout
+                    while True:
+                        # a second at a time, so that waiting stops once the
+                        # command started for proc_name has died
+                        if self.agent.wait_proc(proc_name, max(0, min(1, deadline - time.time()))):
+                            return True
+                        if time.time() >= deadline or self.spawned_exited(proc_name):
+                            return len(self.agent.wait_proc(proc_name)) > 0
+                except AgentError as e:
+                    self.agent_failed(e)
+            return wait_until(lambda: self.run("pgrep {}".format(proc_name)).exited == 0, timeout)
+
+    def wait_for_ports(self, ports, timeout):
+        ports = set(str(p) for p in ports)
+        if self.dry:
+            return True
+        def listening():
+            res = self.run("ss -Hltn")
+            # local address:port is the 4th column
+            bound = set(l.split()[3].rsplit(':', 1)[-1] for l in res.stdout.splitlines() if len(l.split()) > 3)
+            return ports <= bound
+        with span('wait_ports', host=self.addr, ports=len(ports)):
+            return wait_until(listening, timeout)
+
+    # check_proc, check_ports and check_file exit if the process isn't running,
+    # nothing is listening on the ports or the string isn't in the file; with a
+    # timeout, they keep checking until it is, for up to that many seconds
+    # (check_proc stops early if the agent started the process and it died).
+    def check_proc(self, proc_name, proc_out, timeout=0):
+        if not self.wait_for_proc(proc_name, timeout):
             fatal_warn('failed to find running process with name \"{}\" on {}'.format(proc_name, self.addr), exit=False)
             res = self.run('tail {}'.format(proc_out))
             if not self.verbose and res.exited == 0:
@@ -113,9 +330,17 @@ class ConnectionWrapper(Connection):
             sys.exit(1)
 
 
-    def check_file(self, grep, where):
-        res = self.run("grep \"{}\" {}".format(grep, where))
-        if res.exited != 0:
+    def check_ports(self, ports, proc_out, timeout=0):
+        if not self.wait_for_ports(ports, timeout):
+            fatal_warn('nothing listening on TCP port(s) {} on {}'.format(", ".join(str(p) for p in ports), self.addr), exit=False)
+            res = self.run('tail {}'.format(proc_out))
+            if not self.verbose and res.exited == 0:
+                print(res.command)
+                print(res.stdout)
+            sys.exit(1)
+
+    def check_file(self, grep, where, timeout=0):
+        if not self.wait_for_file(grep, where, timeout):
             fatal_warn("Unable to find search string (\"{}\") in process output file {}".format(
                 grep,
                 where
@@ -145,7 +370,10 @@ class ConnectionWrapper(Connection):
             input("")
 
         if not self.dry:
-            return super().put(local_file, remote, preserve_mode)
+            with span('put', host=self.addr, file=remote) as s:
+                if isinstance(local_file, str):
+                    s.set(bytes=os.path.getsize(local_file))
+                return super().put(local_file, remote, preserve_mode)
         else:
             return FakeResult()
 
@@ -161,39 +389,200 @@ class ConnectionWrapper(Connection):
         if self.interact:
             input("")
 
-        if not self.dry:
+        if self.dry:
+            return FakeResult()
+        with span('get', host=self.addr, file=remote_file):
+            if self.agent is not None and local is not None:
+                try:
+                    return self.agent_get(remote_file, local, preserve_mode)
+                except AgentError as e:
+                    self.agent_failed(e)
             return super().get(remote_file, local=local, preserve_mode=preserve_mode)
-        else:
+
+    def agent_get(self, remote_file, local, preserve_mode):
+        if not isinstance(local, str):
+            self.agent.read(remote_file, local)
             return FakeResult()
+        if os.path.isdir(local):
+            local = os.path.join(local, os.path.basename(remote_file))
+        tmp = local + ".tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                self.agent.read(remote_file, f)
+        except AgentError:
+            os.remove(tmp)
+            raise
+        os.replace(tmp, local)
+        if preserve_mode:
+            r = self.agent.run("stat -c %a {}".format(remote_file))
+            if r['exited'] == 0:
+                os.chmod(local, int(r['stdout'].strip(), 8))
+        return FakeResult()
+
+    def close(self):
+        if getattr(self, 'agent', None) is not None:
+            self.agent.close()
+            self.agent = None
+        super().close()
+
+# how long to wait for an experiment process to come up before giving up on it
+startup_timeout = 30
+
+def wait_until(ready, timeout, interval=0.05, max_interval=1.0):
+    """
+    Call ready() until it returns true or timeout seconds have passed, backing
+    off exponentially between tries. ready() is always called at least once.
+    Returns whether it became ready.
+    """
+    deadline = time.time() + timeout
+    while True:
+        if ready():
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+# what the current thread's output should go through; see ThreadOutput
+thread_output = threading.local()
+
+class ThreadOutput(object):
+    """
+    Stands in for sys.stdout/sys.stderr once capture_thread_output has been
+    called. A thread that set thread_output.buf has what it prints held there;
+    one that set thread_output.prefix has it printed a whole line at a time,
+    each line prefixed; everything else passes straight through.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, real):
+        self.real = real
+        self.partial = {}
+
+    def write(self, s):
+        buf = getattr(thread_output, 'buf', None)
+        if buf is not None:
+            return buf.write(s)
+        prefix = getattr(thread_output, 'prefix', None)
+        if prefix is None:
+            return self.real.write(s)
+        me = threading.get_ident()
+        lines = (self.partial.pop(me, "") + s).split("\n")
+        if lines[-1]:
+            self.partial[me] = lines[-1]
+        with self.lock:
+            self.real.write("".join(prefix + l + "\n" for l in lines[:-1]))
+        return len(s)
+
+    def flush(self):
+        if getattr(thread_output, 'buf', None) is None:
+            self.real.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+def capture_thread_output():
+    if not isinstance(sys.stdout, ThreadOutput):
+        sys.stdout = ThreadOutput(sys.stdout)
+    if not isinstance(sys.stderr, ThreadOutput):
+        sys.stderr = ThreadOutput(sys.stderr)
+
+def for_each_host(items, fn, host=lambda conn: conn.addr, serial=False):
+    """
+    Call fn(item) for every item, running the items of different hosts (as
+    given by host(item)) at the same time, each host on its own thread, and
+    those of the same host one after another. Whatever fn prints is held back
+    and printed in the order of items, each line prefixed with its host, as
+    soon as the items before it are done; so the output reads the same as a
+    loop over items, while the whole thing takes as long as the slowest host.
+
+    serial : just loop over items (interactive mode waits for a key press
+             before each command, so commands can't be interleaved)
+
+    Returns fn's results in the order of items. If any fn raised (or exited),
+    that is re-raised once everything has finished.
+    """
+    items = list(items)
+    groups = {}
+    for i, item in enumerate(items):
+        groups.setdefault(host(item), []).append(i)
+    if serial or len(groups) <= 1:
+        return [fn(item) for item in items]
+
+    done = [threading.Event() for _ in items]
+    bufs = [io.StringIO() for _ in items]
+    results = [None] * len(items)
+    errors = [None] * len(items)
+
+    parent = current_span()
+    def run_host(idxs):
+        adopt(parent)
+        for i in idxs:
+            thread_output.buf = bufs[i]
+            try:
+                results[i] = fn(items[i])
+            except BaseException as e:
+                errors[i] = e
+            finally:
+                thread_output.buf = None
+                done[i].set()
+
+    capture_thread_output()
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        for idxs in groups.values():
+            pool.submit(run_host, idxs)
+        for i, item in enumerate(items):
+            done[i].wait()
+            prefix = "[{}] ".format(host(item))
+            sys.stdout.write("".join(prefix + line for line in bufs[i].getvalue().splitlines(keepends=True)))
+            sys.stdout.flush()
+
+    for e in errors:
+        if e is not None:
+            raise e
+    return results
+
+def interacting(conns):
+    return any(conn.interact for conn in conns)
+
+def experiment_hosts(machines):
+    return [(m, machines[m]) for m in machines if m in ("sender", "inbox", "outbox", "receiver")]
 
 def update_sysctl(machines, config):
     if 'sysctl' in config:
         agenda.task("Updating sysctl")
 
-        for (name, conn) in set((m, machines[m]) for m in machines if m in ("sender", "inbox", "outbox", "receiver")):
+        def update(host):
+            name, conn = host
             agenda.subtask(f"{name}")
 
-            for k in config['sysctl']:
-                v = config['sysctl'][k]
-                expect(
-                    conn.run(f"sysctl -w {k}=\"{v}\"", sudo=True),
-                    f"Failed to set {k} on {conn.addr}"
-                )
+            keys = list(config['sysctl'])
+            results = conn.run_batch(
+                [f"sysctl -w {k}=\"{config['sysctl'][k]}\"" for k in keys],
+                sudo=True
+            )
+            for k, res in zip(keys, results):
+                expect(res, f"Failed to set {k} on {conn.addr}")
+
+        for_each_host(experiment_hosts(machines), update, host=lambda h: h[1].addr, serial=interacting(machines.values()))
 
 def disable_tcp_offloads(config, machines):
     agenda.task("Turn off TSO, GSO, and GRO")
-    for (name, conn) in set((m, machines[m]) for m in machines if m in ("sender", "inbox", "outbox", "receiver")):
+    def disable(host):
+        name, conn = host
         agenda.subtask(name)
-        for iface in config['topology'][name]['ifaces']:
-            expect(
-                conn.run(
-                    "ethtool -K {} tso off gso off gro off".format(
-                        iface['dev']
-                    ),
-                    sudo=True
-                ),
-                "Failed to turn off optimizations"
-            )
+        results = conn.run_batch(
+            [
+                "ethtool -K {} tso off gso off gro off".format(iface['dev'])
+                for iface in config['topology'][name]['ifaces']
+            ],
+            sudo=True
+        )
+        for res in results:
+            expect(res, "Failed to turn off optimizations")
+
+    for_each_host(experiment_hosts(machines), disable, host=lambda h: h[1].addr, serial=interacting(machines.values()))
 
 def start_tcpprobe(config, sender):
     if config['args'].verbose:
@@ -234,27 +623,33 @@ def start_tcpdump(config, machines):
 
     return config
 
-def kill_leftover_procs(config, machines, verbose=False):
+def kill_leftover_procs(config, machines, verbose=False, keep=()):
+    """
+    keep : names of experiment processes to leave running
+    """
     agenda.subtask("Kill leftover experiment processes")
-    for (_name, conn) in set((m, machines[m]) for m in machines if m in ("sender", "inbox", "outbox", "receiver")):
-        proc_regex = "|".join(["inbox", "outbox", *config['ccp'].keys(), "iperf", "tcpdump", "etgClient", "etgServer", "ccp_const"])
-        conn.run(
-            "pkill -9 \"({search})\"".format(
-                search=proc_regex
-            ),
-            sudo=True
-        )
-        res = conn.run(
-            "pgrep -c \"({search})\"".format(
-                search=proc_regex
-            ),
-            sudo=True
-        )
+    procs = ["inbox", "outbox", *config['ccp'].keys(), "iperf", "tcpdump", "etgClient", "etgServer", "ccp_const"]
+    proc_regex = "|".join(p for p in procs if p not in keep)
+    def kill(host):
+        _name, conn = host
+        cmds = [
+            "pkill -9 \"({search})\"".format(search=proc_regex),
+            "pgrep -c \"({search})\"".format(search=proc_regex),
+        ]
+        # what the agent started is killed by pid, anything else (started
+        # over plain ssh, or by an earlier run) by name
+        pids = sorted(pid for _, _, procs in conn.poll_spawned().values() for pid, name in procs.items() if re.search(proc_regex, name))
+        if pids:
+            cmds.insert(0, "kill -9 {}".format(" ".join(str(pid) for pid in pids)))
+        *_, res = conn.run_batch(cmds, sudo=True)
         if not res.exited and not config['args'].dry_run:
             fatal_warn("Failed to kill all procs on {}.".format(conn.addr))
+        return res
+
+    results = for_each_host(experiment_hosts(machines), kill, host=lambda h: h[1].addr, serial=interacting(machines.values()))
 
     # True = some processes remain, therefore there *are* zombies, so we return false
-    return (not res.exited)
+    return any(not res.exited for res in results)
 
 def expect(res, msg):
     if res and res.exited: